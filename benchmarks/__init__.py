@@ -0,0 +1,6 @@
+"""
+Micro benchmarks for the crawl projects.
+
+Run from the repository root, e.g. `python -m benchmarks.items_memory`.
+
+"""
@@ -0,0 +1,86 @@
+"""
+Memory benchmark of the duplicate filter fingerprint stores.
+
+Adds the fingerprints of N distinct requests to the set of hex strings kept by scrapy's
+RFPDupeFilter, to the FingerprintTable of CompactDupeFilter and to the ScalableBloomFilter
+of BloomDupeFilter, and reports the bytes kept per request, the lookup rate and, for the
+lossy stores, how many of N other requests are wrongly reported as seen.
+
+Usage:
+    python -m benchmarks.dupefilter_memory --requests 300000 --error-rate 1e-6
+
+"""
+
+import argparse
+import gc
+import hashlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlkit.dupefilters import FingerprintTable, ScalableBloomFilter  # noqa: E402
+
+
+def fingerprints(start, count):
+    # request fingerprints are SHA1 digests
+    return [hashlib.sha1(b'https://www.thesting.com/nl-nl/p/%d.html' % n).digest() for n in range(start, start + count)]
+
+
+def measure(name, make, add, count):
+    added = fingerprints(0, count)
+    others = fingerprints(count, count)
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    store = make()
+    for fp in added:
+        add(store, fp)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    false_positives = sum(1 for fp in others if add(store, fp) is False)
+    elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'bytes_per_request': (after - before) / count,
+        'requests_per_sec': count / elapsed,
+        'false_positives': false_positives,
+    }
+
+
+def add_hex(store, fp):
+    # RFPDupeFilter.request_seen
+    fp = fp.hex()
+    if fp in store:
+        return False
+    store.add(fp)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300000)
+    parser.add_argument('--error-rate', type=float, default=1e-6, help='for the Bloom filter')
+    parser.add_argument('--capacity', type=int, default=65536, help='initial table/filter capacity')
+    args = parser.parse_args(argv)
+
+    variants = (
+        ('set of hex str (RFPDupeFilter)', set, add_hex),
+        ('FingerprintTable, 8 bytes', lambda: FingerprintTable(8, args.capacity), FingerprintTable.add),
+        ('FingerprintTable, 16 bytes', lambda: FingerprintTable(16, args.capacity), FingerprintTable.add),
+        ('ScalableBloomFilter, %g' % args.error_rate,
+         lambda: ScalableBloomFilter(args.error_rate, args.capacity), ScalableBloomFilter.add),
+    )
+    print('%-32s %15s %14s %16s' % ('store', 'bytes/request', 'requests/s', 'false positives'))
+    for name, make, add in variants:
+        result = measure(name, make, add, args.requests)
+        print('%-32s %15.1f %14.0f %16d' % (name, result['bytes_per_request'], result['requests_per_sec'],
+                                            result['false_positives']))
+
+
+if __name__ == '__main__':
+    main()
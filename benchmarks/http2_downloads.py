@@ -0,0 +1,175 @@
+"""
+Throughput benchmark of HTTP/2 downloads for small JSON endpoints.
+
+Serves a changeItemInfo-like JSON endpoint over TLS from a local twisted server (in its own process,
+speaking HTTP/2 and HTTP/1.1 through ALPN, answering after --latency ms), crawls N distinct URLs of it
+with the default HTTP/1.1 handler and with DomainsDownloadHandler (HTTP2_ENABLED), and reports the
+requests per second and the TCP connections the server accepted for each run.
+
+Needs the h2 and priority packages (pip install h2 priority).
+
+Usage:
+    python -m benchmarks.http2_downloads --requests 2000 --concurrency 64 --latency 20
+
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'the_sting'))
+
+
+def make_certificate(directory):
+    # self-signed certificate for localhost
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+                   .add_extension(x509.SubjectAlternativeName([x509.DNSName('localhost')]), critical=False)
+                   .sign(key, hashes.SHA256()))
+    key_path, cert_path = os.path.join(directory, 'key.pem'), os.path.join(directory, 'cert.pem')
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+
+def serve(port, key_path, cert_path, latency, connections, ready):
+    # Runs in the server process
+    from OpenSSL import crypto
+    from twisted.internet import reactor, ssl
+    from twisted.web import resource, server
+
+    class ItemInfo(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            code = request.args.get(b'slitmCd', [b''])[0].decode()
+            body = ('{"slitmCd": "%s", "colorName": "black", "price": 59000, "sizes": '
+                    '[{"name": "S", "stock": 3}, {"name": "M", "stock": 0}]}' % code).encode()
+            request.setHeader(b'content-type', b'application/json')
+            reactor.callLater(latency, self.finish, request, body)
+            return server.NOT_DONE_YET
+
+        def finish(self, request, body):
+            request.write(body)
+            request.finish()
+
+    class CountingSite(server.Site):
+        def buildProtocol(self, addr):
+            with connections.get_lock():
+                connections.value += 1
+            return super().buildProtocol(addr)
+
+    with open(key_path, 'rb') as f:
+        key = crypto.load_privatekey(crypto.FILETYPE_PEM, f.read())
+    with open(cert_path, 'rb') as f:
+        certificate = crypto.load_certificate(crypto.FILETYPE_PEM, f.read())
+    options = ssl.CertificateOptions(privateKey=key, certificate=certificate,
+                                     acceptableProtocols=[b'h2', b'http/1.1'])
+    site = CountingSite(ItemInfo())
+    site.displayTracebacks = False
+    reactor.listenSSL(port, site, options, interface='127.0.0.1')
+    reactor.callWhenRunning(ready.set)
+    reactor.run()
+
+
+def crawl(args, port, connections):
+    import scrapy
+    from scrapy.crawler import CrawlerRunner
+    from twisted.internet import defer, reactor
+
+    class ItemInfoSpider(scrapy.Spider):
+        name = 'item_info'
+
+        def start_requests(self):
+            for n in range(self.requests):
+                yield scrapy.Request('https://localhost:%d/pda/changeItemInfo.html?slitmCd=%d&sectId=1' % (port, n),
+                                     dont_filter=True)
+
+        def parse(self, response):
+            self.protocols.add(response.protocol)
+
+    settings = {
+        'LOG_LEVEL': 'WARNING',
+        'ROBOTSTXT_OBEY': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'DOWNLOAD_HANDLERS': {'https': 'the_sting.http2.DomainsDownloadHandler'},
+        'HTTP2_DOMAINS': ['localhost'],
+        'HTTP2_MAX_CONNECTIONS_PER_HOST': args.connections,
+        'HTTP2_MAX_CONCURRENT_STREAMS': args.streams,
+    }
+    results = []
+
+    @defer.inlineCallbacks
+    def run():
+        for name, http2 in (('HTTP/1.1 (default handler)', False), ('HTTP/2 (DomainsDownloadHandler)', True)):
+            runner = CrawlerRunner(dict(settings, HTTP2_ENABLED=http2))
+            crawler = runner.create_crawler(ItemInfoSpider)
+            ItemInfoSpider.protocols = set()
+            before = connections.value
+            started = time.perf_counter()
+            yield runner.crawl(crawler, requests=args.requests)
+            elapsed = time.perf_counter() - started
+            stats = crawler.stats.get_stats()
+            results.append({
+                'name': name,
+                'responses': stats.get('response_received_count', 0),
+                'requests_per_sec': stats.get('response_received_count', 0) / elapsed,
+                'connections': connections.value - before,
+                'protocols': ', '.join(sorted(p for p in ItemInfoSpider.protocols if p)),
+            })
+        reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64, help='requests in flight (CONCURRENT_REQUESTS)')
+    parser.add_argument('--latency', type=float, default=20, help='server time per response, in ms')
+    parser.add_argument('--connections', type=int, default=1, help='HTTP2_MAX_CONNECTIONS_PER_HOST')
+    parser.add_argument('--streams', type=int, default=100, help='HTTP2_MAX_CONCURRENT_STREAMS')
+    parser.add_argument('--port', type=int, default=8743)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        key_path, cert_path = make_certificate(directory)
+        connections = multiprocessing.Value('i', 0)
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, daemon=True, args=(
+            args.port, key_path, cert_path, args.latency / 1000, connections, ready))
+        server.start()
+        try:
+            ready.wait(10)
+            results = crawl(args, args.port, connections)
+        finally:
+            server.terminate()
+
+    print('%-34s %10s %14s %12s  %s' % ('handler', 'responses', 'requests/s', 'connections', 'protocol'))
+    for result in results:
+        print('%-34s %10d %14.0f %12d  %s' % (result['name'], result['responses'], result['requests_per_sec'],
+                                              result['connections'], result['protocols']))
+
+
+if __name__ == '__main__':
+    main()
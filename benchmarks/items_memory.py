@@ -0,0 +1,98 @@
+"""
+Memory and allocation benchmark of the item classes.
+
+Builds the same products with ProductItem/SizeItem (dict-backed scrapy.Items) and with
+CompactProductItem/CompactSizeItem (slotted attrs items) and reports the bytes kept per
+product, the allocated blocks per product and the build rate.
+
+Usage:
+    python -m benchmarks.items_memory --products 20000 --sizes 5
+
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlkit.items import CompactProductItem, CompactSizeItem, ProductItem, SizeItem  # noqa: E402
+
+# distinct string objects per product, as they come out of the selectors
+FIELDS = {
+    'url': 'https://www.thesting.com/nl-nl/p/relaxed-jeans-%d.html',
+    'country_code': 'nl',
+    'language_code': 'nl',
+    'currency': 'EUR',
+    'title': 'Relaxed cropped jeans %d',
+    'brand': 'Only',
+    'description_text': 'Description\ndenim oversized wool knit slim basic %d',
+    'color_name': 'Blauw',
+    'old_price_text': '€ 39,99',
+    'new_price_text': '€ 29,99',
+}
+
+
+def build(product_class, size_class, count, sizes):
+    products = []
+    for n in range(count):
+        product = product_class()
+        for field, value in FIELDS.items():
+            product[field] = value % n if '%d' in value else value
+        product['category_names'] = ['Women', 'Clothing', 'New In', 'Jeans']
+        product['image_urls'] = ['https://images.thesting.com/product/%d_%d.jpg' % (n, i) for i in range(4)]
+        size_infos = []
+        for i in range(sizes):
+            size = size_class()
+            size['size_name'] = 'S%d' % i
+            size['stock'] = i % 2
+            size_infos.append(size)
+        product['size_infos'] = size_infos
+        product['use_size_level_prices'] = False
+        products.append(product)
+    return products
+
+
+def measure(product_class, size_class, count, sizes):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    products = build(product_class, size_class, count, sizes)
+    after, _ = tracemalloc.get_traced_memory()
+    blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    del products
+
+    started = time.perf_counter()
+    build(product_class, size_class, count, sizes)
+    elapsed = time.perf_counter() - started
+    return {
+        'bytes_per_item': (after - before) / count,
+        'blocks_per_item': (blocks_after - blocks_before) / count,
+        'items_per_sec': count / elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--sizes', type=int, default=5, help='SizeItems per product')
+    args = parser.parse_args(argv)
+
+    print('%-28s %15s %16s %14s' % ('classes', 'bytes/product', 'blocks/product', 'products/s'))
+    results = {}
+    for name, classes in (('ProductItem/SizeItem', (ProductItem, SizeItem)),
+                          ('CompactProductItem/SizeItem', (CompactProductItem, CompactSizeItem))):
+        results[name] = result = measure(classes[0], classes[1], args.products, args.sizes)
+        print('%-28s %15.0f %16.1f %14.0f' % (name, result['bytes_per_item'], result['blocks_per_item'],
+                                             result['items_per_sec']))
+    dict_based, compact = results.values()
+    print('compact items keep %.0f%% of the memory' % (100.0 * compact['bytes_per_item'] / dict_based['bytes_per_item']))
+
+
+if __name__ == '__main__':
+    main()
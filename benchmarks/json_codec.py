@@ -0,0 +1,90 @@
+"""
+CPU benchmark of the JSON work done per item.
+
+Replays the JSON calls a product goes through (the Arket and Marc Jacobs detail payloads,
+Mohagni's ld+json description and the SqlitePipeline column encoding) on payloads from the
+synthetic sites, once the way the code did it with the stdlib json module and once through
+`codec` with every available backend, and reports the microseconds per item.
+
+Usage:
+    python -m benchmarks.json_codec --products 2000 --repeat 5
+
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'the_sting'))
+
+from loadtest.sites import ArketSite, MarcJacobsSite, MohagniSite  # noqa: E402
+from the_sting import codec  # noqa: E402
+
+LD_JSON = re.compile(r'<script type="application/ld\+json">(.*?)</script>', re.S)
+GTIN = re.compile(r'(?<="gtin14": )([^,\s]+)')
+
+
+def payloads(count):
+    arket, marcjacobs, mohagni = ArketSite(count), MarcJacobsSite(count), MohagniSite(count)
+    result = []
+    for pid in range(count):
+        arket_body = arket.handle('/ko-kr/pda/changeItemInfo.html', 'slitmCd=A%010d' % pid)[2]
+        mj_body = marcjacobs.handle('/on/demandware.store/Sites-mjsfra-Site/en_GB/Product-Variation', 'pid=%d' % pid)[2]
+        page = mohagni.handle(mohagni.product_url(pid), '')[2].decode('utf-8')
+        ld_json = LD_JSON.findall(page)[1].strip().replace('\n', '').replace('\\"', '"')
+        result.append((arket_body, mj_body, ld_json))
+    return result
+
+
+def stdlib_item(arket_body, mj_body, ld_json):
+    # what the spiders and pipelines did before the codec module
+    product = json.loads(arket_body.decode('utf-8'))
+    json.loads(mj_body.decode('utf-8'))['product']
+    json.loads(GTIN.sub(r'"\1"', ld_json))['description']
+    json.dumps(['Women', 'Clothing', 'Jeans'])
+    json.dumps(product['imgList'])
+    json.dumps([{'size_name': 'M', 'stock': 1}, {'size_name': 'L', 'stock': 0}])
+
+
+def codec_item(arket_body, mj_body, ld_json):
+    product = codec.loads(arket_body)
+    codec.loads(mj_body)['product']
+    codec.loads_key(ld_json, 'description')
+    codec.dumps(['Women', 'Clothing', 'Jeans'])
+    codec.dumps(product['imgList'])
+    codec.dumps([{'size_name': 'M', 'stock': 1}, {'size_name': 'L', 'stock': 0}])
+
+
+def measure(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        for item in items:
+            func(*item)
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per variant, the fastest is kept')
+    args = parser.parse_args(argv)
+
+    items = payloads(args.products)
+    baseline = measure(stdlib_item, items, args.repeat)
+    print('%-22s %12s %8s' % ('variant', 'us/item', 'saved'))
+    print('%-22s %12.1f %8s' % ('stdlib json (before)', baseline, '-'))
+    for name in codec.BACKENDS:
+        codec.set_backend(name)
+        result = measure(codec_item, items, args.repeat)
+        print('%-22s %12.1f %7.0f%%' % ('codec/' + name, result, 100.0 * (baseline - result) / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Throughput benchmark of product page parsing in worker processes.
+
+Renders N product pages of the synthetic The Sting site, parses them with ThestingSpider.parse_detail
+on the reactor thread and then through the offload pool (PARSE_OFFLOAD_ENABLED) with each of the
+given worker counts. Reports the pages parsed per second (wall clock, the pools are started and
+warmed up before timing) and the CPU time left on the reactor thread per page, which bounds the
+speedup on a host with enough cores.
+
+Usage:
+    python -m benchmarks.parse_offload --pages 2000 --workers 1,2,4
+
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'the_sting'))
+
+from scrapy import Request  # noqa: E402
+from scrapy.http import HtmlResponse  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+from twisted.internet import defer, task  # noqa: E402
+
+from loadtest.sites import TheStingSite  # noqa: E402
+from the_sting.spiders.thesting import ThestingSpider  # noqa: E402
+
+META = {'country': 'nl', 'currency': 'EUR', 'language': 'nl', 'categories': ['Dames', 'Jeans']}
+
+
+def pages(count, padding):
+    site = TheStingSite(count, padding=padding)
+    responses = []
+    for pid in range(count):
+        url = 'https://www.thesting.com' + site.product_url(pid)
+        body = site.handle(site.product_url(pid), '')[2]
+        responses.append(HtmlResponse(url, body=body, encoding='utf-8', request=Request(url, meta=META)))
+    return responses
+
+
+@defer.inlineCallbacks
+def parse_all(spider, responses):
+    results = [spider.parse_detail(response) for response in responses]
+    items = 0
+    for result in results:
+        output = yield result if isinstance(result, defer.Deferred) else list(result)
+        items += len(output)
+    return items
+
+
+@defer.inlineCallbacks
+def measure(responses, workers):
+    settings = {'PARSE_OFFLOAD_ENABLED': bool(workers), 'PARSE_OFFLOAD_WORKERS': workers}
+    crawler = get_crawler(ThestingSpider, settings)
+    spider = ThestingSpider.from_crawler(crawler)
+    try:
+        # starts the workers and loads the spider module in them
+        yield parse_all(spider, responses[:4 * max(workers, 1)])
+        started, cpu_started = time.perf_counter(), time.process_time()
+        items = yield parse_all(spider, responses)
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    finally:
+        if spider.parse_pool is not None:
+            spider.parse_pool.close()
+    assert items == len(responses), items
+    return len(responses) / elapsed, cpu / len(responses) * 1000
+
+
+@defer.inlineCallbacks
+def run(reactor, args):
+    responses = pages(args.pages, args.padding)
+    print('%d pages of %d KB on %d cores' % (len(responses), sum(len(r.body) for r in responses) / len(responses) / 1024,
+                                            os.cpu_count()))
+    baseline, cpu = yield measure(responses, 0)
+    print('%-28s %12s %10s %18s' % ('variant', 'pages/s', 'speedup', 'reactor ms/page'))
+    print('%-28s %12.0f %9.2fx %18.2f' % ('reactor thread', baseline, 1, cpu))
+    for workers in args.workers:
+        rate, cpu = yield measure(responses, workers)
+        print('%-28s %12.0f %9.2fx %18.2f' % ('offload, %d workers' % workers, rate, rate / baseline, cpu))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--padding', type=int, default=20000, help='bytes of script padding per page')
+    parser.add_argument('--workers', type=lambda value: [int(n) for n in value.split(',')], default=[1, 2, 4],
+                        help='comma separated worker counts')
+    args = parser.parse_args(argv)
+    task.react(run, (args,))
+
+
+if __name__ == '__main__':
+    main()
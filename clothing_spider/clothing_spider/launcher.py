@@ -0,0 +1,10 @@
+# Multi-process crawls of the project, see crawlkit/launcher.py:
+#
+#     python -m clothing_spider.launcher <spider> --workers 4
+
+import sys
+
+from crawlkit.launcher import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,80 +6,72 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-import json
-import sqlite3
+
+from crawlkit import codec, pipelines
 
 
 class ClothingSpiderPipeline:
     def process_item(self, item, spider):
         if item is not None:
             adapter = ItemAdapter(item)
-            if not adapter["description_text"] :
+            # category items of the sitemap discovery have no description
+            if "description_text" in adapter and not adapter["description_text"] :
                 adapter["description_text"] = "Not provided"
         return item
 
-class SqlitePipeline:
-
-    def __init__(self):
-
-        ## Create/Connect to database
-        self.con = sqlite3.connect('Products.db')
-
-        ## Create cursor, used to execute commands
-        self.cur = self.con.cursor()
-        ## Create quotes table if none exists
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS Products (
-                url TEXT,
-                identifier TEXT,
-                currency TEXT,
-                country_code TEXT,
-                use_size_level_prices BOOL,
-                title TEXT,
-                image_urls TEXT,
-                description_text TEXT,
-                category_names TEXT,
-                size_infos TEXT
-            )
-        """)
 
-    def process_item(self, item, spider):
-        self.cur.execute("select * from Products where url = ?", (item['url'],))
-        result = self.cur.fetchone()
-        if result:
-            spider.logger.warn("Item already in database: %s" % item['url'])
-        
-        ## If text isn't in the DB, insert data
-        else:
-            serialized_types= []
-            for size in item["size_infos"]:
-                serialized_type = {
-                    "size_name" : size["size_name"],
-                    "size_current_price_text": size["size_current_price_text"],
-                    "size_original_price_text": size["size_original_price_text"],
-                    "stock": size["stock"]
-                }
-                serialized_types.append(serialized_type)
-
-            ## Define insert statement
-            self.cur.execute("""
-                INSERT INTO Products (url, identifier, currency, country_code, use_size_level_prices, title, image_urls, description_text, category_names , size_infos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ? ,?)
-            """,
-            (
-                item["url"],
-                item['identifier'],
-                item['currency'],
-                item['country_code'],
-                item['use_size_level_prices'],
-                item["title"],
-                json.dumps(item["image_urls"]),
-                item["description_text"],
-                item["category_names"],
-                json.dumps(serialized_types)
-            ))
-
-            ## Execute insert of data into database
-            self.con.commit()
-        return item
+class SqlitePipeline(pipelines.SqlitePipeline):
+    ## Products table of PRODUCTS_DB, see crawlkit.pipelines.SqlitePipeline
+    schema = """
+        CREATE TABLE IF NOT EXISTS Products (
+            url TEXT,
+            identifier TEXT,
+            currency TEXT,
+            country_code TEXT,
+            use_size_level_prices BOOL,
+            title TEXT,
+            image_urls TEXT,
+            description_text TEXT,
+            category_names TEXT,
+            size_infos TEXT
+        )
+    """
 
+    @staticmethod
+    def product_measures(row):
+        # what a Products row adds to the aggregates (see crawlkit/aggregates.py): the
+        # prices are per size, the product's is its lowest current size price;
+        # Mohagni is a single brand, there is no brand column
+        sizes = codec.loads(row['size_infos']) if row['size_infos'] else []
+        prices = [round(size['size_current_price_text'] * 100) for size in sizes
+                  if isinstance(size.get('size_current_price_text'), (int, float))]
+        discounted = any(isinstance(size.get('size_current_price_text'), (int, float))
+                         and isinstance(size.get('size_original_price_text'), (int, float))
+                         and size['size_current_price_text'] < size['size_original_price_text'] for size in sizes)
+        in_stock = any(size.get('stock') for size in sizes)
+        groups = [('category', row['category_names'] or ''), ('country', row['country_code'] or '')]
+        return row['currency'] or '', groups, min(prices) if prices else None, int(discounted), int(in_stock)
 
+    def row_values(self, item):
+        # column -> value of `item`, with the defaults of a new row
+        serialized_types= []
+        for size in item.get("size_infos", []):
+            serialized_type = {
+                "size_name" : size["size_name"],
+                "size_current_price_text": size["size_current_price_text"],
+                "size_original_price_text": size["size_original_price_text"],
+                "stock": size["stock"]
+            }
+            serialized_types.append(serialized_type)
+        return {
+            'url': item["url"],
+            'identifier': item.get('identifier', ""),
+            'currency': item.get('currency', ""),
+            'country_code': item.get('country_code', ""),
+            'use_size_level_prices': item.get('use_size_level_prices', False),
+            'title': item.get("title", ""),
+            'image_urls': codec.dumps(item.get("image_urls", [])),
+            'description_text': item.get("description_text", ""),
+            'category_names': item.get("category_names", ""),
+            'size_infos': codec.dumps(serialized_types),
+        }
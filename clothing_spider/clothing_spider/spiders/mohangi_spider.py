@@ -8,71 +8,158 @@ Attributes:
     name (str): The name of the spider.
     start_urls (list): List of URLs to start crawling from.
     product_pattern : Regular expression pattern to extract product data from JavaScript.
-    des_pattern : Regular expression pattern to clean JSON data for description.
     stitched_pattern (re.Pattern): Regular expression pattern to identify stitched product variants.
 
 Methods:
+    start_requests(self): Requests the home page, the cached categories (NAV_CACHE_ENABLED, see `NavCacheMixin`) and the sitemap in the SITEMAP_DISCOVERY mode.
     parse(self, response): Parses the initial response and initiates category parsing.
-    parse_category(self, response): Extracts category title and pagination links for each category and initiates  parse_products.
-    extract_pagination_links(self, response) : Extracts pagination links from the response and appends '?page=1' to ensure all pages are included. 
-    parse_products(self, response): Parses product pages and initiates product detail parsing for each product url.
-    parse_product_detail(self, response): Parses product detail pages and extracts relevant information.
+    parse_category(self, response): Extracts category title, parses the products of the first page and initiates parse_products for the other pages, or estimates the size of the category from its pagination (CATALOG_ESTIMATE, see `CatalogEstimateMixin`).
+    extract_pagination_links(self, response) : Extracts the links to the other pages of a category, the first page is the category page itself.
+    estimate_tiles(self, response): Returns the product URLs of a category page (CATALOG_ESTIMATE).
+    parse_products(self, response): Parses product pages and initiates product detail parsing for each product url, or yields the category of the products requested from the sitemap.
+    parse_product_detail(self, response): Parses product detail pages, in the worker processes with PARSE_OFFLOAD_ENABLED (see `ParseOffloadMixin`) or from the extraction cache with EXTRACTION_CACHE_ENABLED (see `ExtractionCacheMixin`).
+    extract_product_detail(self, response): Extracts the relevant information of a product detail page.
     get_varients(self, response): Extracts product variants based on stitching and stitching type.
 
 """
 
-import json
 import re
 
 import scrapy
 from scrapy import Request
-from w3lib.url import add_or_replace_parameter
+from w3lib.url import url_query_parameter
 
-from ..items import ProductItem, SizeItem
+from crawlkit import codec
+from crawlkit.canonical import DEFAULT_URL_RULES, canonicalize, drop_default_params, drop_params
+from crawlkit.estimate import CatalogEstimateMixin
+from crawlkit.extractcache import ExtractionCacheMixin
+from crawlkit.items import ProductItem, SizeItem, item_classes
+from crawlkit.navcache import NavCacheMixin
+from crawlkit.offload import ParseOffloadMixin
+from crawlkit.sitemaps import SitemapDiscoveryMixin
 
 
-class MohangiSpider(scrapy.Spider):
+class MohangiSpider(SitemapDiscoveryMixin, ExtractionCacheMixin, ParseOffloadMixin, NavCacheMixin, CatalogEstimateMixin,
+                    scrapy.Spider):
     name = 'mohangi'
     start_urls = ['https://mohagni.com/']
 
     product_pattern = re.compile(r'product: ({.*?}),\s*collectionId:')
-    des_pattern = re.compile(r'(?<="gtin14": )([^,\s]+)')
     stitched_pattern = re.compile(r'\b(STITCHED|S|M|L|XL)\b', re.IGNORECASE)
     identifier_pattern = r'/products/(\w+-\d+)'
 
 
+    # callbacks of the product pages, served before discovery by
+    # backpressure.BackpressureScheduler
+    detail_callbacks = ('parse_product_detail',)
+
+    # meta keys extract_product_detail reads, sent with the body to the parse workers
+    # and part of the extraction cache key
+    offload_meta = ('category',)
+
+    # the nav cache keeps the category pages, their category is read from the page
+    nav_cache_callback = 'parse_category'
+
+    # item classes, switched to the slotted variants by COMPACT_ITEMS
+    product_item = ProductItem
+    size_item = SizeItem
+
+    # product pages listed in the sitemap, in the SITEMAP_DISCOVERY mode
+    sitemap_urls = ['https://mohagni.com/sitemap.xml']
+    sitemap_product_pattern = identifier_pattern
+    sitemap_callback = 'parse_product_detail'
+
+    # URL canonicalization (see crawlkit/canonical.py): `?page=1` is the category page,
+    # and the CDN serves the original image when no `width` is given
+    canonical_url_rules = DEFAULT_URL_RULES + [drop_default_params(page='1')]
+    canonical_image_rules = DEFAULT_URL_RULES + [drop_params('width')]
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.product_item, spider.size_item = item_classes(crawler.settings)
+        spider.sitemap_settings(crawler.settings)
+        spider.setup_parse_pool(crawler)
+        spider.setup_extraction_cache(crawler)
+        spider.setup_nav_cache(crawler)
+        spider.setup_catalog_estimate(crawler)
+        # product urls given a category item, the first category listing one wins
+        spider.category_urls = set()
+        return spider
+
+    def start_requests(self):
+        # the sitemap only lists product pages, which the estimation skips
+        if self.sitemap_discovery and self.catalog_estimate is None:
+            yield from self.sitemap_requests()
+            if not self.sitemap_categories:
+                return
+        yield from self.cached_nav_requests('PK', {})
+        # the home page is crawled in any case, it revalidates the cached categories
+        yield from super().start_requests()
+
     def parse(self, response):
         links = self.extract_links(response)
         for link in links:
+            self.record_nav('PK', None, response.urljoin(link))
             yield response.follow(link, callback=self.parse_category)
     
     def parse_category(self, response):
         category = response.css("h2.collection-hero__title::text")[1].get()
+        if self.catalog_estimate is not None:
+            pages = {int(url_query_parameter(link, 'page', '1')): link for link in self.extract_pagination_links(response)}
+            last_page = max(pages, default=1)
+            yield from self.estimate_from_pages(response, 'PK', category, last_page,
+                                                response.urljoin(pages[last_page]) if pages else None)
+            return
+        # the category page is the first page of products
+        response.meta["category"] = category
+        yield from self.parse_products(response)
         pagination_links = self.extract_pagination_links(response)
         for link in pagination_links:
             yield response.follow(link, callback=self.parse_products, meta = {"category": category})
 
     def extract_pagination_links(self, response):
         # Extract pagination links from response
-        pagination_links = set(response.css("ul.pagination__list a::attr(href)").getall())
-        pagination_links.add(add_or_replace_parameter(response.url, 'page', '1'))
-        return pagination_links
+        return set(response.css("ul.pagination__list a::attr(href)").getall())
+
+    def estimate_tiles(self, response):
+        return response.css("li.grid__item a.full-unstyled-link::attr(href)").getall()
 
     def parse_products(self, response):
         products = response.css("li.grid__item")
         for product in products:
             url = response.urljoin(product.css("a.full-unstyled-link::attr(href)").get())
+            if self.listed_in_sitemap(canonicalize(url, self.canonical_url_rules)):
+                yield from self.category_item(response, canonicalize(url, self.canonical_url_rules))
+                continue
             yield Request(url, callback=self.parse_product_detail,  meta = {"category": response.meta.get("category")})
 
+    def category_item(self, response, url):
+        # The product page is requested from the sitemap, the listing only adds the category
+        if url in self.category_urls:
+            return
+        self.category_urls.add(url)
+        self.crawler.stats.inc_value('sitemap/category_items')
+        product = self.product_item()
+        product['url'] = url
+        product['country_code'] = 'PK'
+        product["category_names"] = response.meta.get("category")
+        yield product
+
     def parse_product_detail(self, response):
-        product = ProductItem()
+        return self.offload(response, 'extract_product_detail')
+
+    def extract_product_detail(self, response):
+        product = self.product_item()
         product['url'] = response.url
         product['identifier'] = re.search(self.identifier_pattern, response.url).group(1)
         product['currency'] = 'PKR'
         product['country_code'] = 'PK'
         product['use_size_level_prices'] = True
         product['title'] = self.get_title(response)
-        product["category_names"] = response.meta.get("category")
+        # products requested from the sitemap get their category from a listing item
+        if "category" in response.meta:
+            product["category_names"] = response.meta.get("category")
         product['image_urls'] = self.get_images(response)
         product['description_text']= self.get_description(response)
         product["size_infos"] = self.get_varients(response)
@@ -88,14 +175,14 @@ class MohangiSpider(scrapy.Spider):
         if style_label and "Style" in style_label:
             # Assume product is stitched and unstitched
             data = response.css("variant-radios.no-js-hidden script::text").get()
-            json_data = json.loads(data)
+            json_data = codec.loads(data)
             if json_data:
                 stitched_products = self.process_stitched_products(json_data)
                 unstitched_products = self.process_unstitched_product(response)
         elif style_label and "Size" in style_label:
             # Assume product is just stitched
             data = response.css("variant-radios.no-js-hidden script::text").get()
-            json_data = json.loads(data)
+            json_data = codec.loads(data)
             if json_data:
                 stitched_products = self.process_stitched_products(json_data)
         else:
@@ -115,7 +202,7 @@ class MohangiSpider(scrapy.Spider):
             title = variant.get('title', '')
             # Ensures that "unstitched" variants are not added twice to the list of stitched products.
             if self.stitched_pattern.search(title):
-                stitched_product = SizeItem()
+                stitched_product = self.size_item()
                 stitched_product["size_name"] = title
                 stitched_product["size_current_price_text"] = variant.get('price') / 100  
                 stitched_product["size_original_price_text"] = (variant["compare_at_price"] or variant["price"]) / 100
@@ -129,8 +216,8 @@ class MohangiSpider(scrapy.Spider):
         javascript_scripts = response.css('script[type="text/javascript"]::text').get()
         match = self.product_pattern.findall(javascript_scripts)
         if match:
-            json_data = json.loads(match[0])
-            unstitched_product = SizeItem()
+            json_data = codec.loads(match[0])
+            unstitched_product = self.size_item()
             unstitched_product["size_name"] = "UNSTITCHED"
             unstitched_product["size_current_price_text"] = json_data["price"] / 100
             unstitched_product["size_original_price_text"] = (json_data["compare_at_price"] or json_data["price"]) / 100
@@ -147,5 +234,5 @@ class MohangiSpider(scrapy.Spider):
 
     def get_description(self,response):
         data = response.css('script[type="application/ld+json"]::text')[1].get().strip().replace('\n', '').replace('\\"', '"')
-        data = self.des_pattern.sub(r'"\1"', data)
-        return json.loads(data)["description"]
\ No newline at end of file
+        # only the description is decoded, the unquoted gtin14 elsewhere in the block doesn't matter
+        return codec.loads_key(data, "description")
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+Crawl infrastructure shared by the crawl projects (the_sting, clothing_spider).
+
+The projects keep their settings, spiders and Products table; everything they
+plug in through the settings lives here. The project packages put the
+repository root on sys.path, so `scrapy crawl` from a project directory finds
+this package.
+
+Modules:
+    aggregates: Dashboard aggregate tables of Products.db.
+    backpressure: Scheduler holding back discovery requests while products are queued.
+    breaker: Per-endpoint circuit breaker downloader middleware.
+    canonical: URL canonicalization and the canonicalizing spider middleware.
+    checkpoint: Resumable crawls (CheckpointScheduler).
+    codec: JSON codec used by the spiders and pipelines.
+    dupefilters: Memory-bounded duplicate filters.
+    estimate: Catalog size estimation mode.
+    extensions: Prometheus metrics exporter.
+    extractcache: Extraction cache keyed by the response body.
+    frontier: Shared crawl frontier for multi-process crawls.
+    instrumentation: Histograms and timers used by the middlewares and extensions.
+    items: Items and their compact slotted variants.
+    launcher: Runs one spider in several worker processes.
+    middlewares: Callback profiler and instrumentation middlewares.
+    navcache: Persistent navigation tree cache.
+    offload: Parse offload to worker processes.
+    pipelines: SQLite and image pipelines.
+    sitemaps: Sitemap discovery.
+    streaming: Early-abort downloads and parse time measurement.
+
+"""
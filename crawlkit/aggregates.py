@@ -0,0 +1,195 @@
+# Aggregate tables of Products.db (PRODUCTS_AGGREGATES).
+#
+# The dashboards show, per brand (where the Products table has one), category
+# and country, the number of products, their average, lowest and highest price,
+# the share of discounted products and the share of products with a size in
+# stock. SqlitePipeline keeps these figures in ProductAggregates, one row per
+# (dimension, value, currency), and updates them with every row it inserts or
+# changes, in the same transaction: an update takes the contribution of the old
+# row out and adds the one of the new row. Prices are summed in cents, so the
+# figures stay exact however many updates they see. ProductAggregatePrices
+# counts the products per price of every group, which keeps the lowest and
+# highest price right when the cheapest or dearest product of a group changes
+# price.
+#
+# The dashboards read the ProductSummary view:
+#
+#   SELECT value, products, avg_price, min_price, max_price, discount_share, in_stock_ratio
+#   FROM ProductSummary WHERE dimension = 'brand' AND currency = 'EUR'
+#
+# What a row contributes (its groups, price, discount and stock) is given by
+# the product_measures of the project's SqlitePipeline. The tables are built
+# from the Products rows when a pipeline first creates them, and can be
+# rebuilt or checked against the rows from the command line, through the
+# aggregates module of the project:
+#
+#   python -m the_sting.aggregates Products.db --check
+#   python -m clothing_spider.aggregates Products.db
+
+import argparse
+import sqlite3
+import sys
+from collections import Counter
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ProductAggregates (
+        dimension TEXT,
+        value TEXT,
+        currency TEXT,
+        products INTEGER,
+        priced INTEGER,
+        price_sum INTEGER,
+        min_price INTEGER,
+        max_price INTEGER,
+        discounted INTEGER,
+        in_stock INTEGER,
+        PRIMARY KEY (dimension, value, currency)
+    );
+    CREATE TABLE IF NOT EXISTS ProductAggregatePrices (
+        dimension TEXT,
+        value TEXT,
+        currency TEXT,
+        price INTEGER,
+        products INTEGER,
+        PRIMARY KEY (dimension, value, currency, price)
+    ) WITHOUT ROWID;
+    CREATE VIEW IF NOT EXISTS ProductSummary AS
+        SELECT dimension, value, currency, products,
+               price_sum / 100.0 / NULLIF(priced, 0) AS avg_price,
+               min_price / 100.0 AS min_price,
+               max_price / 100.0 AS max_price,
+               CAST(discounted AS REAL) / products AS discount_share,
+               CAST(in_stock AS REAL) / products AS in_stock_ratio
+        FROM ProductAggregates;
+"""
+
+# summed columns of ProductAggregates
+COUNTERS = ('products', 'priced', 'price_sum', 'discounted', 'in_stock')
+
+
+class Aggregates:
+
+    def __init__(self, con, measures):
+        self.con = con
+        # row (column -> value) -> (currency, [(dimension, value)], price in cents or None, discounted, in_stock)
+        self.measures = measures
+        created = not con.execute("SELECT 1 FROM sqlite_master WHERE name = 'ProductAggregates'").fetchone()
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                con.execute(statement)
+        if created:
+            # the rows stored before the aggregates were
+            self.rebuild()
+
+    def update(self, old, new):
+        """Replaces the contribution of the row `old` by the one of `new`."""
+        old_measures, new_measures = self.measures(old), self.measures(new)
+        if old_measures != new_measures:
+            self.apply(old_measures, -1)
+            self.apply(new_measures, 1)
+
+    def insert(self, row):
+        self.apply(self.measures(row), 1)
+
+    def apply(self, measures, sign):
+        currency, groups, price, discounted, in_stock = measures
+        priced = price is not None
+        counters = (sign, sign * priced, sign * (price or 0), sign * discounted, sign * in_stock)
+        for dimension, value in groups:
+            key = (dimension, value, currency)
+            self.con.execute(
+                "INSERT INTO ProductAggregates (dimension, value, currency, %s) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dimension, value, currency) DO UPDATE SET %s"
+                % (', '.join(COUNTERS), ', '.join('%s = %s + excluded.%s' % (c, c, c) for c in COUNTERS)),
+                key + counters)
+            if priced:
+                self.con.execute(
+                    "INSERT INTO ProductAggregatePrices VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (dimension, value, currency, price) DO UPDATE SET products = products + excluded.products",
+                    key + (price, sign))
+                if sign < 0:
+                    self.con.execute("DELETE FROM ProductAggregatePrices WHERE dimension = ? AND value = ? "
+                                     "AND currency = ? AND price = ? AND products = 0", key + (price,))
+                # the extreme prices are the first and last of the group's prices
+                self.con.execute(
+                    "UPDATE ProductAggregates SET "
+                    "min_price = (SELECT MIN(price) FROM ProductAggregatePrices p WHERE p.dimension = ?1 "
+                    "AND p.value = ?2 AND p.currency = ?3), "
+                    "max_price = (SELECT MAX(price) FROM ProductAggregatePrices p WHERE p.dimension = ?1 "
+                    "AND p.value = ?2 AND p.currency = ?3) "
+                    "WHERE dimension = ?1 AND value = ?2 AND currency = ?3", key)
+            if sign < 0:
+                self.con.execute("DELETE FROM ProductAggregates WHERE dimension = ? AND value = ? AND currency = ? "
+                                 "AND products = 0", key)
+
+    def compute(self):
+        """Aggregates and price counts of the Products rows, computed from scratch."""
+        aggregates, prices = {}, Counter()
+        cur = self.con.execute("SELECT * FROM Products")
+        columns = [description[0] for description in cur.description]
+        for values in cur:
+            currency, groups, price, discounted, in_stock = self.measures(dict(zip(columns, values)))
+            for dimension, value in groups:
+                key = (dimension, value, currency)
+                counters = aggregates.setdefault(key, [0] * len(COUNTERS) + [None, None])
+                counters[0] += 1
+                counters[3] += discounted
+                counters[4] += in_stock
+                if price is not None:
+                    counters[1] += 1
+                    counters[2] += price
+                    counters[5] = price if counters[5] is None else min(counters[5], price)
+                    counters[6] = price if counters[6] is None else max(counters[6], price)
+                    prices[key + (price,)] += 1
+        return aggregates, prices
+
+    def rebuild(self):
+        aggregates, prices = self.compute()
+        self.con.execute("DELETE FROM ProductAggregates")
+        self.con.execute("DELETE FROM ProductAggregatePrices")
+        self.con.executemany(
+            "INSERT INTO ProductAggregates (dimension, value, currency, %s, min_price, max_price) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % ', '.join(COUNTERS),
+            [key + tuple(counters) for key, counters in aggregates.items()])
+        self.con.executemany("INSERT INTO ProductAggregatePrices VALUES (?, ?, ?, ?, ?)",
+                             [key + (count,) for key, count in prices.items()])
+        return len(aggregates)
+
+    def check(self):
+        """The groups whose stored aggregates differ from the ones computed from the Products rows."""
+        aggregates, prices = self.compute()
+        stored = {tuple(row[:3]): list(row[3:]) for row in self.con.execute(
+            "SELECT dimension, value, currency, %s, min_price, max_price FROM ProductAggregates" % ', '.join(COUNTERS))}
+        stored_prices = Counter()
+        for row in self.con.execute("SELECT dimension, value, currency, price, products FROM ProductAggregatePrices"):
+            stored_prices[tuple(row[:4])] = row[4]
+        differences = [(key, stored.get(key), aggregates.get(key)) for key in sorted(stored.keys() | aggregates.keys())
+                       if stored.get(key) != aggregates.get(key)]
+        price_groups = {key[:3] for key in (stored_prices - prices) + (prices - stored_prices)}
+        differences += [(key, 'price counts', None) for key in sorted(price_groups)]
+        return differences
+
+
+def main(measures, argv=None):
+    # `measures` is the product_measures of the project's SqlitePipeline
+    parser = argparse.ArgumentParser(description="Rebuild or check the aggregate tables of a Products.db")
+    parser.add_argument('path', nargs='?', default='Products.db')
+    parser.add_argument('--check', action='store_true',
+                        help="compare the stored aggregates with the Products rows instead of rebuilding them")
+    args = parser.parse_args(argv)
+
+    con = sqlite3.connect(args.path)
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE name = 'Products'").fetchone():
+        sys.exit("%s has no Products table" % args.path)
+    with con:
+        aggregates = Aggregates(con, measures)
+        if args.check:
+            differences = aggregates.check()
+            for key, stored, computed in differences:
+                print("%s: stored %s, computed %s" % (' / '.join(key), stored, computed))
+            print("%d groups differ" % len(differences) if differences else "The aggregates match the Products rows")
+        else:
+            print("Rebuilt the aggregates of %d groups" % aggregates.rebuild())
+    con.close()
+    if args.check and differences:
+        sys.exit(1)
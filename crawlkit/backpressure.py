@@ -0,0 +1,195 @@
+# Backpressure-aware scheduling.
+#
+# The nav and listing callbacks yield requests much faster than the product
+# pages they lead to are crawled: a listing page gives a page of products and
+# Arket's first listing page every other page of the category. With the
+# default scheduler the queue fills with discovery requests, memory grows with
+# the catalog and the first items wait until discovery is mostly done.
+#
+# BackpressureScheduler keeps two classes of requests, 'detail' (the
+# callbacks of the spider's `detail_callbacks`) and 'discovery' (every other
+# callback). Detail requests are served first; a discovery request is only
+# served when fewer than SCHEDULER_DETAIL_THRESHOLD detail requests are
+# pending and fewer than SCHEDULER_DISCOVERY_IN_FLIGHT discovery requests are
+# being downloaded (or nothing is). The detail queue so stays around the
+# threshold plus the products of the listing pages in flight, at the cost of
+# some idle download slots while the next listing page is fetched.
+#
+# Each class keeps at most SCHEDULER_MEMORY_CAP requests in memory, the others
+# are spilled to a JSON lines file in SCHEDULER_SPILL_DIR (the system temp
+# directory by default) and read back when the class drains. Spilled requests
+# keep their callback, priority and the meta json can encode.
+#
+#   scrapy crawl arket_spider -s SCHEDULER=crawlkit.backpressure.BackpressureScheduler
+#
+# Stats: backpressure/held (discovery requests held back while detail
+# requests were served), backpressure/spilled, backpressure/max_pending/<class>.
+
+import os
+import tempfile
+from collections import deque
+from weakref import WeakSet
+
+from scrapy import signals
+from scrapy.utils.misc import create_instance, load_object
+
+from .checkpoint import decode_request, encode_request
+
+DETAIL, DISCOVERY = 'detail', 'discovery'
+
+
+class SpillFile:
+    # FIFO of encoded requests in an unlinked temporary file
+
+    def __init__(self, directory):
+        self.file = tempfile.TemporaryFile('w+', dir=directory, prefix='scheduler-spill-')
+        self.read_pos = 0
+        self.size = 0
+
+    def push(self, line):
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(line + '\n')
+        self.size += 1
+
+    def pop(self, count):
+        self.file.seek(self.read_pos)
+        lines = []
+        while len(lines) < count and self.size:
+            lines.append(self.file.readline())
+            self.size -= 1
+        self.read_pos = self.file.tell()
+        if not self.size:
+            # everything was read back, start over
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_pos = 0
+        return lines
+
+    def close(self):
+        self.file.close()
+
+
+class RequestClass:
+
+    def __init__(self, name):
+        self.name = name
+        # priority -> deque of requests, popped LIFO like scrapy's memory queues
+        self.queues = {}
+        self.size = 0
+        self.spill = None
+
+    def __len__(self):
+        return self.size + (self.spill.size if self.spill is not None else 0)
+
+    def push(self, request):
+        queue = self.queues.get(request.priority)
+        if queue is None:
+            queue = self.queues[request.priority] = deque()
+        queue.append(request)
+        self.size += 1
+
+    def pop(self):
+        priority = max(self.queues)
+        queue = self.queues[priority]
+        request = queue.pop()
+        if not queue:
+            del self.queues[priority]
+        self.size -= 1
+        return request
+
+
+class BackpressureScheduler:
+
+    def __init__(self, crawler, dupefilter, threshold, in_flight, memory_cap, spill_dir):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.df = dupefilter
+        self.threshold = threshold
+        self.max_in_flight = in_flight
+        self.memory_cap = memory_cap
+        self.spill_dir = spill_dir
+        self.spider = None
+        self.detail_callbacks = set()
+        self.classes = {DETAIL: RequestClass(DETAIL), DISCOVERY: RequestClass(DISCOVERY)}
+        # discovery requests handed to the engine and not yet out of the downloader
+        self.discovery_in_flight = WeakSet()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = create_instance(load_object(settings['DUPEFILTER_CLASS']), settings, crawler)
+        s = cls(
+            crawler,
+            dupefilter,
+            settings.getint('SCHEDULER_DETAIL_THRESHOLD', 2 * settings.getint('CONCURRENT_REQUESTS')),
+            settings.getint('SCHEDULER_DISCOVERY_IN_FLIGHT', 2),
+            settings.getint('SCHEDULER_MEMORY_CAP', 10000),
+            settings.get('SCHEDULER_SPILL_DIR'),
+        )
+        crawler.signals.connect(s.request_left_downloader, signal=signals.request_left_downloader)
+        return s
+
+    def open(self, spider):
+        self.spider = spider
+        self.detail_callbacks = set(getattr(spider, 'detail_callbacks', ()))
+        return self.df.open()
+
+    def close(self, reason):
+        for request_class in self.classes.values():
+            if request_class.spill is not None:
+                request_class.spill.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return len(self) > 0
+
+    def __len__(self):
+        return sum(len(request_class) for request_class in self.classes.values())
+
+    def request_class(self, request):
+        callback = request.callback or self.spider.parse
+        return self.classes[DETAIL if getattr(callback, '__name__', None) in self.detail_callbacks else DISCOVERY]
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        request_class = self.request_class(request)
+        if request_class.size >= self.memory_cap:
+            if request_class.spill is None:
+                request_class.spill = SpillFile(self.spill_dir)
+            request_class.spill.push(encode_request(request, self.spider))
+            self.stats.inc_value('backpressure/spilled', spider=self.spider)
+        else:
+            request_class.push(request)
+        self.stats.max_value('backpressure/max_pending/%s' % request_class.name, len(request_class), spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        detail, discovery = self.classes[DETAIL], self.classes[DISCOVERY]
+        if len(discovery) and len(detail) < self.threshold and (
+                len(self.discovery_in_flight) < self.max_in_flight or not self.crawler.engine.downloader.active):
+            request = self.pop(discovery)
+            self.discovery_in_flight.add(request)
+        elif len(detail):
+            if len(discovery):
+                self.stats.inc_value('backpressure/held', spider=self.spider)
+            request = self.pop(detail)
+        else:
+            # discovery waits for the responses in flight, the engine asks again after each one
+            return None
+        self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def pop(self, request_class):
+        if not request_class.size:
+            # read the spilled requests back, up to half the cap to leave room for new ones
+            for line in request_class.spill.pop(max(1, self.memory_cap // 2)):
+                request_class.push(decode_request(line, self.spider))
+        return request_class.pop()
+
+    def request_left_downloader(self, request, spider):
+        self.discovery_in_flight.discard(request)
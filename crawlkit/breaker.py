@@ -0,0 +1,228 @@
+# Per-endpoint circuit breaker (CIRCUIT_BREAKER_ENABLED).
+#
+# When one route of a site breaks (Arket's dpa/ctgrListAddItem.html answering
+# 5xx, the Marc Jacobs Product-Variation JSON timing out), its requests and
+# their retries keep taking download slots from the healthy routes.
+# CircuitBreakerMiddleware keeps the outcome of the last
+# CIRCUIT_BREAKER_WINDOW downloads of every route, a route being a host and
+# one of the spider's `circuit_breaker_routes` (URL path patterns, the whole
+# host otherwise):
+#
+#   circuit_breaker_routes = [('add_items', r'/dpa/ctgrListAddItem\.html$')]
+#
+# Once CIRCUIT_BREAKER_MIN_REQUESTS have been seen and the share of failures
+# (CIRCUIT_BREAKER_HTTP_CODES and download errors) reaches
+# CIRCUIT_BREAKER_ERROR_RATE, the circuit of the route opens: its requests
+# never reach the downloader. With CIRCUIT_BREAKER_MODE = 'fail' they fail
+# with CircuitOpen (an IgnoreRequest, their errback is called). With 'defer'
+# they are kept aside and the spider does not hear of them until they are
+# scheduled again or dropped. After CIRCUIT_BREAKER_COOLDOWN seconds one
+# request goes through as a probe: when it succeeds the circuit closes and
+# the deferred requests are scheduled again, when it fails the circuit stays
+# open for another cool-down. After CIRCUIT_BREAKER_MAX_PROBES failed probes
+# in a row the deferred requests of the route fail with CircuitOpen.
+#
+# Stats: circuit_breaker/opened, circuit_breaker/closed,
+# circuit_breaker/probes, circuit_breaker/deferred, circuit_breaker/resumed
+# and circuit_breaker/skipped, also per route as
+# circuit_breaker/<host>/<route>/skipped.
+
+import logging
+import re
+import time
+from collections import deque
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(IgnoreRequest):
+    """The request was not downloaded because the circuit of its route is open."""
+
+
+class Circuit:
+
+    def __init__(self, window):
+        # True for the failed downloads among the last `window` ones
+        self.outcomes = deque(maxlen=window)
+        # time the circuit opened or was last probed, None while it is closed
+        self.opened_at = None
+        self.probing = False
+        self.failed_probes = 0
+        # requests kept aside while the circuit is open (defer mode)
+        self.deferred = deque()
+        # delayed call of the next probe
+        self.timer = None
+
+    @property
+    def error_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class CircuitBreakerMiddleware:
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = settings.getint('CIRCUIT_BREAKER_WINDOW', 50)
+        self.min_requests = settings.getint('CIRCUIT_BREAKER_MIN_REQUESTS', 20)
+        self.error_rate = settings.getfloat('CIRCUIT_BREAKER_ERROR_RATE', 0.5)
+        self.cooldown = settings.getfloat('CIRCUIT_BREAKER_COOLDOWN', 60.0)
+        self.max_probes = settings.getint('CIRCUIT_BREAKER_MAX_PROBES', 5)
+        self.defer = settings.get('CIRCUIT_BREAKER_MODE', 'defer') == 'defer'
+        self.http_codes = {int(code) for code in
+                           settings.getlist('CIRCUIT_BREAKER_HTTP_CODES', [500, 502, 503, 504, 522, 524, 408, 429])}
+        # route -> Circuit
+        self.circuits = {}
+        self.routes = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CIRCUIT_BREAKER_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.routes = [(name, re.compile(pattern)) for name, pattern in getattr(spider, 'circuit_breaker_routes', [])]
+
+    def route(self, request):
+        parts = urlparse_cached(request)
+        for name, pattern in self.routes:
+            if pattern.search(parts.path):
+                return '%s/%s' % (parts.hostname, name)
+        return '%s/*' % parts.hostname
+
+    def process_request(self, request, spider):
+        if request.meta.get('circuit_probe'):
+            return None
+        route = self.route(request)
+        if request.meta.get('circuit_dropped'):
+            # deferred until the probes gave up on the route
+            self.skipped(route, spider)
+            raise CircuitOpen('Circuit open for %s' % route)
+        circuit = self.circuits.get(route)
+        if circuit is None or circuit.opened_at is None:
+            return None
+        if time.monotonic() - circuit.opened_at >= self.cooldown:
+            # this one tests whether the route recovered (or replaces a probe
+            # that got lost)
+            self.probe(route, circuit, request)
+            return None
+        if self.defer and circuit.failed_probes < self.max_probes:
+            circuit.deferred.append(request.replace(dont_filter=True))
+            self.stats.inc_value('circuit_breaker/deferred', spider=spider)
+            # A downloader middleware can only take a request out of the
+            # downloader by raising IgnoreRequest. The copy kept aside is the
+            # one that gets crawled, this one is dropped without calling its
+            # errback, nothing failed yet.
+            request.errback = None
+            raise IgnoreRequest('Deferred while the circuit of %s is open' % route)
+        self.skipped(route, spider)
+        raise CircuitOpen('Circuit open for %s' % route)
+
+    def process_response(self, request, response, spider):
+        self.record(request, response.status in self.http_codes, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self.record(request, True, spider)
+
+    def record(self, request, failed, spider):
+        route = self.route(request)
+        circuit = self.circuits.get(route)
+        if circuit is None:
+            circuit = self.circuits[route] = Circuit(self.window)
+        # popped before RetryMiddleware copies the meta into a retry
+        if request.meta.pop('circuit_probe', False) and circuit.probing:
+            circuit.probing = False
+            if failed:
+                self.reopen(route, circuit, spider)
+            else:
+                self.close(route, circuit, spider)
+            return
+        if circuit.opened_at is not None:
+            # downloads that were in flight when the circuit opened
+            return
+        circuit.outcomes.append(failed)
+        if failed and len(circuit.outcomes) >= self.min_requests and circuit.error_rate >= self.error_rate:
+            logger.warning("Opening the circuit of %s: %d%% of the last %d downloads failed",
+                           route, circuit.error_rate * 100, len(circuit.outcomes), extra={'spider': spider})
+            self.stats.inc_value('circuit_breaker/opened', spider=spider)
+            circuit.opened_at = time.monotonic()
+            circuit.outcomes.clear()
+            self.schedule_probe(route, circuit)
+
+    def probe(self, route, circuit, request):
+        circuit.probing = True
+        circuit.opened_at = time.monotonic()
+        request.meta['circuit_probe'] = True
+        self.stats.inc_value('circuit_breaker/probes', spider=self.crawler.spider)
+
+    def schedule_probe(self, route, circuit):
+        # deferred requests wait for the probe, so send one of them when the
+        # cool-down is over instead of waiting for a new request of the route
+        from twisted.internet import reactor
+
+        if circuit.timer is not None and circuit.timer.active():
+            circuit.timer.cancel()
+        circuit.timer = reactor.callLater(self.cooldown, self.send_probe, route, circuit)
+
+    def send_probe(self, route, circuit):
+        if (circuit.opened_at is None or not circuit.deferred
+                or time.monotonic() - circuit.opened_at < self.cooldown):
+            return
+        request = circuit.deferred.popleft()
+        self.probe(route, circuit, request)
+        self.crawler.engine.crawl(request)
+
+    def reopen(self, route, circuit, spider):
+        circuit.failed_probes += 1
+        circuit.opened_at = time.monotonic()
+        if circuit.failed_probes >= self.max_probes and circuit.deferred:
+            logger.warning("Dropping %d requests of %s after %d failed probes",
+                           len(circuit.deferred), route, circuit.failed_probes, extra={'spider': spider})
+            # back through the downloader to fail with CircuitOpen, so their
+            # errbacks see them dropped
+            while circuit.deferred:
+                request = circuit.deferred.popleft()
+                request.meta['circuit_dropped'] = True
+                self.crawler.engine.crawl(request)
+        self.schedule_probe(route, circuit)
+
+    def close(self, route, circuit, spider):
+        logger.info("Closing the circuit of %s, resuming %d requests", route, len(circuit.deferred),
+                    extra={'spider': spider})
+        self.stats.inc_value('circuit_breaker/closed', spider=spider)
+        circuit.opened_at = None
+        circuit.failed_probes = 0
+        while circuit.deferred:
+            self.stats.inc_value('circuit_breaker/resumed', spider=spider)
+            self.crawler.engine.crawl(circuit.deferred.popleft())
+
+    def skipped(self, route, spider, count=1):
+        self.stats.inc_value('circuit_breaker/skipped', count, spider=spider)
+        self.stats.inc_value('circuit_breaker/%s/skipped' % route, count, spider=spider)
+
+    def spider_idle(self, spider):
+        # deferred requests are still to be probed or resumed
+        waiting = False
+        for route, circuit in self.circuits.items():
+            if circuit.deferred:
+                waiting = True
+                self.send_probe(route, circuit)
+        if waiting:
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        for circuit in self.circuits.values():
+            if circuit.timer is not None and circuit.timer.active():
+                circuit.timer.cancel()
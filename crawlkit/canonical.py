@@ -0,0 +1,182 @@
+# URL canonicalization.
+#
+# The same page often reaches the scheduler under several URLs (tracking
+# parameters on product tiles, `?page=1` for the first listing page, CDN
+# resize parameters on images). Scrapy's fingerprint only sorts the query and
+# drops the fragment, so these are fetched and stored once per variant.
+#
+# CanonicalUrlMiddleware rewrites every request the spider yields with the
+# spider's `canonical_url_rules` before it reaches the dupefilter, and the
+# `image_urls` of every item with its `canonical_image_rules` (dropping the
+# URLs that become duplicates). Rules are built with the helpers below, each
+# optionally limited to the URL paths matching `path`:
+#
+#   canonical_url_rules = [drop_params('utm_*', 'position'), drop_default_params(page='1')]
+#   canonical_image_rules = [drop_params('width')]
+#
+# Stats: canonical/requests_rewritten, canonical/image_urls_rewritten and
+# canonical/image_urls_removed. With CANONICAL_URLS_DEBUG also
+# canonical/requests_avoided (requests that were new before and duplicates
+# after canonicalization); it fingerprints every request twice and keeps both
+# sets of fingerprints in memory, so it is meant for checking the rules.
+
+import posixpath
+import re
+from fnmatch import fnmatchcase
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from itemadapter import ItemAdapter, is_item
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+
+from .dupefilters import FingerprintTable
+
+TRACKING_PARAMS = ('utm_*', 'gclid', 'fbclid', 'msclkid', '_ga', 'srsltid')
+
+
+def query_pairs(query):
+    # raw name=value pairs, left encoded as they were
+    return [pair for pair in query.split('&') if pair]
+
+
+def param_name(pair):
+    return unquote_plus(pair.partition('=')[0])
+
+
+def rule_for(path, rewrite):
+    if path is None:
+        return rewrite
+    pattern = re.compile(path)
+
+    def rule(parts):
+        return rewrite(parts) if pattern.search(parts.path) else parts
+    return rule
+
+
+def drop_params(*names, path=None):
+    """Removes the query parameters whose name matches one of `names` (fnmatch patterns)."""
+    def rewrite(parts):
+        pairs = [pair for pair in query_pairs(parts.query)
+                 if not any(fnmatchcase(param_name(pair), name) for name in names)]
+        return parts._replace(query='&'.join(pairs))
+    return rule_for(path, rewrite)
+
+
+def keep_params(*names, path=None):
+    """Removes the query parameters not matching any of `names`, all of them when none are given."""
+    def rewrite(parts):
+        pairs = [pair for pair in query_pairs(parts.query)
+                 if any(fnmatchcase(param_name(pair), name) for name in names)]
+        return parts._replace(query='&'.join(pairs))
+    return rule_for(path, rewrite)
+
+
+def drop_default_params(path=None, **defaults):
+    """Removes the query parameters set to their default value, e.g. page=1."""
+    def rewrite(parts):
+        pairs = [pair for pair in query_pairs(parts.query)
+                 if defaults.get(param_name(pair)) != unquote_plus(pair.partition('=')[2])]
+        return parts._replace(query='&'.join(pairs))
+    return rule_for(path, rewrite)
+
+
+def sort_params(path=None):
+    """Sorts the query parameters by name, keeping the order of repeated names."""
+    def rewrite(parts):
+        return parts._replace(query='&'.join(sorted(query_pairs(parts.query), key=param_name)))
+    return rule_for(path, rewrite)
+
+
+def normalize_path(path=None):
+    """Lower-cases the host, collapses repeated slashes and resolves . and .. segments."""
+    def rewrite(parts):
+        url_path = parts.path
+        if url_path:
+            normalized = posixpath.normpath(re.sub('/{2,}', '/', url_path))
+            if url_path.endswith('/') and normalized != '/':
+                normalized += '/'
+            url_path = normalized
+        return parts._replace(netloc=parts.netloc.lower(), path=url_path, fragment='')
+    return rule_for(path, rewrite)
+
+
+DEFAULT_URL_RULES = [drop_params(*TRACKING_PARAMS), normalize_path()]
+
+
+def canonicalize(url, rules):
+    if not rules:
+        return url
+    parts = urlsplit(url)
+    for rule in rules:
+        parts = rule(parts)
+    return urlunsplit(parts)
+
+
+class CanonicalUrlMiddleware:
+
+    image_field = 'image_urls'
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.fingerprinter = crawler.request_fingerprinter
+        # fingerprints of the requests as yielded and as rewritten, to count the avoided ones
+        if crawler.settings.getbool('CANONICAL_URLS_DEBUG'):
+            self.raw_fingerprints = FingerprintTable()
+            self.canonical_fingerprints = FingerprintTable()
+        else:
+            self.raw_fingerprints = self.canonical_fingerprints = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CANONICAL_URLS_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            yield self.process_request(request, spider)
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if isinstance(output, Request):
+                yield self.process_request(output, spider)
+            elif is_item(output):
+                yield self.process_item(output, spider)
+            else:
+                yield output
+
+    def process_request(self, request, spider):
+        url = canonicalize(request.url, getattr(spider, 'canonical_url_rules', DEFAULT_URL_RULES))
+        if request.dont_filter:
+            return request.replace(url=url) if url != request.url else request
+        raw = self.fingerprinter.fingerprint(request) if self.raw_fingerprints is not None else None
+        if url != request.url:
+            request = request.replace(url=url)
+            self.stats.inc_value('canonical/requests_rewritten', spider=spider)
+        if raw is not None:
+            new_raw = self.raw_fingerprints.add(raw)
+            new_canonical = self.canonical_fingerprints.add(self.fingerprinter.fingerprint(request))
+            if new_raw and not new_canonical:
+                self.stats.inc_value('canonical/requests_avoided', spider=spider)
+        return request
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        urls = adapter.get(self.image_field)
+        if not urls:
+            return item
+        rules = getattr(spider, 'canonical_image_rules', DEFAULT_URL_RULES)
+        canonical = []
+        seen = set()
+        for url in urls:
+            canonical_url = canonicalize(url, rules)
+            if canonical_url != url:
+                self.stats.inc_value('canonical/image_urls_rewritten', spider=spider)
+            if canonical_url in seen:
+                self.stats.inc_value('canonical/image_urls_removed', spider=spider)
+                continue
+            seen.add(canonical_url)
+            canonical.append(canonical_url)
+        adapter[self.image_field] = canonical
+        return item
@@ -0,0 +1,247 @@
+# Resumable crawls.
+#
+# CheckpointScheduler keeps the pending requests in memory like the default
+# scheduler and every CHECKPOINT_INTERVAL seconds writes to CHECKPOINT_DIR:
+#
+#   requests.<n>.jl  pending and in-flight requests, one JSON line each with the
+#                    callback name, URL, priority and the JSON-encodable meta
+#   seen.txt         dupefilter fingerprints, appended since the last checkpoint
+#   state.json       the current requests file, the valid length of seen.txt and
+#                    the numeric stats (item counts etc.); replaced last, so a
+#                    crawl killed mid-checkpoint resumes from the previous one
+#
+# Before state.json is replaced the scheduler sends the checkpoint_saving
+# signal: whatever the checkpoint counts as done has to be durable by then.
+# SqlitePipeline commits its pending batch (PRODUCTS_DB_BATCH_SIZE) on it, so
+# the item counts saved with a checkpoint match the stored Products rows.
+#
+# When CHECKPOINT_DIR holds a checkpoint the crawl continues from it: the saved
+# requests are queued again and start requests already seen are filtered out.
+# A crawl that finishes normally removes its checkpoint.
+#
+#   scrapy crawl thesting -s SCHEDULER=crawlkit.checkpoint.CheckpointScheduler -s CHECKPOINT_DIR=crawls/thesting
+
+import json
+import os
+import time
+from collections import deque
+
+from scrapy.http import Request
+from scrapy.utils.misc import create_instance, load_object
+from twisted.internet import task
+
+# meta keys set by scrapy while downloading, rebuilt for the resumed request
+RUNTIME_META = ('download_latency', 'download_timeout')
+
+# stats that describe the process and not the crawl progress
+PROCESS_STATS = ('elapsed_time_seconds', 'memusage/startup', 'memusage/max')
+
+# sent with the spider before every checkpoint is written
+checkpoint_saving = object()
+
+
+def encode_request(request, spider):
+    meta = {key: value for key, value in request.meta.items()
+            if key not in RUNTIME_META and not key.startswith('_')}
+    data = {'u': request.url, 'p': request.priority}
+    if request.callback is not None:
+        data['cb'] = request.callback.__name__
+    if request.errback is not None:
+        data['eb'] = request.errback.__name__
+    if request.method != 'GET':
+        data['method'] = request.method
+        data['body'] = request.body.decode('latin-1')
+    if request.dont_filter:
+        data['df'] = 1
+    try:
+        data['m'] = meta
+        return json.dumps(data, separators=(',', ':'))
+    except (TypeError, ValueError):
+        # drop the values json can't encode
+        data['m'] = {}
+        for key, value in meta.items():
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                continue
+            data['m'][key] = value
+        return json.dumps(data, separators=(',', ':'))
+
+
+def decode_request(line, spider):
+    data = json.loads(line)
+    return Request(
+        data['u'],
+        callback=getattr(spider, data['cb']) if 'cb' in data else None,
+        errback=getattr(spider, data['eb']) if 'eb' in data else None,
+        method=data.get('method', 'GET'),
+        body=data.get('body', '').encode('latin-1'),
+        meta=data.get('m'),
+        priority=data['p'],
+        dont_filter=bool(data.get('df')),
+    )
+
+
+class CheckpointScheduler:
+
+    def __init__(self, crawler, dupefilter, path, interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.df = dupefilter
+        self.path = path
+        self.interval = interval
+        self.spider = None
+        # priority -> deque of requests, popped LIFO like scrapy's memory queues
+        self.queues = {}
+        self.size = 0
+        self.new_fingerprints = []
+        self.generation = 0
+        self.seen_size = 0
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = create_instance(load_object(settings['DUPEFILTER_CLASS']), settings, crawler)
+        return cls(
+            crawler,
+            dupefilter,
+            settings.get('CHECKPOINT_DIR') or os.path.join('checkpoints', crawler.spidercls.name),
+            settings.getfloat('CHECKPOINT_INTERVAL', 60.0),
+        )
+
+    def open(self, spider):
+        self.spider = spider
+        os.makedirs(self.path, exist_ok=True)
+        result = self.df.open()
+        self.resume()
+        self.task = task.LoopingCall(self.checkpoint)
+        self.task.start(self.interval, now=False)
+        return result
+
+    def close(self, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if reason == 'finished':
+            self.clear()
+        else:
+            # in-flight requests have completed by now, their children are queued
+            self.checkpoint(final=True)
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return self.size > 0
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        if not request.dont_filter:
+            self.new_fingerprints.append(self.df.request_fingerprint(request))
+        self.push(request)
+        self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def push(self, request):
+        queue = self.queues.get(request.priority)
+        if queue is None:
+            queue = self.queues[request.priority] = deque()
+        queue.append(request)
+        self.size += 1
+
+    def next_request(self):
+        if not self.size:
+            return None
+        priority = max(self.queues)
+        queue = self.queues[priority]
+        request = queue.pop()
+        if not queue:
+            del self.queues[priority]
+        self.size -= 1
+        self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def __len__(self):
+        return self.size
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def pending(self, final):
+        for queue in self.queues.values():
+            yield from queue
+        if final:
+            return
+        # dequeued requests whose callbacks have not finished, they are crawled again on resume
+        engine = self.crawler.engine
+        yield from engine.downloader.active
+        if engine.scraper.slot is not None:
+            yield from engine.scraper.slot.active
+
+    def checkpoint(self, final=False):
+        started = time.monotonic()
+        self.generation += 1
+        requests_file = 'requests.%d.jl' % self.generation
+
+        with open(self.file('seen.txt'), 'a') as f:
+            if self.new_fingerprints:
+                f.write('\n'.join(self.new_fingerprints) + '\n')
+            self.new_fingerprints = []
+            self.seen_size = f.tell()
+
+        count = 0
+        with open(self.file(requests_file), 'w') as f:
+            for request in self.pending(final):
+                f.write(encode_request(request, self.spider) + '\n')
+                count += 1
+
+        # items counted in the saved stats must be stored before the state points at them
+        self.crawler.signals.send_catch_log(checkpoint_saving, spider=self.spider)
+        progress = {key: value for key, value in self.stats.get_stats().items()
+                    if isinstance(value, (int, float)) and key not in PROCESS_STATS}
+        state = {'requests': requests_file, 'seen_size': self.seen_size, 'stats': progress, 'time': time.time()}
+        with open(self.file('state.json.tmp'), 'w') as f:
+            json.dump(state, f)
+        os.replace(self.file('state.json.tmp'), self.file('state.json'))
+
+        for name in os.listdir(self.path):
+            if name.startswith('requests.') and name != requests_file:
+                os.remove(self.file(name))
+
+        elapsed = time.monotonic() - started
+        self.stats.inc_value('checkpoint/count', spider=self.spider)
+        self.stats.inc_value('checkpoint/seconds', elapsed, spider=self.spider)
+        self.spider.logger.info("Checkpoint saved: %d requests in %.3fs" % (count, elapsed))
+
+    def resume(self):
+        try:
+            with open(self.file('state.json')) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+
+        # fingerprints written after the last complete checkpoint are dropped
+        with open(self.file('seen.txt'), 'r+') as f:
+            f.truncate(state['seen_size'])
+            fingerprints = f.read().split()
+        self.seen_size = state['seen_size']
+        self.df.fingerprints.update(fingerprints)
+
+        count = 0
+        with open(self.file(state['requests'])) as f:
+            for line in f:
+                self.push(decode_request(line, self.spider))
+                count += 1
+        self.generation = int(state['requests'].split('.')[1])
+
+        for key, value in state['stats'].items():
+            self.stats.set_value(key, value, spider=self.spider)
+        self.stats.inc_value('checkpoint/resumed', spider=self.spider)
+        self.spider.logger.info("Resumed from checkpoint: %d requests, %d seen" % (count, len(fingerprints)))
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.startswith('requests.') or name in ('seen.txt', 'state.json'):
+                os.remove(self.file(name))
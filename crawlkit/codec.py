@@ -0,0 +1,75 @@
+# JSON codec shared by the spiders and pipelines.
+#
+# loads/dumps go through orjson when it is installed and through the stdlib
+# json module otherwise; set_backend() switches explicitly (the benchmark uses
+# it to compare both). Payloads orjson rejects but json accepts (NaN, integers
+# over 64 bits, non-string keys...) fall back to the stdlib.
+#
+# loads_key() decodes the value of a single key without decoding the rest of
+# a large document.
+
+import json
+import re
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ('orjson', 'json') if orjson is not None else ('json',)
+backend = BACKENDS[0]
+
+_decoder = json.JSONDecoder()
+
+
+def set_backend(name):
+    global backend
+    if name not in BACKENDS:
+        raise ValueError("JSON backend %r is not available, use one of %s" % (name, ', '.join(BACKENDS)))
+    backend = name
+
+
+def loads(data):
+    """Decodes `data` (str or UTF-8 bytes)."""
+    if backend == 'orjson':
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encodes `obj` into a compact str."""
+    if backend == 'orjson':
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def response_json(response):
+    # Like response.json(), without decoding the body to text first
+    return loads(response.body)
+
+
+@lru_cache(maxsize=None)
+def key_pattern(key):
+    return re.compile(r'"%s"\s*:\s*' % re.escape(key))
+
+
+def loads_key(data, key, default=None):
+    """
+    Decodes the value of the first `key` found in `data`, leaving the rest of
+    the document undecoded. Meant for keys that occur once, or whose first
+    occurrence is the wanted one, in large or partly invalid payloads.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    match = key_pattern(key).search(data)
+    if match is None:
+        return default
+    value, _ = _decoder.raw_decode(data, match.end())
+    return value
@@ -0,0 +1,268 @@
+# Memory-bounded duplicate filters.
+#
+# RFPDupeFilter keeps every fingerprint as a 40 character hex str in a set,
+# ~120 bytes per seen request. The filters here keep the same interface
+# (JOBDIR, DUPEFILTER_DEBUG, `fingerprints` with add/update/in/len) with
+# compact storage:
+#
+#   CompactDupeFilter  open addressing hash table of the first
+#                      DUPEFILTER_FINGERPRINT_BYTES bytes (default 8) of the
+#                      binary fingerprints in one flat buffer, grown at 70% load:
+#                      11-23 bytes per request with 8 bytes. Two different
+#                      requests are taken for duplicates with probability
+#                      n^2 / 2^(8 * bytes + 1), ~3e-6 for 10M requests.
+#   BloomDupeFilter    scalable Bloom filter with a total false positive rate
+#                      of DUPEFILTER_ERROR_RATE (default 1e-6): ~6 bytes per
+#                      request. A false positive drops a request that was never
+#                      crawled, so keep the rate well below 1 / catalog size.
+#
+# DUPEFILTER_CAPACITY sizes the first table/filter. With DUPEFILTER_SPILL_DIR
+# set the buffers are memory mapped files in that directory, so the OS can
+# page them out instead of keeping them resident. Measured figures:
+# `python -m benchmarks.dupefilter_memory`.
+#
+#   DUPEFILTER_CLASS = "crawlkit.dupefilters.CompactDupeFilter"
+
+import hashlib
+import math
+import mmap
+import struct
+import tempfile
+from pathlib import Path
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+
+def allocate(size, spill_dir=None):
+    # zeroed buffer of `size` bytes, a memory mapped temporary file when spilling
+    if spill_dir is None:
+        return bytearray(size)
+    with tempfile.TemporaryFile(dir=spill_dir) as f:
+        f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+
+def to_bytes(fp):
+    return bytes.fromhex(fp) if isinstance(fp, str) else fp
+
+
+class FingerprintTable:
+    # Set of fixed width binary fingerprints, linear probing in a flat buffer.
+    # Fingerprints are SHA1 digests, so their leading bytes are already
+    # uniformly distributed and used as the hash.
+
+    max_load = 0.7
+
+    def __init__(self, width=8, capacity=65536, spill_dir=None):
+        self.width = width
+        self.spill_dir = spill_dir
+        self.empty = bytes(width)
+        slots = 1
+        while slots * self.max_load < capacity:
+            slots *= 2
+        self.resize(slots)
+
+    def resize(self, slots):
+        old, old_slots = getattr(self, 'data', None), getattr(self, 'slots', 0)
+        self.slots = slots
+        self.mask = slots - 1
+        self.limit = int(slots * self.max_load)
+        self.data = allocate(slots * self.width, self.spill_dir)
+        self.count = 0
+        width = self.width
+        for offset in range(0, old_slots * width, width):
+            key = old[offset:offset + width]
+            if key != self.empty:
+                self.insert(key)
+        if isinstance(old, mmap.mmap):
+            old.close()
+
+    def key(self, fp):
+        key = to_bytes(fp)[:self.width]
+        # the all zero key marks empty slots
+        return key if key != self.empty else b'\x01' + key[1:]
+
+    def probe(self, key):
+        # (found, offset of the key or of the empty slot where it belongs)
+        width, data, empty = self.width, self.data, self.empty
+        index = int.from_bytes(key, 'little') & self.mask
+        while True:
+            offset = index * width
+            slot = data[offset:offset + width]
+            if slot == key:
+                return True, offset
+            if slot == empty:
+                return False, offset
+            index = (index + 1) & self.mask
+
+    def insert(self, key):
+        found, offset = self.probe(key)
+        if found:
+            return False
+        self.data[offset:offset + self.width] = key
+        self.count += 1
+        return True
+
+    def add(self, fp):
+        """Adds `fp` (bytes or hex str), returns False if it was already there."""
+        if self.count >= self.limit:
+            self.resize(self.slots * 2)
+        return self.insert(self.key(fp))
+
+    def update(self, fps):
+        for fp in fps:
+            self.add(fp)
+
+    def __contains__(self, fp):
+        return self.probe(self.key(fp))[0]
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return len(self.data)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate, spill_dir=None):
+        self.capacity = capacity
+        # k = log2(1 / error_rate) hashes rounded up, and the bits sized from
+        # k so that half of them are set at capacity: the false positive rate
+        # is then 2^-k <= error_rate (rounding k to the nearest and sizing the
+        # bits from the unrounded optimum lands above error_rate when k rounds down)
+        self.hashes = max(1, int(math.ceil(-math.log2(error_rate))))
+        self.bits = max(8, int(math.ceil(capacity * self.hashes / math.log(2))))
+        self.data = allocate((self.bits + 7) // 8, spill_dir)
+        self.count = 0
+
+    def positions(self, words):
+        # the i-th hash function is the i-th word modulo the number of bits
+        bits = self.bits
+        return [words[i] % bits for i in range(self.hashes)]
+
+    def contains(self, words):
+        data, bits = self.data, self.bits
+        for i in range(self.hashes):
+            pos = words[i] % bits
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, words):
+        data = self.data
+        for pos in self.positions(words):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    # Chain of Bloom filters, each twice as large as the previous one with half
+    # its error rate, so the total false positive rate stays under `error_rate`
+    # however many fingerprints are added (Almeida et al., 2007).
+
+    growth = 2
+    tightening = 0.5
+
+    def __init__(self, error_rate=1e-6, capacity=65536, spill_dir=None):
+        self.error_rate = error_rate
+        self.initial_capacity = capacity
+        self.spill_dir = spill_dir
+        self.filters = []
+        self.count = 0
+
+    def words(self, fp):
+        # One independent 64 bit word per hash function of the last filter (the
+        # one with the most), from SHAKE128 of the fingerprint. Double hashing
+        # of the two halves of the fingerprint (h1 + i * h2) made the positions
+        # of small filters correlated enough to triple their false positive rate.
+        count = self.filters[-1].hashes if self.filters else 0
+        return struct.unpack('<%dQ' % count, hashlib.shake_128(to_bytes(fp)).digest(8 * count))
+
+    def __contains__(self, fp):
+        words = self.words(fp)
+        return any(f.contains(words) for f in reversed(self.filters))
+
+    def add(self, fp):
+        """Adds `fp` (bytes or hex str), returns False if it was (probably) already there."""
+        words = self.words(fp)
+        if any(f.contains(words) for f in reversed(self.filters)):
+            return False
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.growth ** n,
+                self.error_rate * (1 - self.tightening) * self.tightening ** n,
+                self.spill_dir,
+            ))
+            words = self.words(fp)
+        self.filters[-1].add(words)
+        self.count += 1
+        return True
+
+    def update(self, fps):
+        for fp in fps:
+            self.add(fp)
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return sum(len(f.data) for f in self.filters)
+
+    def close(self):
+        for f in self.filters:
+            if isinstance(f.data, mmap.mmap):
+                f.data.close()
+
+
+class CompactDupeFilter(RFPDupeFilter):
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None, fingerprints=None):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.fingerprints = fingerprints if fingerprints is not None else FingerprintTable()
+        if path:
+            self.file = Path(path, "requests.seen").open("a+", encoding="utf-8")
+            self.file.seek(0)
+            self.fingerprints.update(x.rstrip() for x in self.file if x.strip())
+
+    @classmethod
+    def from_settings(cls, settings, *, fingerprinter=None):
+        return cls(job_dir(settings), settings.getbool('DUPEFILTER_DEBUG'),
+                   fingerprinter=fingerprinter, fingerprints=cls.make_fingerprints(settings))
+
+    @classmethod
+    def make_fingerprints(cls, settings):
+        return FingerprintTable(
+            width=settings.getint('DUPEFILTER_FINGERPRINT_BYTES', 8),
+            capacity=settings.getint('DUPEFILTER_CAPACITY', 65536),
+            spill_dir=settings.get('DUPEFILTER_SPILL_DIR'),
+        )
+
+    def request_seen(self, request):
+        fp = self.fingerprinter.fingerprint(request)
+        if not self.fingerprints.add(fp):
+            return True
+        if self.file:
+            self.file.write(fp.hex() + "\n")
+        return False
+
+    def close(self, reason):
+        super().close(reason)
+        self.fingerprints.close()
+
+
+class BloomDupeFilter(CompactDupeFilter):
+
+    @classmethod
+    def make_fingerprints(cls, settings):
+        return ScalableBloomFilter(
+            error_rate=settings.getfloat('DUPEFILTER_ERROR_RATE', 1e-6),
+            capacity=settings.getint('DUPEFILTER_CAPACITY', 65536),
+            spill_dir=settings.get('DUPEFILTER_SPILL_DIR'),
+        )
@@ -0,0 +1,303 @@
+# Catalog size estimation (CATALOG_ESTIMATE).
+#
+# Sizing a crawl needs the number of products per site and category, which
+# otherwise takes a full crawl. With CATALOG_ESTIMATE the spiders walk their
+# nav as usual but request no product page: the first page of every listing
+# gives the size of its category from what the site exposes, with a few more
+# listing pages where it exposes no count.
+#
+#   total     the count shown on the listing (Arket's totalCnt), exact
+#   pages     the number of pages is shown (Mohagni's pagination): the last
+#             page is fetched for a random CATALOG_ESTIMATE_SAMPLE share of the
+#             categories, the others get the mean fill of those last pages
+#   probe     only a next page link (The Sting, the Marc Jacobs spinner): the
+#             page number of the next page URL is probed, doubling until a page
+#             comes back empty or short and then bisecting, at most
+#             CATALOG_ESTIMATE_MAX_PROBES pages per category; a page out of
+#             range answering 404 or 410 counts as empty
+#
+# A probe failing otherwise (after the retries) stops the probing of its
+# category, which keeps the bounds of the pages fetched so far.
+#
+# Every category gets hard bounds (low, high: what the fetched pages allow,
+# high is None while the last page is not bounded) and a point estimate. The
+# report, written to CATALOG_ESTIMATE_FILE when the spider closes, adds the
+# totals per country with a 95% interval for the sampled last page fills.
+# Products listed in several categories are counted in each of them.
+#
+#   scrapy crawl mohangi -s CATALOG_ESTIMATE=1 -s CATALOG_ESTIMATE_SAMPLE=0.5
+#
+# Stats: estimate/categories, estimate/exact, estimate/probes,
+# estimate/probe_errors, estimate/products (the point estimate of all
+# categories).
+
+import json
+import logging
+import math
+import os
+import random
+import time
+
+from scrapy import Request, signals
+
+logger = logging.getLogger(__name__)
+
+
+# statuses of a listing page out of range on sites that don't serve it empty
+PAST_LAST_PAGE = [404, 410]
+
+
+class CategoryEstimate:
+
+    def __init__(self, response, country, categories, method, page_size):
+        self.country = country
+        self.categories = categories
+        self.url = response.url
+        # probes go through the download slot of the listing
+        self.meta = {key: response.meta[key] for key in ('download_slot',) if key in response.meta}
+        self.method = method
+        self.page_size = page_size
+        # product count bounds, high is None while unbounded
+        self.low = self.high = None
+        # number of pages, when known
+        self.pages = None
+        # probing: next page URL, highest full page, lowest empty page and the
+        # first tile of page 1 (sites serving page 1 for pages out of range)
+        self.next_url = None
+        self.full_page = 1
+        self.empty_page = None
+        self.first_tile = None
+        self.probes = 0
+
+    @property
+    def exact(self):
+        return self.low is not None and self.low == self.high
+
+    def resolve(self, count, pages):
+        self.low = self.high = count
+        self.pages = pages
+
+    def estimate(self, last_page_fill=None):
+        if self.exact or self.high is None:
+            return self.low
+        if self.method == 'pages' and last_page_fill is not None:
+            return (self.pages - 1) * self.page_size + last_page_fill
+        return (self.low + self.high) / 2
+
+    def as_dict(self, last_page_fill=None):
+        return {
+            'country': self.country,
+            'categories': self.categories,
+            'url': self.url,
+            'method': self.method,
+            'page_size': self.page_size,
+            'pages': self.pages,
+            'low': self.low,
+            'estimate': self.estimate(last_page_fill),
+            'high': self.high,
+            'exact': self.exact,
+        }
+
+
+class CatalogEstimate:
+
+    def __init__(self, crawler, path, sample, max_probes):
+        self.crawler = crawler
+        self.path = path
+        self.sample = sample
+        self.max_probes = max_probes
+        self.random = random.Random()
+        # listing url -> CategoryEstimate
+        self.categories = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, spider_name):
+        settings = crawler.settings
+        path = settings.get('CATALOG_ESTIMATE_FILE', '%(spider)s.estimate.json') % {'spider': spider_name}
+        estimate = cls(crawler, path, settings.getfloat('CATALOG_ESTIMATE_SAMPLE', 0.2),
+                       settings.getint('CATALOG_ESTIMATE_MAX_PROBES', 16))
+        crawler.signals.connect(estimate.spider_closed, signal=signals.spider_closed)
+        return estimate
+
+    def add(self, estimate):
+        # a listing reached again through another nav path is estimated once,
+        # None then
+        if estimate.url in self.categories:
+            return None
+        self.categories[estimate.url] = estimate
+        self.crawler.stats.inc_value('estimate/categories')
+        return estimate
+
+    def last_page_fill(self):
+        # fills of the last pages fetched for the 'pages' categories
+        fills = [category.low - (category.pages - 1) * category.page_size for category in self.categories.values()
+                 if category.method == 'pages' and category.exact and category.pages > 1]
+        if not fills:
+            return None, None, 0
+        mean = sum(fills) / len(fills)
+        # too few samples for a variance, the interval is then the hard bounds
+        variance = sum((fill - mean) ** 2 for fill in fills) / (len(fills) - 1) if len(fills) > 1 else None
+        return mean, variance, len(fills)
+
+    def report(self):
+        mean, variance, sampled = self.last_page_fill()
+        countries = {}
+        for category in self.categories.values():
+            total = countries.setdefault(category.country, {
+                'categories': 0, 'exact': 0, 'products': 0, 'low': 0, 'high': 0, 'unbounded': 0, 'unsampled': 0})
+            total['categories'] += 1
+            total['exact'] += category.exact
+            total['products'] += category.estimate(mean)
+            total['low'] += category.low
+            if category.high is None:
+                total['unbounded'] += 1
+            else:
+                total['high'] += category.high
+            if category.method == 'pages' and not category.exact:
+                total['unsampled'] += 1
+        for total in countries.values():
+            # 95% interval of the sum of the unsampled last page fills, within the hard bounds
+            margin = 0
+            if total['unsampled']:
+                unsampled = total['unsampled']
+                margin = (math.inf if variance is None
+                          else 1.96 * math.sqrt(variance * unsampled * (1 + unsampled / sampled)))
+            total['low95'] = max(total['low'], total['products'] - margin)
+            total['high95'] = None if total['unbounded'] else min(total['high'], total['products'] + margin)
+            if total['unbounded']:
+                total['high'] = None
+        return {
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'last_page_fill': {'mean': mean, 'sampled': sampled},
+            'countries': countries,
+            'categories': [category.as_dict(mean) for category in self.categories.values()],
+        }
+
+    def spider_closed(self, spider, reason):
+        report = self.report()
+        products = 0
+        for country, total in sorted(report['countries'].items()):
+            products += total['products']
+            logger.info("Estimated %d products in %d categories for %s (95%% interval %d-%s, %d categories exact)",
+                        total['products'], total['categories'], country, total['low95'],
+                        '?' if total['high95'] is None else '%d' % total['high95'], total['exact'],
+                        extra={'spider': spider})
+        self.crawler.stats.set_value('estimate/products', int(products))
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, spider=spider.name, reason=reason), f, ensure_ascii=False, indent=1)
+        logger.info("Wrote the catalog estimate to %s", self.path, extra={'spider': spider})
+
+
+class CatalogEstimateMixin:
+    # The spider's listing callbacks call one of the estimate_from_total,
+    # estimate_from_pages and estimate_by_probing methods when
+    # catalog_estimate is set. estimate_from_pages needs the spider to define
+    # estimate_tiles, estimate_by_probing needs estimate_tiles and
+    # estimate_page_url; a spider only using estimate_from_total (Arket)
+    # defines neither.
+
+    # CatalogEstimate, set by setup_catalog_estimate when CATALOG_ESTIMATE
+    catalog_estimate = None
+
+    def setup_catalog_estimate(self, crawler):
+        if crawler.settings.getbool('CATALOG_ESTIMATE'):
+            self.catalog_estimate = CatalogEstimate.from_crawler(crawler, self.name)
+
+    def estimate_tiles(self, response):
+        """Product urls on a listing page."""
+        raise NotImplementedError("%s must define estimate_tiles to estimate from pages or by probing"
+                                  % type(self).__name__)
+
+    def estimate_page_url(self, next_url, page, page_size):
+        """Url of the 1-based `page` of the listing whose second page is `next_url`."""
+        raise NotImplementedError("%s must define estimate_page_url to estimate by probing" % type(self).__name__)
+
+    def estimate_from_total(self, response, country, categories, total, page_size):
+        category = self.catalog_estimate.add(
+            CategoryEstimate(response, country, categories, 'total', page_size))
+        if category is None:
+            return ()
+        category.resolve(total, -(-total // page_size) if page_size else 1)
+        self.crawler.stats.inc_value('estimate/exact')
+        return ()
+
+    def estimate_from_pages(self, response, country, categories, pages, last_page_url):
+        tiles = self.estimate_tiles(response)
+        category = self.catalog_estimate.add(
+            CategoryEstimate(response, country, categories, 'pages', len(tiles)))
+        if category is None:
+            return
+        if pages <= 1:
+            category.resolve(len(tiles), 1)
+            self.crawler.stats.inc_value('estimate/exact')
+            return
+        category.pages = pages
+        category.low = (pages - 1) * len(tiles) + 1
+        category.high = pages * len(tiles)
+        if self.catalog_estimate.random.random() < self.catalog_estimate.sample:
+            yield self.estimate_probe(category, last_page_url, pages)
+
+    def estimate_by_probing(self, response, country, categories, next_url):
+        tiles = self.estimate_tiles(response)
+        category = self.catalog_estimate.add(
+            CategoryEstimate(response, country, categories, 'probe', len(tiles)))
+        if category is None:
+            return
+        if not next_url or not tiles:
+            category.resolve(len(tiles), 1)
+            self.crawler.stats.inc_value('estimate/exact')
+            return
+        category.next_url = next_url
+        category.first_tile = tiles[0]
+        category.low = len(tiles)
+        yield self.estimate_probe(category, self.estimate_page_url(next_url, 2, len(tiles)), 2)
+
+    def estimate_probe(self, category, url, page):
+        category.probes += 1
+        self.crawler.stats.inc_value('estimate/probes')
+        # listings sharing their pages (a nav level showing its first leaf) probe them each
+        return Request(url, self.parse_estimate_probe, errback=self.estimate_probe_failed, dont_filter=True,
+                       meta=dict(category.meta, estimate_listing=category.url, estimate_page=page,
+                                 handle_httpstatus_list=PAST_LAST_PAGE))
+
+    def estimate_probe_failed(self, failure):
+        # the category keeps the bounds it has
+        category = self.catalog_estimate.categories[failure.request.meta['estimate_listing']]
+        self.crawler.stats.inc_value('estimate/probe_errors')
+        logger.warning("Catalog estimate probe of page %d of %s failed: %s", failure.request.meta['estimate_page'],
+                       category.url, failure.value, extra={'spider': self})
+
+    def parse_estimate_probe(self, response):
+        category = self.catalog_estimate.categories[response.meta['estimate_listing']]
+        page, size = response.meta['estimate_page'], category.page_size
+        if response.status in PAST_LAST_PAGE:
+            if category.method == 'pages':
+                # the shown last page is gone, the bounds stay
+                return
+            tiles = []
+        else:
+            tiles = self.estimate_tiles(response)
+        if tiles and tiles[0] == category.first_tile:
+            # page 1 served again for a page out of range
+            tiles = []
+        if category.method == 'pages':
+            category.resolve((page - 1) * size + len(tiles), page)
+        elif 0 < len(tiles) < size:
+            category.resolve((page - 1) * size + len(tiles), page)
+        elif tiles:
+            category.full_page = max(category.full_page, page)
+        else:
+            category.empty_page = min(category.empty_page or page, page)
+        if category.method == 'probe' and not category.exact:
+            category.low = category.full_page * size
+            category.high = (category.empty_page - 1) * size if category.empty_page else None
+            if category.empty_page == category.full_page + 1:
+                # the last page is exactly full
+                category.resolve(category.full_page * size, category.full_page)
+            elif category.probes < self.catalog_estimate.max_probes:
+                page = (category.full_page * 2 if category.empty_page is None
+                        else (category.full_page + category.empty_page) // 2)
+                yield self.estimate_probe(category, self.estimate_page_url(category.next_url, page, size), page)
+        if category.exact:
+            self.crawler.stats.inc_value('estimate/exact')
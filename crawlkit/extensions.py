@@ -0,0 +1,138 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet import task
+from twisted.web import resource, server
+
+from .instrumentation import LATENCY_BUCKETS, Histogram, get_rss
+from .middlewares import item_pipeline_started
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, extension):
+        super().__init__()
+        self.extension = extension
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.extension.body
+
+
+class PrometheusMetrics:
+    # Serves live crawl metrics in the Prometheus text format on
+    # METRICS_HOST:METRICS_PORT (first free port of the range).
+    #
+    # The metrics text is rebuilt every METRICS_INTERVAL seconds from counters
+    # the engine already keeps, and HTTP requests only return that snapshot, so
+    # scraping the endpoint never does work on the reactor thread. The pipeline
+    # latency needs PipelineTimerMiddleware (see crawlkit/middlewares.py).
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.host = settings.get('METRICS_HOST', '127.0.0.1')
+        self.portrange = [int(x) for x in settings.getlist('METRICS_PORT', [9410, 9450])]
+        self.interval = settings.getfloat('METRICS_INTERVAL', 5.0)
+        self.pipeline_latency = Histogram(LATENCY_BUCKETS)
+        # id(item) -> time it entered the pipelines. Items can be dicts or
+        # slotted objects, which can't be weakly referenced; every item handed
+        # to the pipelines ends with one of the done signals, which removes it
+        self.pipeline_started = {}
+        self.body = b''
+        self.port = None
+        self.task = None
+        self.last_items = 0
+        self.last_time = None
+        self.items_per_sec = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.item_started, signal=item_pipeline_started)
+        crawler.signals.connect(s.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(s.item_done, signal=signals.item_error)
+        return s
+
+    def engine_started(self):
+        self.port = listen_tcp(self.portrange, self.host, server.Site(MetricsResource(self)))
+        h = self.port.getHost()
+        self.crawler.spider.logger.info("Metrics endpoint listening on http://%s:%d/metrics" % (h.host, h.port))
+        self.last_time = time.monotonic()
+        self.task = task.LoopingCall(self.update)
+        self.task.start(self.interval)
+
+    def item_started(self, item, spider):
+        self.pipeline_started[id(item)] = time.monotonic()
+
+    def item_done(self, item, spider, **kwargs):
+        started = self.pipeline_started.pop(id(item), None)
+        if started is not None:
+            self.pipeline_latency.observe(time.monotonic() - started)
+
+    def update(self):
+        engine = self.crawler.engine
+        stats = self.crawler.stats
+        spider = self.crawler.spider
+        if engine is None or spider is None:
+            return
+        label = 'spider="%s"' % spider.name
+
+        now = time.monotonic()
+        items = stats.get_value('item_scraped_count', 0)
+        self.items_per_sec = (items - self.last_items) / max(now - self.last_time, 1e-9)
+        self.last_items, self.last_time = items, now
+
+        scheduler = engine.slot.scheduler if engine.slot else None
+        lines = [
+            '# TYPE scrapy_items_scraped_total counter',
+            'scrapy_items_scraped_total{%s} %d' % (label, items),
+            '# TYPE scrapy_items_per_second gauge',
+            'scrapy_items_per_second{%s} %.3f' % (label, self.items_per_sec),
+            '# TYPE scrapy_responses_received_total counter',
+            'scrapy_responses_received_total{%s} %d' % (label, stats.get_value('response_received_count', 0)),
+            '# TYPE scrapy_scheduler_queue_depth gauge',
+            'scrapy_scheduler_queue_depth{%s} %d' % (label, len(scheduler) if scheduler is not None else 0),
+            '# TYPE scrapy_inflight_requests gauge',
+        ]
+        for key, slot in list(engine.downloader.slots.items()):
+            lines.append('scrapy_inflight_requests{%s,slot="%s"} %d' % (label, key, len(slot.active)))
+
+        lines.append('# TYPE scrapy_pipeline_queue_depth gauge')
+        lines.append('scrapy_pipeline_queue_depth{%s} %d' % (
+            label, engine.scraper.slot.itemproc_size if engine.scraper.slot else 0))
+        lines.append('# TYPE scrapy_pipeline_latency_seconds histogram')
+        for bound, count in self.pipeline_latency.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('scrapy_pipeline_latency_seconds_bucket{%s,le="%s"} %d' % (label, le, count))
+        lines.append('scrapy_pipeline_latency_seconds_sum{%s} %.6f' % (label, self.pipeline_latency.sum))
+        lines.append('scrapy_pipeline_latency_seconds_count{%s} %d' % (label, self.pipeline_latency.count))
+
+        # len() of the dupefilters is kept in memory, for FrontierDupeFilter it
+        # counts the fingerprints this worker added
+        dupefilter = getattr(scheduler, 'df', None)
+        seen = len(dupefilter) if hasattr(dupefilter, '__len__') else len(getattr(dupefilter, 'fingerprints', ()))
+        lines.append('# TYPE scrapy_dupefilter_size gauge')
+        lines.append('scrapy_dupefilter_size{%s} %d' % (label, seen))
+        lines.append('# TYPE process_resident_memory_bytes gauge')
+        lines.append('process_resident_memory_bytes{%s} %d' % (label, get_rss()))
+        self.body = ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+        if self.port is not None:
+            self.port.stopListening()
@@ -0,0 +1,183 @@
+# Extraction cache (EXTRACTION_CACHE_ENABLED).
+#
+# Product pages often come back byte-identical from one crawl to the next, and
+# parsing them again gives the same items. With EXTRACTION_CACHE_ENABLED the
+# items of the spider's offloadable extraction methods (see offload.py) are
+# stored in EXTRACTION_CACHE_DIR/<spider>.db, keyed by a hash of the method,
+# the response url and body and the response meta keys of `offload_meta`:
+# that is all such a method may read, so the stored items are the ones it
+# would build. A response with the same key gets its items from the cache
+# without parsing the body (nor sending it to the parse workers).
+#
+# Every entry records a version of the code, a hash of the source files of the
+# spider's project package and of crawlkit, and of the scrapy and parsel
+# versions. Entries of another version are dropped when the spider opens, so
+# any change to the spider, its items or its helpers invalidates the cache. The
+# cache keeps at most EXTRACTION_CACHE_SIZE bytes of item data, the entries
+# used least recently are evicted first.
+#
+# Spiders list ExtractionCacheMixin before ParseOffloadMixin in their bases,
+# it wraps `offload`.
+#
+#   scrapy crawl thesting -s EXTRACTION_CACHE_ENABLED=1
+#
+# Stats: extraction_cache/hits, extraction_cache/misses,
+# extraction_cache/stored, extraction_cache/evicted,
+# extraction_cache/invalidated (entries of an older version dropped).
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import parsel
+import scrapy
+from itemadapter import ItemAdapter, is_item
+from scrapy import signals
+from twisted.internet.defer import Deferred
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+# writes between two commits
+COMMIT_EVERY = 500
+
+
+def code_version(spidercls):
+    """Hash of the source files of the package of `spidercls` and of crawlkit, and of the scrapy and parsel versions."""
+    digest = hashlib.blake2b(digest_size=16)
+    for package in (sys.modules[spidercls.__module__.split('.')[0]], sys.modules[__package__]):
+        root = os.path.dirname(package.__file__)
+        for path in sorted(glob.glob(os.path.join(root, '**', '*.py'), recursive=True)):
+            digest.update(os.path.relpath(path, os.path.dirname(root)).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    digest.update(('scrapy %s parsel %s' % (scrapy.__version__, parsel.__version__)).encode())
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+
+    def __init__(self, crawler, path, max_size, version):
+        self.crawler = crawler
+        self.path = path
+        self.max_size = max_size
+        self.version = version
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.con = sqlite3.connect(path)
+        self.con.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, version TEXT, data TEXT, "
+                         "size INTEGER, used REAL)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.invalidated = self.con.execute("DELETE FROM entries WHERE version != ?", (version,)).rowcount
+        self.con.commit()
+        self.size = self.con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.writes = 0
+
+    @classmethod
+    def from_crawler(cls, crawler, spidercls):
+        settings = crawler.settings
+        path = os.path.join(settings.get('EXTRACTION_CACHE_DIR', 'extractcache'), '%s.db' % spidercls.name)
+        cache = cls(crawler, path, settings.getint('EXTRACTION_CACHE_SIZE', 256 * 1024 * 1024),
+                    code_version(spidercls))
+        crawler.signals.connect(cache.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(cache.spider_closed, signal=signals.spider_closed)
+        return cache
+
+    def spider_opened(self, spider):
+        # the stats collector is not there yet when the cache is created
+        if self.invalidated:
+            self.crawler.stats.set_value('extraction_cache/invalidated', self.invalidated)
+            logger.info("Dropped %d extraction cache entries of an older code version", self.invalidated,
+                        extra={'spider': spider})
+
+    def key(self, method, response, meta):
+        digest = hashlib.blake2b(digest_size=20)
+        # stdlib json for the sorted keys and repr() of values json can't
+        # encode, the key must not depend on the codec backend
+        digest.update(json.dumps([method, response.url, meta], sort_keys=True, default=repr).encode())
+        digest.update(response.body)
+        return digest.digest()
+
+    def get(self, key):
+        """The items stored under `key` as dicts, None when not cached."""
+        row = self.con.execute("SELECT data FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.crawler.stats.inc_value('extraction_cache/misses')
+            return None
+        self.crawler.stats.inc_value('extraction_cache/hits')
+        self.con.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        self.written()
+        return codec.loads(row[0])
+
+    def set(self, key, results):
+        try:
+            data = codec.dumps(results)
+        except (TypeError, ValueError):
+            # items with values json can't encode are not cached
+            return
+        previous = self.con.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        self.con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                         (key, self.version, data, len(data), time.time()))
+        self.size += len(data) - (previous[0] if previous else 0)
+        self.crawler.stats.inc_value('extraction_cache/stored')
+        if self.size > self.max_size:
+            self.evict()
+        self.written()
+
+    def evict(self):
+        # least recently used entries first, down to 90% of the size so that
+        # the next stores don't evict again right away
+        while self.size > self.max_size * 0.9:
+            rows = self.con.execute("SELECT key, size FROM entries ORDER BY used LIMIT 100").fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for key, size in rows:
+                self.con.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.size -= size
+                self.crawler.stats.inc_value('extraction_cache/evicted')
+                if self.size <= self.max_size * 0.9:
+                    break
+
+    def written(self):
+        self.writes += 1
+        if self.writes >= COMMIT_EVERY:
+            self.con.commit()
+            self.writes = 0
+
+    def spider_closed(self, spider, reason):
+        self.con.commit()
+        self.con.close()
+
+
+class ExtractionCacheMixin:
+    # ExtractionCache, set by setup_extraction_cache when EXTRACTION_CACHE_ENABLED
+    extraction_cache = None
+
+    def setup_extraction_cache(self, crawler):
+        if crawler.settings.getbool('EXTRACTION_CACHE_ENABLED'):
+            self.extraction_cache = ExtractionCache.from_crawler(crawler, type(self))
+
+    def offload(self, response, method):
+        """Output of the extraction method `method` for the response, from the cache when it has it."""
+        if self.extraction_cache is None:
+            return super().offload(response, method)
+        meta = {key: response.meta[key] for key in self.offload_meta if key in response.meta}
+        key = self.extraction_cache.key(method, response, meta)
+        cached = self.extraction_cache.get(key)
+        if cached is not None:
+            return [self.offload_item(data) for data in cached]
+        result = super().offload(response, method)
+        if isinstance(result, Deferred):
+            return result.addCallback(self.cache_extraction, key)
+        return self.cache_extraction(list(result or ()), key)
+
+    def cache_extraction(self, results, key):
+        if all(is_item(result) for result in results):
+            self.extraction_cache.set(key, [ItemAdapter(result).asdict() for result in results])
+        return results
@@ -0,0 +1,324 @@
+# Shared crawl frontier for running one spider in several worker processes.
+#
+# FrontierScheduler and FrontierDupeFilter keep the pending requests and the
+# seen fingerprints in one SQLite file (FRONTIER_PATH, WAL mode), so every
+# worker started by crawlkit.launcher pulls from the same queue and filters
+# against the same dedup state. Requests are claimed in small batches
+# (FRONTIER_BATCH_SIZE). A request handed to the engine stays in the table as
+# leased until the spider callback of its response has run and the requests it
+# yielded are queued (FrontierLeaseMiddleware); a request that got no response
+# (dropped, failed, redirected or retried as a new request) keeps it until it
+# is garbage collected. Only then its row is deleted, so a worker that dies
+# before its callback ran leaves the request to the others. Every heartbeat
+# renews the leases of the worker; the claimed and leased rows of a worker that
+# stopped beating for FRONTIER_LEASE_TIMEOUT seconds (it crashed or was killed)
+# are handed back to the queue for the other workers. A worker that closes
+# releases its rows itself, and the launcher releases what is left before the
+# next run.
+#
+#   SCHEDULER = "crawlkit.frontier.FrontierScheduler"
+#   DUPEFILTER_CLASS = "crawlkit.frontier.FrontierDupeFilter"
+#   SPIDER_MIDDLEWARES = {"crawlkit.frontier.FrontierLeaseMiddleware": 1}
+
+import gc
+import json
+import os
+import pickle
+import sqlite3
+import time
+import weakref
+
+from scrapy import signals
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.misc import create_instance, load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+
+PENDING, CLAIMED, LEASED = 0, 1, 2
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        priority INTEGER,
+        state INTEGER DEFAULT 0,
+        worker TEXT,
+        leased_at REAL,
+        data BLOB
+    );
+    CREATE INDEX IF NOT EXISTS requests_pending ON requests (state, priority DESC, id);
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        fp BLOB PRIMARY KEY
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS workers (
+        worker TEXT PRIMARY KEY,
+        busy INTEGER,
+        heartbeat REAL
+    );
+"""
+
+
+def frontier_path(settings, spider_name):
+    return settings.get('FRONTIER_PATH', '%(spider)s.frontier.sqlite') % {'spider': spider_name}
+
+
+def connect(path):
+    con = sqlite3.connect(path, timeout=60, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.executescript(SCHEMA)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(requests)")]
+    if 'leased_at' not in columns:
+        # frontier kept by --resume from before the leases
+        con.execute("ALTER TABLE requests ADD COLUMN leased_at REAL")
+    return con
+
+
+def prepare_frontier(path, workers):
+    """
+    Releases requests claimed or leased by workers of a previous run and registers the
+    workers about to start as busy, so none of them stops before the others
+    had a chance to enqueue their start requests.
+    """
+    con = connect(path)
+    con.execute("UPDATE requests SET state = ?, worker = NULL WHERE state IN (?, ?)", (PENDING, CLAIMED, LEASED))
+    con.execute("DELETE FROM workers")
+    con.executemany("INSERT INTO workers (worker, busy, heartbeat) VALUES (?, 1, ?)",
+                    [(worker, time.time()) for worker in workers])
+    con.close()
+
+
+class FrontierDupeFilter(BaseDupeFilter):
+
+    def __init__(self, path, fingerprinter):
+        self.path = path
+        self.fingerprinter = fingerprinter
+        self.con = None
+        # fingerprints added by this worker; the size of the shared table
+        # would be a COUNT(*) on every call
+        self.added = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(frontier_path(crawler.settings, crawler.spidercls.name), crawler.request_fingerprinter)
+
+    def open(self):
+        self.con = connect(self.path)
+
+    def request_seen(self, request):
+        fp = self.fingerprinter.fingerprint(request)
+        # the insert is atomic across workers: only the first one to see a fingerprint adds it
+        if self.con.execute("INSERT OR IGNORE INTO fingerprints (fp) VALUES (?)", (fp,)).rowcount == 0:
+            return True
+        self.added += 1
+        return False
+
+    def __len__(self):
+        return self.added
+
+    def close(self, reason):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+
+class FrontierScheduler:
+
+    def __init__(self, crawler, dupefilter, path, worker, batch_size, heartbeat_interval, lease_timeout, stats_path):
+        self.crawler = crawler
+        self.path = path
+        self.stats = crawler.stats
+        self.df = dupefilter
+        self.worker = worker
+        self.batch_size = batch_size
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.stats_path = stats_path
+        self.spider = None
+        self.con = None
+        self.claimed = []
+        # request -> finalizer deleting its row, called by release() or when
+        # the request is garbage collected
+        self.leases = weakref.WeakKeyDictionary()
+        self.finished = []
+        self.empty_since = None
+        self.heartbeat = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = create_instance(load_object(settings['DUPEFILTER_CLASS']), settings, crawler)
+        s = cls(
+            crawler,
+            dupefilter,
+            frontier_path(settings, crawler.spidercls.name),
+            settings.get('FRONTIER_WORKER') or str(os.getpid()),
+            settings.getint('FRONTIER_BATCH_SIZE', 16),
+            settings.getfloat('FRONTIER_HEARTBEAT', 0.5),
+            settings.getfloat('FRONTIER_LEASE_TIMEOUT', 60),
+            settings.get('FRONTIER_STATS_PATH'),
+        )
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def open(self, spider):
+        self.spider = spider
+        self.con = connect(self.path)
+        self.con.execute("INSERT OR REPLACE INTO workers (worker, busy, heartbeat) VALUES (?, 1, ?)",
+                         (self.worker, time.time()))
+        self.heartbeat = task.LoopingCall(self.beat)
+        self.heartbeat.start(self.heartbeat_interval, now=False)
+        return self.df.open()
+
+    def close(self, reason):
+        if self.heartbeat and self.heartbeat.running:
+            self.heartbeat.stop()
+        # finalizes the crawled requests only kept alive by reference cycles
+        # (the failures of download errors)
+        gc.collect()
+        self.delete_finished()
+        # hand back what this worker claimed or leased but did not crawl
+        self.con.execute("UPDATE requests SET state = ?, worker = NULL WHERE state IN (?, ?) AND worker = ?",
+                         (PENDING, CLAIMED, LEASED, self.worker))
+        self.con.execute("DELETE FROM workers WHERE worker = ?", (self.worker,))
+        self.claimed = []
+        for lease in list(self.leases.values()):
+            lease.detach()
+        self.leases.clear()
+        self.con.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return bool(self.claimed) or self.claim() > 0
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        self.con.execute("INSERT INTO requests (priority, data) VALUES (?, ?)", (request.priority, data))
+        self.empty_since = None
+        self.stats.inc_value('scheduler/enqueued/frontier', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        if not self.claimed and not self.claim():
+            return None
+        row_id, data = self.claimed.pop()
+        self.con.execute("UPDATE requests SET state = ?, leased_at = ? WHERE id = ?", (LEASED, time.time(), row_id))
+        request = request_from_dict(pickle.loads(data), spider=self.spider)
+        self.leases[request] = weakref.finalize(request, self.finish, row_id)
+        self.stats.inc_value('scheduler/dequeued/frontier', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def claim(self):
+        # Claim up to batch_size requests for this worker. An empty queue is only
+        # queried again after a heartbeat, other workers may fill it meanwhile.
+        if self.empty_since is not None and time.monotonic() - self.empty_since < self.heartbeat_interval:
+            return 0
+        now = time.time()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            # the leases of a worker that stopped renewing them go back to the queue
+            expired = self.con.execute(
+                "UPDATE requests SET state = ?, worker = NULL WHERE state IN (?, ?) AND leased_at < ?",
+                (PENDING, CLAIMED, LEASED, now - self.lease_timeout)).rowcount
+            rows = self.con.execute(
+                "SELECT id, data FROM requests WHERE state = ? ORDER BY priority DESC, id LIMIT ?",
+                (PENDING, self.batch_size)).fetchall()
+            self.con.executemany("UPDATE requests SET state = ?, worker = ?, leased_at = ? WHERE id = ?",
+                                 [(CLAIMED, self.worker, now, row_id) for row_id, _ in rows])
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        # highest priority last, next_request() pops from the end
+        self.claimed = rows[::-1] + self.claimed
+        self.empty_since = None if rows else time.monotonic()
+        if expired:
+            self.stats.inc_value('frontier/leases_expired', expired, spider=self.spider)
+        return len(rows)
+
+    def finish(self, row_id):
+        self.finished.append(row_id)
+
+    def release(self, request):
+        lease = self.leases.pop(request, None)
+        if lease is not None:
+            lease()
+
+    def delete_finished(self):
+        if not self.finished:
+            return
+        finished, self.finished = self.finished, []
+        self.con.executemany("DELETE FROM requests WHERE id = ?", [(row_id,) for row_id in finished])
+        self.stats.inc_value('frontier/leases_released', len(finished), spider=self.spider)
+
+    def __len__(self):
+        if self.con is None:
+            return len(self.claimed)
+        return len(self.claimed) + self.con.execute(
+            "SELECT COUNT(*) FROM requests WHERE state = ?", (PENDING,)).fetchone()[0]
+
+    def beat(self):
+        engine = self.crawler.engine
+        # The engine only polls an empty scheduler every few seconds, wake it up
+        # as soon as other workers queued something
+        if not self.claimed and self.claim() and engine.slot is not None:
+            engine.slot.nextcall.schedule()
+        busy = not engine.spider_is_idle()
+        now = time.time()
+        self.delete_finished()
+        self.con.execute("UPDATE requests SET leased_at = ? WHERE state IN (?, ?) AND worker = ?",
+                         (now, CLAIMED, LEASED, self.worker))
+        self.con.execute("UPDATE workers SET busy = ?, heartbeat = ? WHERE worker = ?",
+                         (int(busy), now, self.worker))
+
+    def spider_idle(self, spider):
+        # Keep the worker alive while others still crawl, they may add requests
+        self.beat()
+        deadline = time.time() - 10 * self.heartbeat_interval
+        busy = self.con.execute("SELECT COUNT(*) FROM workers WHERE worker != ? AND busy = 1 AND heartbeat > ?",
+                                (self.worker, deadline)).fetchone()[0]
+        if busy or self.has_pending_requests():
+            raise DontCloseSpider
+
+    def spider_closed(self, spider, reason):
+        if not self.stats_path:
+            return
+        stats = {key: value if isinstance(value, (int, float, str)) else str(value)
+                 for key, value in self.stats.get_stats().items()}
+        with open(self.stats_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+
+class FrontierLeaseMiddleware:
+    # Releases the lease of a request once the callback of its response has
+    # run and everything it yielded has been handed to the engine (the
+    # requests are in the frontier then). Keep it closest to the engine (lowest
+    # order), the scraper consumes its output last.
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not issubclass(load_object(crawler.settings['SCHEDULER']), FrontierScheduler):
+            raise NotConfigured
+        return cls(crawler)
+
+    def release(self, response):
+        self.crawler.engine.slot.scheduler.release(response.request)
+
+    def process_spider_output(self, response, result, spider):
+        try:
+            yield from result
+        finally:
+            self.release(response)
+
+    def process_spider_exception(self, response, exception, spider):
+        # the callback failed, nothing left to schedule
+        self.release(response)
@@ -0,0 +1,196 @@
+# Items of the crawl projects, and their compact slotted variants
+# (COMPACT_ITEMS).
+
+from types import MappingProxyType
+
+import attr
+import scrapy
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
+
+class ProductItem(scrapy.Item):
+
+    url =scrapy.Field()
+    referer_url =scrapy.Field()
+
+    # 2-letter country codes (e.g. "US,FR,DE")
+    country_code =scrapy.Field()
+
+    # base of sku that is independent of color
+    # (e.g. 41371610LP(red), 41371610QW(blue) --> base_sku = 41371610)
+    # should be available on overview page to merge categories
+    base_sku =scrapy.Field()
+
+    # unique identifier of Product-color variation, e.g; 41371610_red
+    identifier =scrapy.Field()
+
+    title =scrapy.Field()
+    brand =scrapy.Field()
+    description_text =scrapy.Field()
+
+    # binary product availability
+    available =scrapy.Field()
+
+    # prices
+    old_price_text =scrapy.Field()
+    new_price_text =scrapy.Field()
+    currency =scrapy.Field()
+
+    # local language of description
+    language_code =scrapy.Field()
+
+    color_name =scrapy.Field()
+    # color code as specified by retailer, if available (e.g. "W57")
+    color_code =scrapy.Field()
+
+    category_names =scrapy.Field()
+
+    # list of image urls to be downloaded, in high quality
+    image_urls =scrapy.Field()
+    # downloaded images (url, path, checksum), filled by ContentImagesPipeline
+    images =scrapy.Field()
+
+    # Info for size and availability collections
+    # will be array of SizeItem objects
+    size_infos =scrapy.Field()
+
+    # Set this flag to True, if prices should be taken from SizeItem
+    # instead of ProductItem
+    use_size_level_prices =scrapy.Field()
+    
+
+    """
+    ADVANCED FIELDS
+    """
+    # timestamp of request download -> it will be added automatically for each spider
+    timestamp =scrapy.Field()
+
+
+# For size and availability
+class SizeItem(scrapy.Item):
+
+    # Those prices will only be used if use_size_level_prices=True on
+    # ProductItem
+    size_original_price_text =scrapy.Field()
+    size_current_price_text =scrapy.Field()
+
+    # identifier for SKU-model + size
+    size_identifier =scrapy.Field()
+    size_name =scrapy.Field()
+    stock =scrapy.Field()   # 0 = unavailable, 1 = available (default), 2 or more = available stock given on website
+
+
+class SlotsItem:
+    # dict-like access to the fields of a slotted attrs item, so spiders and
+    # pipelines can use it like a scrapy.Item (item['url'], item.get(...),
+    # 'size_infos' in item). Unset fields behave like missing keys.
+    __slots__ = ()
+
+    fields = {}
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError("%s does not support field: %s" % (self.__class__.__name__, key))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def __iter__(self):
+        return (key for key in self.fields if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.fields else default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self]
+
+    def copy(self):
+        item = self.__class__()
+        for key, value in self.items():
+            setattr(item, key, value)
+        return item
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+
+class SlotsItemAdapter(AdapterInterface):
+    # itemadapter support for SlotsItem. Without it the items are handled by
+    # the attrs adapter, which reads every field and fails on the unset ones
+    # (partial items such as the category items of sitemap discovery).
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, SlotsItem)
+
+    @classmethod
+    def get_field_meta_from_class(cls, item_class, field_name):
+        return MappingProxyType(item_class.fields[field_name])
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(item_class.fields)
+
+    def field_names(self):
+        return self.item.fields.keys()
+
+    def __getitem__(self, field_name):
+        return self.item[field_name]
+
+    def __setitem__(self, field_name, value):
+        self.item[field_name] = value
+
+    def __delitem__(self, field_name):
+        del self.item[field_name]
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+
+ItemAdapter.ADAPTER_CLASSES.appendleft(SlotsItemAdapter)
+
+
+def make_slots_item(name, item_class):
+    # attrs class with one slot per field of `item_class` and no per-instance
+    # dict; SlotsItemAdapter handles it for itemadapter
+    cls = attr.make_class(name, {field: attr.ib(init=False) for field in item_class.fields},
+                          bases=(SlotsItem,), slots=True, eq=False, repr=False)
+    cls.fields = {field: dict(meta) for field, meta in item_class.fields.items()}
+    return cls
+
+
+# Compact alternatives to ProductItem and SizeItem with the same field names,
+# used when COMPACT_ITEMS is enabled
+CompactProductItem = make_slots_item('CompactProductItem', ProductItem)
+CompactSizeItem = make_slots_item('CompactSizeItem', SizeItem)
+
+
+def item_classes(settings):
+    """Returns the (product, size) item classes selected by the COMPACT_ITEMS setting."""
+    if settings.getbool('COMPACT_ITEMS'):
+        return CompactProductItem, CompactSizeItem
+    return ProductItem, SizeItem
@@ -0,0 +1,123 @@
+"""
+Runs one spider in several worker processes sharing a crawl frontier.
+
+Every worker is a regular `scrapy crawl` process using FrontierScheduler and
+FrontierDupeFilter (see `frontier.py`), so requests discovered by one worker are
+downloaded by whichever worker claims them first. When all workers are done the
+stats they wrote are merged into `<spider>.stats.json`.
+
+Usage, from the project directory, through the launcher module of the project:
+
+    python -m the_sting.launcher thesting --workers 4
+    python -m the_sting.launcher thesting --workers 4 --resume
+    python -m the_sting.launcher arket_spider --workers 2 -s LOG_LEVEL=INFO -a countries=kr
+    python -m clothing_spider.launcher mohangi --workers 2
+
+Without --resume the frontier of a previous run is deleted first.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from scrapy.utils.project import get_project_settings
+
+from .frontier import frontier_path, prepare_frontier
+
+# stats where the merged value is the largest one and not the sum
+MAX_STATS = ('elapsed_time_seconds', 'memusage/max', 'memusage/startup', 'start_time', 'finish_time')
+
+
+def merge_stats(all_stats):
+    merged = {}
+    for stats in all_stats:
+        for key, value in stats.items():
+            if key not in merged:
+                merged[key] = value
+            elif key in MAX_STATS:
+                merged[key] = max(merged[key], value)
+            elif isinstance(value, (int, float)) and isinstance(merged[key], (int, float)):
+                merged[key] += value
+            elif value not in str(merged[key]).split(', '):
+                merged[key] = '%s, %s' % (merged[key], value)
+    return dict(sorted(merged.items()))
+
+
+def worker_command(spider, worker, path, stats_path, args):
+    command = [
+        sys.executable, '-m', 'scrapy', 'crawl', spider,
+        '-s', 'SCHEDULER=crawlkit.frontier.FrontierScheduler',
+        '-s', 'DUPEFILTER_CLASS=crawlkit.frontier.FrontierDupeFilter',
+        '-s', 'FRONTIER_PATH=%s' % path,
+        '-s', 'FRONTIER_WORKER=%s' % worker,
+        '-s', 'FRONTIER_STATS_PATH=%s' % stats_path,
+        '-s', 'LOG_FILE=%s.%s.log' % (spider, worker),
+    ]
+    for name, value in args.set:
+        command += ['-s', '%s=%s' % (name, value)]
+    for name, value in args.spargs:
+        command += ['-a', '%s=%s' % (name, value)]
+    return command
+
+
+def pair(value):
+    name, sep, setting = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE, got %r" % value)
+    return name, setting
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a spider in several processes sharing one crawl frontier")
+    parser.add_argument('spider')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--resume', action='store_true', help="continue the frontier left by a previous run")
+    parser.add_argument('-s', dest='set', type=pair, action='append', default=[], metavar='NAME=VALUE',
+                        help="setting passed to every worker")
+    parser.add_argument('-a', dest='spargs', type=pair, action='append', default=[], metavar='NAME=VALUE',
+                        help="spider argument passed to every worker")
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    settings.setdict(dict(args.set), priority='cmdline')
+    path = os.path.abspath(frontier_path(settings, args.spider))
+    if not args.resume:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    workers = ['w%d' % i for i in range(args.workers)]
+    prepare_frontier(path, workers)
+
+    processes = []
+    for worker in workers:
+        stats_path = '%s.%s.stats.json' % (args.spider, worker)
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+        command = worker_command(args.spider, worker, path, stats_path, args)
+        processes.append((worker, stats_path, subprocess.Popen(command)))
+
+    all_stats = []
+    failed = 0
+    for worker, stats_path, process in processes:
+        if process.wait() != 0:
+            failed += 1
+            print("worker %s exited with code %d" % (worker, process.returncode), file=sys.stderr)
+        if os.path.exists(stats_path):
+            with open(stats_path) as f:
+                all_stats.append(json.load(f))
+
+    merged = merge_stats(all_stats)
+    merged['workers'] = len(workers)
+    with open('%s.stats.json' % args.spider, 'w') as f:
+        json.dump(merged, f, indent=2)
+    for key, value in merged.items():
+        print("%s: %s" % (key, value))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
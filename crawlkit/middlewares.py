@@ -0,0 +1,298 @@
+# Spider and downloader middlewares of the crawl projects: the callback
+# profiler (CallbackProfilerMiddleware), the item pipeline entry signal
+# (PipelineTimerMiddleware) and the timing and payload instrumentation layer
+# (InstrumentationMiddleware).
+
+import cProfile
+import os
+import random
+import time
+import tracemalloc
+from weakref import WeakKeyDictionary
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+# useful for handling different item types with a single interface
+from itemadapter import is_item, ItemAdapter
+from twisted.internet import task
+
+from .instrumentation import LATENCY_BUCKETS, SIZE_BUCKETS, Histogram
+
+# sent with every item the spider middlewares hand to the item pipelines
+item_pipeline_started = object()
+
+
+class CallbackProfilerMiddleware:
+    # Opt-in sampling profiler for spider callbacks (PROFILER_ENABLED).
+    #
+    # A PROFILER_SAMPLE_RATE share of callback invocations runs under cProfile
+    # and tracemalloc. Results are aggregated per callback name and written to
+    # PROFILER_DIR every PROFILER_DUMP_INTERVAL seconds and when the spider closes:
+    #   <spider>.<callback>.prof       pstats file (snakeviz, flameprof, gprof2dot)
+    #   <spider>.<callback>.alloc.txt  lines allocating the memory the callback kept
+    #
+    # Only the time spent inside the callback generator is measured, so keep this
+    # middleware closest to the spider (highest order). Only one invocation is
+    # profiled at a time, because cProfile and tracemalloc are process wide.
+
+    def __init__(self, sample_rate, directory, dump_interval, trace_allocations):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.trace_allocations = trace_allocations
+        self.profiles = {}
+        self.allocations = {}
+        self.samples = {}
+        self.active = False
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # This method is used by Scrapy to create your spiders.
+        settings = crawler.settings
+        if not settings.getbool('PROFILER_ENABLED'):
+            raise NotConfigured
+        s = cls(
+            settings.getfloat('PROFILER_SAMPLE_RATE', 0.01),
+            settings.get('PROFILER_DIR', 'profiles'),
+            settings.getfloat('PROFILER_DUMP_INTERVAL', 60.0),
+            settings.getbool('PROFILER_TRACEMALLOC', True),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_input(self, response, spider):
+        # Called for each response that goes through the spider
+        # middleware and into the spider.
+
+        # Should return None or raise an exception.
+        return None
+
+    def process_spider_output(self, response, result, spider):
+        # Called with the results returned from the Spider, after
+        # it has processed the response.
+
+        # Must return an iterable of Request, or item objects.
+        if self.active or random.random() >= self.sample_rate:
+            return result
+        callback = response.request.callback or spider.parse
+        return self.profile(getattr(callback, '__name__', str(callback)), result)
+
+    def profile(self, name, result):
+        self.active = True
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        self.samples[name] = self.samples.get(name, 0) + 1
+        iterator = iter(result)
+        try:
+            while True:
+                # measure the callback only, not what the engine does with its output
+                if self.trace_allocations:
+                    tracemalloc.start()
+                profile.enable()
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    profile.disable()
+                    if self.trace_allocations:
+                        self.add_allocations(name, tracemalloc.take_snapshot())
+                        tracemalloc.stop()
+                yield output
+        finally:
+            self.active = False
+
+    def add_allocations(self, name, snapshot):
+        allocations = self.allocations.setdefault(name, {})
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            size, count = allocations.get((frame.filename, frame.lineno), (0, 0))
+            allocations[(frame.filename, frame.lineno)] = (size + stat.size, count + stat.count)
+
+    def process_spider_exception(self, response, exception, spider):
+        # Called when a spider or process_spider_input() method
+        # (from other spider middleware) raises an exception.
+
+        # Should return either None or an iterable of Request or item objects.
+        pass
+
+    def process_start_requests(self, start_requests, spider):
+        # Called with the start requests of the spider, and works
+        # similarly to the process_spider_output() method, except
+        # that it doesn’t have a response associated.
+
+        # Must return only requests (not items).
+        for r in start_requests:
+            yield r
+
+    def dump(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.directory, '%s.%s.prof' % (spider.name, name)))
+        for name, allocations in self.allocations.items():
+            top = sorted(allocations.items(), key=lambda entry: entry[1][0], reverse=True)[:50]
+            with open(os.path.join(self.directory, '%s.%s.alloc.txt' % (spider.name, name)), 'w') as f:
+                f.write('# %d sampled invocations, bytes still allocated when the callback yielded\n'
+                        % self.samples.get(name, 0))
+                for (filename, lineno), (size, count) in top:
+                    f.write('%12d B %8d blocks  %s:%d\n' % (size, count, filename, lineno))
+
+    def spider_opened(self, spider):
+        spider.logger.info("Spider opened: %s" % spider.name)
+        if self.trace_allocations and tracemalloc.is_tracing():
+            # started by someone else (e.g. PYTHONTRACEMALLOC), don't stop it under them
+            spider.logger.warning("tracemalloc is already tracing, profiling CPU only")
+            self.trace_allocations = False
+        spider.logger.info("Profiling %.1f%% of callbacks into %s" % (self.sample_rate * 100, self.directory))
+        self.task = task.LoopingCall(self.dump, spider)
+        self.task.start(self.dump_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.dump(spider)
+        for name in sorted(self.samples):
+            spider.logger.info("Profiled %d invocations of %s" % (self.samples[name], name))
+
+
+class PipelineTimerMiddleware:
+    # Sends item_pipeline_started for every item of the callbacks. The scraper
+    # hands an item to the item pipelines as soon as the last spider middleware
+    # yields it, so keep this one closest to the engine (lowest order).
+    # PrometheusMetrics times the pipelines from this signal to
+    # item_scraped/item_dropped/item_error. Enabled with METRICS_ENABLED.
+
+    def __init__(self, signals):
+        self.signals = signals
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler.signals)
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if is_item(output):
+                self.signals.send_catch_log(item_pipeline_started, item=output, spider=spider)
+            yield output
+
+
+class InstrumentationMiddleware:
+    # Instrumentation layer: records queue-wait time, download latency, response
+    # size (on the wire and decompressed) and status per domain and per callback.
+    # Values go into fixed-bucket histograms that are reported when the spider
+    # closes, and requests slower than INSTRUMENTATION_SLOW_REQUEST_THRESHOLD
+    # seconds are logged.
+    #
+    # Keep it below HttpCompressionMiddleware (590) so process_response() sees the
+    # decompressed body; the wire size is taken from the response_downloaded signal.
+
+    dimensions = ('domain', 'callback')
+
+    def __init__(self, stats, slow_threshold):
+        self.stats = stats
+        self.slow_threshold = slow_threshold
+        self.histograms = {}
+        # Timings are kept outside request.meta, because the spiders deep-copy meta
+        # into every child request
+        self.timings = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # This method is used by Scrapy to create your spiders.
+        s = cls(crawler.stats, crawler.settings.getfloat('INSTRUMENTATION_SLOW_REQUEST_THRESHOLD', 5.0))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
+        return s
+
+    def request_scheduled(self, request, spider):
+        self.timings[request] = {'scheduled': time.time()}
+
+    def response_downloaded(self, response, request, spider):
+        timing = self.timings.get(request)
+        if timing is not None:
+            timing['wire_size'] = len(response.body)
+
+    def process_request(self, request, spider):
+        # Called for each request that goes through the downloader
+        # middleware.
+        now = time.time()
+        timing = self.timings.setdefault(request, {})
+        if 'scheduled' in timing:
+            self.observe('queue_wait', request, spider, now - timing['scheduled'])
+        timing['started'] = now
+        return None
+
+    def process_response(self, request, response, spider):
+        # Called with the response returned from the downloader.
+        timing = self.timings.pop(request, None)
+        if timing is None or 'started' not in timing:
+            return response
+
+        latency = time.time() - timing['started']
+        self.observe('latency', request, spider, latency)
+        self.observe('size', request, spider, len(response.body))
+        self.observe('wire_size', request, spider, timing.get('wire_size', len(response.body)))
+        for dimension, key in self.keys(request, spider):
+            self.stats.inc_value('instrumentation/%s/%s/status_count/%d' % (dimension, key, response.status),
+                                 spider=spider)
+        if latency > self.slow_threshold:
+            spider.logger.warning("Slow request (%.2fs, %d): %s" % (latency, response.status, request.url))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # Called when a download handler or a process_request()
+        # (from other downloader middleware) raises an exception.
+        timing = self.timings.pop(request, None)
+        if timing is not None and 'started' in timing:
+            self.observe('latency', request, spider, time.time() - timing['started'])
+        for dimension, key in self.keys(request, spider):
+            self.stats.inc_value('instrumentation/%s/%s/exception_count/%s'
+                                 % (dimension, key, exception.__class__.__name__), spider=spider)
+
+    def keys(self, request, spider):
+        callback = request.callback or spider.parse
+        return (
+            ('domain', urlparse_cached(request).netloc),
+            ('callback', getattr(callback, '__name__', str(callback))),
+        )
+
+    def observe(self, metric, request, spider, value):
+        for dimension, key in self.keys(request, spider):
+            histogram = self.histograms.get((metric, dimension, key))
+            if histogram is None:
+                bounds = SIZE_BUCKETS if metric in ('size', 'wire_size') else LATENCY_BUCKETS
+                histogram = self.histograms[(metric, dimension, key)] = Histogram(bounds)
+            histogram.observe(value)
+
+    def spider_opened(self, spider):
+        spider.logger.info("Spider opened: %s" % spider.name)
+
+    def spider_closed(self, spider):
+        for (metric, dimension, key), histogram in sorted(self.histograms.items()):
+            prefix = 'instrumentation/%s/%s/%s' % (dimension, key, metric)
+            if metric in ('size', 'wire_size'):
+                self.stats.set_value(prefix + '/total', histogram.sum, spider=spider)
+                self.stats.set_value(prefix + '/mean', int(histogram.mean()), spider=spider)
+                self.stats.set_value(prefix + '/p95', int(histogram.quantile(0.95)), spider=spider)
+                self.stats.set_value(prefix + '/max', histogram.max, spider=spider)
+            else:
+                self.stats.set_value(prefix + '/mean', round(histogram.mean(), 4), spider=spider)
+                self.stats.set_value(prefix + '/p50', round(histogram.quantile(0.5), 4), spider=spider)
+                self.stats.set_value(prefix + '/p95', round(histogram.quantile(0.95), 4), spider=spider)
+                self.stats.set_value(prefix + '/p99', round(histogram.quantile(0.99), 4), spider=spider)
+                self.stats.set_value(prefix + '/max', round(histogram.max, 4), spider=spider)
+        for (metric, dimension, key), histogram in sorted(self.histograms.items()):
+            if metric == 'latency':
+                spider.logger.info(
+                    "Download latency %s=%s: %d requests, mean %.3fs, p50 <= %.3fs, p95 <= %.3fs, max %.3fs"
+                    % (dimension, key, histogram.count, histogram.mean(), histogram.quantile(0.5),
+                       histogram.quantile(0.95), histogram.max))
@@ -0,0 +1,117 @@
+# Persistent navigation tree cache (NAV_CACHE_ENABLED).
+#
+# Every crawl starts by fetching the home page (and for The Sting one sub-nav
+# page per top category) before the first listing can be requested, although
+# the category tree rarely changes. With NAV_CACHE_ENABLED the listings found
+# through the nav (categories and URL) are saved per spider and country in
+# NAV_CACHE_DIR/<spider>.json when the crawl finishes. The next crawls, while
+# the tree is younger than NAV_CACHE_TTL seconds, request those listings right
+# away and still walk the nav as before to revalidate the tree: listings it
+# finds that were not cached are crawled in the same run (the cached ones are
+# dropped by the dupefilter) and the saved tree is replaced by the walked one.
+#
+# Spiders call `record_nav` for every listing request they make from the nav
+# and yield `cached_nav_requests` before their home page requests.
+#
+# Stats: nav_cache/hits and nav_cache/misses (countries), nav_cache/listings
+# (requests sent from the cache), nav_cache/new_listings and
+# nav_cache/removed_listings (found by the revalidation).
+
+import json
+import logging
+import os
+import time
+
+from scrapy import Request, signals
+
+logger = logging.getLogger(__name__)
+
+
+class NavCache:
+
+    def __init__(self, crawler, path, ttl):
+        self.crawler = crawler
+        self.path = path
+        self.ttl = ttl
+        # country -> {'saved_at': timestamp, 'listings': [[categories, url], ...]}
+        self.trees = self.load()
+        # country -> {url: categories} of the listings found in this crawl
+        self.walked = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, spider_name):
+        settings = crawler.settings
+        path = os.path.join(settings.get('NAV_CACHE_DIR', 'navcache'), '%s.json' % spider_name)
+        cache = cls(crawler, path, settings.getfloat('NAV_CACHE_TTL', 86400))
+        crawler.signals.connect(cache.spider_closed, signal=signals.spider_closed)
+        return cache
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Ignoring the unreadable nav cache %s", self.path)
+            return {}
+
+    def listings(self, country):
+        """The cached (categories, url) listings of `country`, empty when missing or older than the TTL."""
+        tree = self.trees.get(country)
+        if tree is None or time.time() - tree['saved_at'] >= self.ttl:
+            self.crawler.stats.inc_value('nav_cache/misses')
+            return []
+        self.crawler.stats.inc_value('nav_cache/hits')
+        self.crawler.stats.inc_value('nav_cache/listings', len(tree['listings']))
+        return tree['listings']
+
+    def record(self, country, categories, url):
+        # the first categories a listing is found under win, like in the crawl
+        self.walked.setdefault(country, {}).setdefault(url, categories)
+
+    def spider_closed(self, spider, reason):
+        # an interrupted crawl may not have walked the whole tree
+        if reason != 'finished' or not self.walked:
+            return
+        for country, listings in self.walked.items():
+            cached = {url for _, url in self.trees.get(country, {}).get('listings', [])}
+            if cached:
+                self.crawler.stats.inc_value('nav_cache/new_listings', len(listings.keys() - cached))
+                self.crawler.stats.inc_value('nav_cache/removed_listings', len(cached - listings.keys()))
+            self.trees[country] = {'saved_at': time.time(),
+                                   'listings': [[categories, url] for url, categories in listings.items()]}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # written next to the cache and renamed, a crash never leaves half a file
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.trees, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        logger.info("Saved the nav tree of %s to %s", ', '.join(sorted(self.walked)), self.path,
+                    extra={'spider': spider})
+
+
+class NavCacheMixin:
+    # name of the callback of the listing requests made from the nav
+    nav_cache_callback = 'parse_products'
+
+    # NavCache, set by setup_nav_cache when NAV_CACHE_ENABLED
+    nav_cache = None
+
+    def setup_nav_cache(self, crawler):
+        if crawler.settings.getbool('NAV_CACHE_ENABLED'):
+            self.nav_cache = NavCache.from_crawler(crawler, self.name)
+
+    def cached_nav_requests(self, country, meta):
+        """Listing requests of the cached nav tree of `country`, with `meta` and the cached categories."""
+        if self.nav_cache is None:
+            return
+        callback = getattr(self, self.nav_cache_callback)
+        for categories, url in self.nav_cache.listings(country):
+            listing_meta = dict(meta)
+            if categories is not None:
+                listing_meta['categories'] = categories
+            yield Request(url, callback, meta=listing_meta)
+
+    def record_nav(self, country, categories, url):
+        if self.nav_cache is not None:
+            self.nav_cache.record(country, categories, url)
@@ -0,0 +1,209 @@
+# Parse offload to worker processes (PARSE_OFFLOAD_ENABLED).
+#
+# Product page extraction (lxml parsing, a few dozen selectors, the regex and
+# JSON repair of the embedded scripts) runs on the reactor thread, so a crawl
+# uses one core however many the host has. With PARSE_OFFLOAD_ENABLED the
+# spider's extraction methods run in a pool of PARSE_OFFLOAD_WORKERS processes
+# (the number of cores by default) and the reactor only gets the plain item
+# data back:
+#
+#   def parse_detail(self, response):
+#       return self.offload(response, 'extract_detail')
+#
+# The extraction method must only yield items and only read the url, body and
+# the meta keys listed in the spider's `offload_meta` from the response: it
+# runs on an instance of the spider class created in the worker, without a
+# crawler. Bodies are handed over through shared memory segments reused from
+# one response to the next, only the segment name goes through the pool's
+# pipe. At most PARSE_OFFLOAD_MAX_IN_FLIGHT responses (twice the workers by
+# default) are in the pool, the others wait in the scraper, whose
+# SCRAPER_SLOT_MAX_ACTIVE_SIZE then slows the downloads down. When a worker
+# dies the pool is not restarted and the remaining responses are parsed on the
+# reactor thread.
+#
+# Stats: parse_offload/responses, parse_offload/body_bytes,
+# parse_offload/waits (responses that waited for a free slot),
+# parse_offload/inline (parsed on the reactor thread after a pool failure).
+
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+from itemadapter import ItemAdapter, is_item
+from scrapy import Request, signals
+from scrapy.utils.misc import load_object
+from twisted.internet.defer import Deferred, DeferredSemaphore
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+# smallest shared memory segment, grown to the next power of two for larger bodies
+MIN_SEGMENT_SIZE = 256 * 1024
+
+# spider instance of a worker process, see init_worker
+worker_spider = None
+
+
+def init_worker(spider_path):
+    global worker_spider
+    # Ctrl-C is for the crawl process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_spider = load_object(spider_path)()
+
+
+def extract(method, response_class, url, status, encoding, meta, segment, size):
+    # Runs in a worker: rebuilds the response and returns the items of
+    # `method` as plain dicts
+    shm = SharedMemory(segment)
+    try:
+        body = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    response = response_class(url, status=status, body=body, encoding=encoding, request=Request(url, meta=meta))
+    results = []
+    for result in getattr(worker_spider, method)(response) or ():
+        if not is_item(result):
+            raise TypeError("%s can only yield items when offloaded, got %r" % (method, result))
+        results.append(ItemAdapter(result).asdict())
+    return results
+
+
+class BodySegment:
+    # shared memory segment holding the body of one response in the pool
+
+    def __init__(self):
+        self.shm = None
+
+    def write(self, body):
+        if self.shm is None or self.shm.size < len(body):
+            self.close()
+            size = MIN_SEGMENT_SIZE
+            while size < len(body):
+                size *= 2
+            self.shm = SharedMemory(create=True, size=size)
+        self.shm.buf[:len(body)] = body
+        return self.shm.name
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class ParsePool:
+
+    def __init__(self, crawler, spider_path, workers, max_in_flight):
+        self.crawler = crawler
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(spider_path,))
+        self.slots = DeferredSemaphore(max_in_flight)
+        self.segments = [BodySegment() for _ in range(max_in_flight)]
+        self.broken = False
+
+    @classmethod
+    def from_crawler(cls, crawler, spidercls):
+        settings = crawler.settings
+        workers = settings.getint('PARSE_OFFLOAD_WORKERS') or os.cpu_count() or 1
+        max_in_flight = settings.getint('PARSE_OFFLOAD_MAX_IN_FLIGHT') or 2 * workers
+        pool = cls(crawler, '%s.%s' % (spidercls.__module__, spidercls.__qualname__), workers, max_in_flight)
+        crawler.signals.connect(pool.close, signal=signals.spider_closed)
+        return pool
+
+    def extract(self, response, method, meta):
+        """Returns a Deferred firing with the items of `method` for the response, as dicts."""
+        if not self.slots.tokens:
+            self.crawler.stats.inc_value('parse_offload/waits')
+        d = self.slots.acquire()
+        d.addCallback(self.submit, response, method, meta)
+        return d
+
+    def submit(self, _, response, method, meta):
+        from twisted.internet import reactor
+
+        segment = self.segments.pop()
+        d = Deferred()
+        try:
+            future = self.executor.submit(
+                extract, method, type(response), response.url, response.status, response.encoding, meta,
+                segment.write(response.body), len(response.body))
+        except BrokenProcessPool:
+            self.release(segment)
+            raise
+        self.crawler.stats.inc_value('parse_offload/responses')
+        self.crawler.stats.inc_value('parse_offload/body_bytes', len(response.body))
+        future.add_done_callback(lambda future: reactor.callFromThread(self.done, future, segment, d))
+        return d
+
+    def done(self, future, segment, d):
+        self.release(segment)
+        exception = future.exception()
+        if exception is None:
+            d.callback(future.result())
+        else:
+            if isinstance(exception, BrokenProcessPool) and not self.broken:
+                logger.error("Parse offload pool failed, parsing on the reactor thread: %s", exception)
+                self.broken = True
+            d.errback(Failure(exception))
+
+    def release(self, segment):
+        self.segments.append(segment)
+        self.slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for segment in self.segments:
+            segment.close()
+
+
+def fill_item(item, data):
+    for key, value in data.items():
+        item[key] = value
+    return item
+
+
+def chain_output(result, more):
+    """Callback output `result` (an offload Deferred or an iterable) followed by the iterable `more`."""
+    if isinstance(result, Deferred):
+        return result.addCallback(lambda results: list(results) + list(more))
+    return itertools.chain(result, more)
+
+
+class ParseOffloadMixin:
+    # response meta keys the offloaded extraction methods read
+    offload_meta = ()
+
+    # ParsePool, set by setup_parse_pool when PARSE_OFFLOAD_ENABLED
+    parse_pool = None
+
+    def setup_parse_pool(self, crawler):
+        if crawler.settings.getbool('PARSE_OFFLOAD_ENABLED'):
+            self.parse_pool = ParsePool.from_crawler(crawler, type(self))
+
+    def offload(self, response, method):
+        """Output of the extraction method `method` for the response, computed in the pool when there is one."""
+        if self.parse_pool is None or self.parse_pool.broken:
+            return getattr(self, method)(response)
+        meta = {key: response.meta[key] for key in self.offload_meta if key in response.meta}
+        d = self.parse_pool.extract(response, method, meta)
+        d.addCallbacks(lambda results: [self.offload_item(data) for data in results],
+                       self.offload_failed, errbackArgs=(response, method))
+        return d
+
+    def offload_failed(self, failure, response, method):
+        failure.trap(BrokenProcessPool)
+        self.crawler.stats.inc_value('parse_offload/inline')
+        return list(getattr(self, method)(response))
+
+    def offload_item(self, data):
+        # plain data of an offloaded item back into the spider's item classes
+        product = fill_item(self.product_item(), data)
+        if data.get('size_infos'):
+            product['size_infos'] = [fill_item(self.size_item(), size) for size in data['size_infos']]
+        return product
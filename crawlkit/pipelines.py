@@ -0,0 +1,268 @@
+# Item pipelines shared by the crawl projects.
+#
+# SqlitePipeline stores the items in the Products table of PRODUCTS_DB, the
+# projects subclass it with their table (`schema`), the columns identifying a
+# stored product (`key_columns`), the row of an item (`row_values`) and what a
+# row adds to the aggregate tables (`product_measures`, see aggregates.py).
+# ContentImagesPipeline downloads the images of the items.
+
+import hashlib
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from urllib.parse import urlparse
+
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.exceptions import NotConfigured
+from scrapy.http.request import NO_CALLBACK
+from scrapy.pipelines.files import FilesPipeline, FSFilesStore
+
+from .aggregates import Aggregates
+from .checkpoint import checkpoint_saving
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class SqlitePipeline(ABC):
+    # Items are kept until `batch_size` of them are waiting, until a checkpoint
+    # of CheckpointScheduler or until the spider closes, then written and
+    # committed in one transaction, with the aggregate tables (see
+    # aggregates.py) updated in it unless `aggregates` is false. The write lock
+    # is only held while a batch is written, so the workers of the launcher can
+    # share PRODUCTS_DB (WAL mode, a worker waits up to 60s for the others).
+
+    # CREATE TABLE statement of the Products table
+    schema = None
+    # columns of the stored row an item is merged into
+    key_columns = ('url',)
+
+    def __init__(self, path='Products.db', batch_size=100, aggregates=True):
+        # Create/Connect to database
+        self.con = sqlite3.connect(path, timeout=60)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        # Create cursor, used to execute commands
+        self.cur = self.con.cursor()
+        # Create Products table if it doesn't exist
+        self.cur.execute(self.schema)
+        # lookups by product url for every item
+        self.cur.execute("CREATE INDEX IF NOT EXISTS products_url ON Products (%s)" % ', '.join(self.key_columns))
+        self.aggregates = Aggregates(self.con, self.product_measures) if aggregates else None
+        self.con.commit()
+        self.batch_size = batch_size
+        # (row values, columns the item has) of the items not written yet
+        self.pending = []
+
+    @classmethod
+    def from_settings(cls, settings):
+        # PRODUCTS_DB defaults to Products.db in the working directory
+        return cls(settings.get('PRODUCTS_DB', 'Products.db'), settings.getint('PRODUCTS_DB_BATCH_SIZE', 100),
+                   settings.getbool('PRODUCTS_AGGREGATES', True))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls.from_settings(crawler.settings)
+        pipeline.connect_signals(crawler)
+        return pipeline
+
+    def connect_signals(self, crawler):
+        # a resumable crawl must not checkpoint items still in the batch
+        crawler.signals.connect(self.commit, signal=checkpoint_saving)
+
+    def process_item(self, item, spider):
+        values = self.row_values(item)
+        self.pending.append((values, [column for column in values if column in item]))
+        if len(self.pending) >= self.batch_size:
+            self.commit(spider)
+        return item
+
+    def store(self, values, columns):
+        self.cur.execute("SELECT rowid, * FROM Products WHERE %s" % ' AND '.join('%s = ?' % c for c in self.key_columns),
+                         [values[column] for column in self.key_columns])
+        result = self.cur.fetchone()
+        if result:
+            stored = dict(zip([description[0] for description in self.cur.description], result))
+            # Merge the fields the item has into the stored row: listing refresh
+            # items only carry prices, sitemap discovery stores the product page
+            # and its category separately
+            self.cur.execute("UPDATE Products SET %s WHERE rowid = ?" % ', '.join('%s = ?' % c for c in columns),
+                             [values[column] for column in columns] + [result[0]])
+            if self.aggregates is not None:
+                self.aggregates.update(stored, dict(stored, **{column: values[column] for column in columns}))
+        else:
+            # Define insert statement
+            self.cur.execute("INSERT INTO Products (%s) VALUES (%s)" % (', '.join(values), ', '.join('?' * len(values))),
+                             list(values.values()))
+            if self.aggregates is not None:
+                self.aggregates.insert(values)
+
+    def commit(self, spider=None):
+        # Write the inserts and updates of the batch
+        pending, self.pending = self.pending, []
+        try:
+            if pending and not self.con.in_transaction:
+                # take the write lock now, the merges read the rows they update
+                self.con.execute("BEGIN IMMEDIATE")
+            for values, columns in pending:
+                try:
+                    self.store(values, columns)
+                except (sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+                    # a value sqlite cannot bind only loses its own row
+                    if spider is not None:
+                        spider.logger.error("Could not store %s: %s" % (values.get('url'), e))
+            self.con.commit()
+        except sqlite3.OperationalError:
+            # the database stayed locked past the timeout, the disk is full...:
+            # undo the part of the batch already written and keep the batch
+            # for the next commit
+            self.con.rollback()
+            self.pending[:0] = pending
+            raise
+
+    def close_spider(self, spider):
+        try:
+            self.commit(spider)
+        finally:
+            self.con.close()
+
+    @abstractmethod
+    def row_values(self, item):
+        """Column -> value of `item`, with the defaults of a new row."""
+
+    @staticmethod
+    @abstractmethod
+    def product_measures(row):
+        """What a Products row adds to the aggregates, see aggregates.Aggregates."""
+
+
+def make_thumbnails(path, thumbs, thumbs_dir):
+    # Runs in the thumbnail process pool, away from the reactor
+    name = os.path.splitext(os.path.basename(path))[0]
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        for thumb_id, size in thumbs.items():
+            thumb = image.copy()
+            thumb.thumbnail(size)
+            target = os.path.join(thumbs_dir, thumb_id, name + '.jpg')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            thumb.save(target, 'JPEG')
+    return len(thumbs)
+
+
+class ContentImagesPipeline(FilesPipeline):
+    # Downloads item['image_urls'] into the IMAGES_STORE directory and fills
+    # item['images'] with url/path/checksum dicts. The pipeline is disabled
+    # while IMAGES_STORE is unset.
+    #
+    # Files are named by the SHA1 of their content (full/<ab>/<sha1>.jpg), so an
+    # image shared by colours or products, or served under several CDN sizes,
+    # is stored once. index.sqlite maps every downloaded URL to its file, and
+    # URLs already in the index are not requested again.
+    #
+    # Image requests use their own download slot per host ("images/<host>")
+    # limited to IMAGES_CONCURRENT_REQUESTS_PER_HOST, so they don't hold back
+    # the page requests of the same host. IMAGES_THUMBS ({name: [width, height]})
+    # thumbnails are made by a process pool when Pillow is installed.
+
+    MEDIA_NAME = 'image'
+    FILES_URLS_FIELD = 'image_urls'
+    FILES_RESULT_FIELD = 'images'
+
+    def __init__(self, store_uri, settings=None):
+        super().__init__(store_uri, settings=settings)
+        if not isinstance(self.store, FSFilesStore):
+            raise NotConfigured("IMAGES_STORE must be a local directory")
+        self.basedir = self.store.basedir
+        os.makedirs(self.basedir, exist_ok=True)
+        # the crawlers of runner.crawl (and other crawl processes) may share
+        # IMAGES_STORE: every index write is committed at once (autocommit), so
+        # no connection holds the write lock between two of its writes, and WAL
+        # lets the others read meanwhile
+        self.index = sqlite3.connect(os.path.join(self.basedir, 'index.sqlite'), timeout=30, isolation_level=None)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("PRAGMA synchronous=NORMAL")
+        self.index.execute("CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, path TEXT, checksum TEXT)")
+        self.per_host = settings.getint('IMAGES_CONCURRENT_REQUESTS_PER_HOST', 4)
+        self.delay = settings.getfloat('IMAGES_DOWNLOAD_DELAY', 0)
+        self.thumbs = settings.getdict('IMAGES_THUMBS')
+        self.thumbs_workers = settings.getint('IMAGES_THUMBS_WORKERS') or None
+        self.pool = None
+        self.thumbs_pending = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.get('IMAGES_STORE'):
+            raise NotConfigured("IMAGES_STORE is not set")
+        return cls(settings.get('IMAGES_STORE'), settings=settings)
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        if self.thumbs and Image is None:
+            spider.logger.warning("IMAGES_THUMBS is set but Pillow is not installed, no thumbnails are made")
+            self.thumbs = {}
+        if self.thumbs:
+            self.pool = ProcessPoolExecutor(max_workers=self.thumbs_workers)
+
+    def close_spider(self, spider):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        self.index.close()
+
+    def get_media_requests(self, item, info):
+        per_slot_settings = info.spider.crawler.engine.downloader.per_slot_settings
+        requests = []
+        for url in ItemAdapter(item).get(self.files_urls_field) or []:
+            slot = 'images/%s' % urlparse(url).netloc
+            if slot not in per_slot_settings:
+                per_slot_settings[slot] = {'concurrency': self.per_host, 'delay': self.delay}
+            # dont_filter: image CDNs are usually outside allowed_domains
+            requests.append(Request(url, callback=NO_CALLBACK, meta={'download_slot': slot}, dont_filter=True))
+        return requests
+
+    def media_to_download(self, request, info, *, item=None):
+        row = self.index.execute("SELECT path, checksum FROM images WHERE url = ?", (request.url,)).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.basedir, row[0])):
+            return None  # download it
+        self.inc_stats(info.spider, 'uptodate')
+        return {'url': request.url, 'path': row[0], 'checksum': row[1], 'status': 'uptodate'}
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        checksum = hashlib.sha1(response.body).hexdigest()
+        extension = os.path.splitext(super().file_path(request))[1] or '.jpg'
+        return 'full/%s/%s%s' % (checksum[:2], checksum, extension)
+
+    def file_downloaded(self, response, request, info, *, item=None):
+        path = self.file_path(request, response=response, info=info, item=item)
+        checksum = os.path.splitext(os.path.basename(path))[0]
+        absolute_path = os.path.join(self.basedir, path)
+        if os.path.exists(absolute_path):
+            # already counted as downloaded
+            info.spider.crawler.stats.inc_value('file_status_count/duplicate', spider=info.spider)
+        else:
+            self.store.persist_file(path, BytesIO(response.body), info)
+            if self.pool is not None:
+                self.make_thumbnails(absolute_path, info.spider)
+
+        self.index.execute("INSERT OR REPLACE INTO images (url, path, checksum) VALUES (?, ?, ?)",
+                           (request.url, path, checksum))
+        return checksum
+
+    def make_thumbnails(self, path, spider):
+        from twisted.internet import reactor
+
+        self.thumbs_pending += 1
+        future = self.pool.submit(make_thumbnails, path, self.thumbs, os.path.join(self.basedir, 'thumbs'))
+        future.add_done_callback(lambda f: reactor.callFromThread(self.thumbnails_done, f, path, spider))
+
+    def thumbnails_done(self, future, path, spider):
+        self.thumbs_pending -= 1
+        if future.exception() is not None:
+            spider.logger.warning("Thumbnails of %s failed: %s" % (path, future.exception()))
+            spider.crawler.stats.inc_value('image_thumbs/error', spider=spider)
+        else:
+            spider.crawler.stats.inc_value('image_thumbs/created', future.result(), spider=spider)
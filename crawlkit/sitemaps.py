@@ -0,0 +1,88 @@
+# Sitemap discovery (SITEMAP_DISCOVERY).
+#
+# Instead of reaching products through the nav menus and paginated listings,
+# the spider reads the site's sitemap (index) files and sends the product URLs
+# straight to the product page callback, so the first items come after a
+# couple of requests. Sitemaps are parsed incrementally (lxml iterparse over
+# the body, gzip decompressed on the fly) and entries are released as soon as
+# they are read, so large sitemap files never become a full element tree.
+#
+# Sitemap entries carry no categories. With SITEMAP_CATEGORIES (default) the
+# nav tree is walked as usual in parallel, and the listing tiles of products
+# already requested from a sitemap give a partial item (url, country,
+# categories) that SqlitePipeline merges into the stored row. Without it only
+# the sitemaps and product pages are crawled.
+#
+# Stats: sitemap/files, sitemap/product_urls, sitemap/category_items.
+
+import gzip
+import re
+from io import BytesIO
+
+from lxml import etree
+from scrapy import Request
+
+from .canonical import DEFAULT_URL_RULES, canonicalize
+
+
+def iter_sitemap(body):
+    """Yields ('sitemap', url) for sitemap index entries and ('url', url) for urlset entries."""
+    stream = BytesIO(body)
+    if body[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+    for _, element in etree.iterparse(stream, events=('end',), tag=('{*}sitemap', '{*}url'),
+                                      resolve_entities=False, no_network=True, huge_tree=True):
+        loc = element.findtext('{*}loc')
+        if loc:
+            yield 'sitemap' if element.tag.endswith('sitemap') else 'url', loc.strip()
+        # drop the entry and the ones before it, only the current path is kept
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+class SitemapDiscoveryMixin:
+    # sitemap or sitemap index files of the site
+    sitemap_urls = []
+    # regular expression matching the product urls among the sitemap entries
+    sitemap_product_pattern = None
+    # name of the callback parsing product pages
+    sitemap_callback = None
+
+    # set from the SITEMAP_DISCOVERY and SITEMAP_CATEGORIES settings
+    sitemap_discovery = False
+    sitemap_categories = True
+
+    def sitemap_settings(self, settings):
+        self.sitemap_discovery = settings.getbool('SITEMAP_DISCOVERY')
+        self.sitemap_categories = settings.getbool('SITEMAP_CATEGORIES', True)
+        # product urls requested from the sitemaps
+        self.sitemap_product_urls = set()
+
+    def sitemap_requests(self):
+        for url in self.sitemap_urls:
+            yield Request(url, self.parse_sitemap)
+
+    def parse_sitemap(self, response):
+        self.crawler.stats.inc_value('sitemap/files')
+        pattern = re.compile(self.sitemap_product_pattern)
+        callback = getattr(self, self.sitemap_callback)
+        for kind, url in iter_sitemap(response.body):
+            if kind == 'sitemap':
+                yield Request(url, self.parse_sitemap)
+            elif pattern.search(url):
+                # canonical like the urls of the listing tiles it is matched with
+                url = canonicalize(url, getattr(self, 'canonical_url_rules', DEFAULT_URL_RULES))
+                meta = self.sitemap_product_meta(url)
+                if meta is None:
+                    continue
+                self.crawler.stats.inc_value('sitemap/product_urls')
+                self.sitemap_product_urls.add(url)
+                yield Request(url, callback, meta=meta)
+
+    def sitemap_product_meta(self, url):
+        # meta of the product page request, None to skip the url
+        return {}
+
+    def listed_in_sitemap(self, url):
+        return self.sitemap_discovery and url in self.sitemap_product_urls
@@ -0,0 +1,127 @@
+# Early-abort downloads.
+#
+# Some callbacks read a small part of large pages. With EARLY_ABORT_ENABLED,
+# EarlyAbortMiddleware stops reading the body of their responses once
+# `max_bytes` have been received or the `until` marker has been seen (from
+# the bytes_received signal, so at chunk granularity). The callback gets the
+# truncated body, flagged 'download_stopped'; the lxml HTML parser behind
+# response.css() reads it like a complete page, closing the open elements.
+#
+# Limits are set per callback name on the spider:
+#
+#   early_abort_limits = {'parse_detail': {'until': b'<footer', 'max_bytes': 512 * 1024}}
+#
+# These requests ask for an uncompressed body, so the marker can be searched
+# and the budget counts body bytes. Stats per callback:
+#   early_abort/<callback>/stopped      responses cut short
+#   early_abort/<callback>/bytes        body bytes received
+#   early_abort/<callback>/bytes_saved  body bytes not downloaded (from Content-Length)
+# ParseTimeMiddleware adds early_abort/<callback>/parse_seconds and
+# early_abort/<callback>/responses whether aborting is enabled or not, so
+# runs with and without it can be compared.
+
+import time
+from weakref import WeakKeyDictionary
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, StopDownload
+
+
+def callback_name(request, spider):
+    callback = request.callback or spider.parse
+    return getattr(callback, '__name__', str(callback))
+
+
+def early_abort_limits(request, spider):
+    return getattr(spider, 'early_abort_limits', {}).get(callback_name(request, spider))
+
+
+class EarlyAbortMiddleware:
+
+    def __init__(self, stats):
+        self.stats = stats
+        # request -> [callback, max_bytes, marker, bytes received, tail of the previous chunk]
+        self.active = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('EARLY_ABORT_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler.stats)
+        crawler.signals.connect(s.bytes_received, signal=signals.bytes_received)
+        return s
+
+    def process_request(self, request, spider):
+        limits = early_abort_limits(request, spider)
+        if not limits:
+            return None
+        self.active[request] = [callback_name(request, spider), limits.get('max_bytes'), limits.get('until'), 0, b'']
+        # keep HttpCompressionMiddleware from asking for a compressed body
+        request.headers['Accept-Encoding'] = 'identity'
+        return None
+
+    def bytes_received(self, data, request, spider):
+        state = self.active.get(request)
+        if state is None:
+            return
+        name, max_bytes, marker, received, tail = state
+        state[3] = received = received + len(data)
+        if marker:
+            # the marker may straddle two chunks
+            window = tail + data
+            if marker in window:
+                raise StopDownload(fail=False)
+            state[4] = window[-(len(marker) - 1):] if len(marker) > 1 else b''
+        if max_bytes and received >= max_bytes:
+            raise StopDownload(fail=False)
+
+    def process_response(self, request, response, spider):
+        state = self.active.pop(request, None)
+        if state is None:
+            return response
+        prefix = 'early_abort/%s' % state[0]
+        self.stats.inc_value(prefix + '/bytes', len(response.body), spider=spider)
+        if 'download_stopped' in response.flags:
+            self.stats.inc_value(prefix + '/stopped', spider=spider)
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit():
+                self.stats.inc_value(prefix + '/bytes_saved', max(0, int(length) - len(response.body)),
+                                     spider=spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.active.pop(request, None)
+
+
+class ParseTimeMiddleware:
+    # Times the callbacks having early abort limits, only while they run (not
+    # what the engine does with their output). Keep it close to the spider.
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        if not early_abort_limits(response.request, spider):
+            return result
+        return self.timed(callback_name(response.request, spider), result, spider)
+
+    def timed(self, name, result, spider):
+        elapsed = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield output
+        finally:
+            self.stats.inc_value('early_abort/%s/parse_seconds' % name, elapsed, spider=spider)
+            self.stats.inc_value('early_abort/%s/responses' % name, spider=spider)
@@ -0,0 +1,12 @@
+"""
+Local load-testing tools for the crawl projects.
+
+Modules:
+    catalog: Deterministic synthetic product catalog shared by all fake retailers.
+    sites: Markup/JSON renderers that mimic The Sting, Arket, Marc Jacobs and Mohagni.
+    server: Threaded HTTP server serving the synthetic retailers.
+    scrapy_hooks: Download handler and stats recorder that are plugged into a crawl.
+    harness: Runs each spider against the server and reports pages/sec, items/sec and memory.
+    soak: Runs each spider for a long time and checks for memory leaks and growth per item.
+
+"""
@@ -0,0 +1,105 @@
+"""
+Deterministic synthetic catalog used by the fake retailer sites.
+
+Nothing is stored per product: every field is derived from the product id and the
+catalog seed, so a 100k+ product catalog costs no memory on the server side.
+
+Classes:
+    Catalog: Splits a number of products over a list of listing (category) paths and
+        generates product data, colour variants and pagination on demand.
+
+"""
+
+import random
+
+TOP_CATEGORIES = ['Women', 'Men', 'Kids']
+SUB_CATEGORIES = ['Clothing', 'Shoes', 'Accessories', 'Sale']
+GROUPS = ['New In', 'Trending']
+LEAVES = ['Jeans', 'Shirts', 'Jackets', 'Dresses', 'Knitwear', 'Sneakers']
+
+COLORS = ['Black', 'White', 'Navy', 'Beige', 'Olive', 'Burgundy', 'Grey', 'Pink']
+SIZES = ['XS', 'S', 'M', 'L', 'XL']
+BRANDS = ['Only', 'Jack & Jones', 'Vero Moda', 'Pieces', 'Noisy May', 'Selected']
+WORDS = ['relaxed', 'slim', 'cropped', 'oversized', 'linen', 'cotton', 'wool', 'denim', 'knit', 'basic']
+DESCRIPTION_TITLES = ['Description', 'Material', 'Care']
+
+
+def slugify(text):
+    return text.lower().replace(' & ', '-').replace(' ', '-')
+
+
+def category_tree(depth):
+    """
+    Returns the category paths (tuples of names) of the shared taxonomy.
+
+    depth=2 -> (top, sub), depth=3 -> (top, sub, leaf), depth=4 -> (top, sub, group, leaf)
+    """
+    paths = []
+    for top in TOP_CATEGORIES:
+        for sub in SUB_CATEGORIES:
+            if depth == 2:
+                paths.append((top, sub))
+                continue
+            for group_index, group in enumerate(GROUPS):
+                for leaf in LEAVES[group_index * 3:group_index * 3 + 3]:
+                    paths.append((top, sub, group, leaf) if depth == 4 else (top, sub, leaf))
+    return paths
+
+
+class Catalog:
+
+    def __init__(self, listings, size, page_size=24, colors=3, seed=0):
+        self.listings = listings
+        self.size = size
+        self.page_size = page_size
+        self.colors = colors
+        self.seed = seed
+
+    def listing_range(self, index):
+        start = index * self.size // len(self.listings)
+        end = (index + 1) * self.size // len(self.listings)
+        return start, end
+
+    def listing_total(self, index):
+        start, end = self.listing_range(index)
+        return end - start
+
+    def page_count(self, index):
+        return max(1, -(-self.listing_total(index) // self.page_size))
+
+    def listing_page(self, index, page):
+        """Returns the product ids shown on the 1-based `page` of listing `index`."""
+        start, end = self.listing_range(index)
+        first = start + (page - 1) * self.page_size
+        return range(max(first, start), min(first + self.page_size, end))
+
+    def listing_of(self, pid):
+        return ((pid + 1) * len(self.listings) - 1) // self.size
+
+    def siblings(self, pid):
+        """Returns the ids of the colour variants of `pid`, `pid` included."""
+        start, end = self.listing_range(self.listing_of(pid))
+        first = start + (pid - start) // self.colors * self.colors
+        return range(first, min(first + self.colors, end))
+
+    def product(self, pid):
+        rnd = random.Random(self.seed * 1000003 + pid)
+        base = self.siblings(pid)[0]
+        price = rnd.randint(10, 150) - 0.01
+        on_sale = rnd.random() < 0.3
+        sizes = [(name, rnd.choice([0, 1, 1, 2, 5])) for name in SIZES[:rnd.randint(2, len(SIZES))]]
+        return {
+            'pid': pid,
+            'base': base,
+            'title': ' '.join(rnd.sample(WORDS, 2)).capitalize() + ' ' + self.listings[self.listing_of(pid)][-1].lower(),
+            'brand': BRANDS[base % len(BRANDS)],
+            'color': COLORS[pid % len(COLORS)],
+            'old_price': price,
+            'new_price': round(price * 0.7, 2) if on_sale else None,
+            'sizes': sizes,
+            'images': rnd.randint(3, 6),
+            'description': [
+                (title, ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(8, 20))))
+                for title in DESCRIPTION_TITLES
+            ],
+        }
@@ -0,0 +1,172 @@
+"""
+End-to-end load test harness.
+
+Starts the synthetic retailer server, runs each spider against it in its own `scrapy crawl`
+process (so memory figures are not shared between spiders) and prints pages/sec, items/sec
+and peak RSS per spider. The full timeline of every run is written to
+<out>/<spider>/report.json, next to the crawl log and the Products.db written by the pipelines.
+
+Usage:
+    python -m loadtest.harness --products 100000 --latency-ms 20 --concurrency 64
+    python -m loadtest.harness --spiders thesting,mohangi --close-after 300
+
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from runner.crawl import SPIDER_PROJECTS
+
+from .server import build_parser as build_server_parser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Synthetic server did not start on %s:%d' % (host, port))
+
+
+def start_server(args):
+    """Starts the synthetic server with the server options of `args` and waits until it listens."""
+    server_command = [
+        sys.executable, '-m', 'loadtest.server', '--host', args.host, '--port', str(args.port),
+        '--products', str(args.products), '--page-size', str(args.page_size), '--latency-ms', str(args.latency_ms),
+        '--jitter-ms', str(args.jitter_ms), '--error-rate', str(args.error_rate), '--padding', str(args.padding),
+        '--seed', str(args.seed),
+    ]
+    server = subprocess.Popen(server_command, cwd=ROOT)
+    try:
+        wait_for_port(args.host, args.port)
+    except RuntimeError:
+        stop_server(server)
+        raise
+    return server
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    server.wait()
+
+
+def server_settings(args):
+    """Settings sending a crawl to the synthetic server, without throttling."""
+    handler = 'loadtest.scrapy_hooks.SyntheticDownloadHandler'
+    return {
+        'DOWNLOAD_HANDLERS': json.dumps({'http': handler, 'https': handler}),
+        'LOADTEST_SERVER_URL': 'http://%s:%d' % (args.host, args.port),
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOTHROTTLE_ENABLED': False,
+        'LOG_LEVEL': 'INFO',
+        'LOG_FILE': 'crawl.log',
+    }
+
+
+def scrapy_command(spider, settings):
+    command = [sys.executable, '-m', 'scrapy', 'crawl', spider]
+    for name, value in settings.items():
+        command += ['-s', '%s=%s' % (name, value)]
+    return command
+
+
+def crawl_command(spider, args, report_path):
+    settings = server_settings(args)
+    settings.update({
+        'EXTENSIONS': json.dumps({'loadtest.scrapy_hooks.LoadTestRecorder': 0}),
+        'LOADTEST_REPORT': report_path,
+        'LOADTEST_SAMPLE_INTERVAL': args.sample_interval,
+    })
+    if args.close_after:
+        settings['CLOSESPIDER_TIMEOUT'] = args.close_after
+    return scrapy_command(spider, settings)
+
+
+def crawl_env(spider):
+    """Environment of a `scrapy crawl` of `spider` in its project, with the loadtest package importable."""
+    project = SPIDER_PROJECTS[spider]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, os.path.join(ROOT, project), env.get('PYTHONPATH')]))
+    env['SCRAPY_SETTINGS_MODULE'] = '%s.settings' % project
+    return env
+
+
+def spider_workdir(spider, out, report_name):
+    """Creates <out>/<spider> and returns it with the path of its report, removing a previous report."""
+    workdir = os.path.abspath(os.path.join(out, spider))
+    os.makedirs(workdir, exist_ok=True)
+    report_path = os.path.join(workdir, report_name)
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    return workdir, report_path
+
+
+def run_spider(spider, args):
+    workdir, report_path = spider_workdir(spider, args.out, 'report.json')
+    subprocess.run(crawl_command(spider, args, report_path), cwd=workdir, env=crawl_env(spider), check=True)
+
+    with open(report_path) as f:
+        return json.load(f)
+
+
+def print_summary(reports):
+    print('%-18s %8s %8s %9s %10s %10s %12s' % ('spider', 'pages', 'items', 'seconds', 'pages/s', 'items/s',
+                                               'peak RSS MB'))
+    for report in reports:
+        print('%-18s %8d %8d %9.1f %10.1f %10.1f %12.1f' % (
+            report['spider'], report['pages'], report['items'], report['elapsed'], report['pages_per_sec'],
+            report['items_per_sec'], report['peak_rss'] / 2 ** 20))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run the spiders against the synthetic retailer server.',
+                                     parents=[build_server_parser()], conflict_handler='resolve')
+    parser.add_argument('--spiders', default=','.join(SPIDER_PROJECTS), help='comma separated spider names')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--close-after', type=int, default=0, help='CLOSESPIDER_TIMEOUT in seconds, 0 to disable')
+    parser.add_argument('--sample-interval', type=float, default=5.0, help='seconds between timeline samples')
+    parser.add_argument('--out', default='loadtest_results', help='directory for logs, reports and Products.db')
+    return parser
+
+
+def parse_spiders(value):
+    spiders = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(spiders) - set(SPIDER_PROJECTS)
+    if unknown:
+        raise SystemExit('Unknown spiders: %s' % ', '.join(sorted(unknown)))
+    return spiders
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spiders = parse_spiders(args.spiders)
+
+    server = start_server(args)
+    reports = []
+    try:
+        for spider in spiders:
+            reports.append(run_spider(spider, args))
+    finally:
+        stop_server(server)
+
+    print_summary(reports)
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump([{key: value for key, value in report.items() if key != 'samples'} for report in reports], f,
+                  indent=2)
+
+
+if __name__ == '__main__':
+    main()
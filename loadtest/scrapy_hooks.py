@@ -0,0 +1,262 @@
+"""
+Scrapy components that plug a crawl into the synthetic retailer server.
+
+Classes:
+    SyntheticDownloadHandler: HTTP download handler that sends every request to the local
+        server (LOADTEST_SERVER_URL) and gives the response back its original URL, so spiders,
+        offsite filtering and link following behave as on the real sites. bytes_received is
+        sent for the original request too, so early-abort handlers see their requests.
+    LoadTestRecorder: Extension that samples responses, items and RSS every
+        LOADTEST_SAMPLE_INTERVAL seconds and writes the timeline to LOADTEST_REPORT as JSON.
+    SoakMonitor: Extension that samples RSS, tracemalloc and trackref live object counts every
+        LOADTEST_SOAK_INTERVAL seconds, flags the object types that keep growing and the
+        allocation sites that grew most since the end of the warm-up, and checks the memory
+        growth per item against LOADTEST_SOAK_BYTES_PER_ITEM (report in LOADTEST_SOAK_REPORT).
+
+"""
+
+import json
+import resource
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.exceptions import NotConfigured, StopDownload
+from scrapy.utils.trackref import live_refs
+from twisted.internet import task
+from twisted.python.failure import Failure
+
+
+def get_rss():
+    """Returns the resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SyntheticDownloadHandler(HTTP11DownloadHandler):
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        self.server_url = settings.get('LOADTEST_SERVER_URL', 'http://127.0.0.1:8700').rstrip('/')
+        self.crawler = crawler
+        # local request -> request of the spider
+        self.originals = WeakKeyDictionary()
+        if crawler is not None:
+            crawler.signals.connect(self.bytes_received, signal=signals.bytes_received)
+
+    def download_request(self, request, spider):
+        parts = urlsplit(request.url)
+        local_url = '%s/%s%s' % (self.server_url, parts.netloc, parts.path or '/')
+        if parts.query:
+            local_url += '?' + parts.query
+        local_request = request.replace(url=local_url)
+        self.originals[local_request] = request
+        dfd = super().download_request(local_request, spider)
+        dfd.addCallback(lambda response: response.replace(url=request.url))
+        return dfd
+
+    def bytes_received(self, data, request, spider):
+        # sent for the local request, send it again for the spider's request
+        # and pass on a StopDownload raised by its handlers
+        original = self.originals.get(request)
+        if original is None:
+            return
+        for _, result in self.crawler.signals.send_catch_log(
+                signal=signals.bytes_received, data=data, request=original, spider=spider):
+            if isinstance(result, Failure) and isinstance(result.value, StopDownload):
+                raise result.value
+
+
+class LoadTestRecorder:
+
+    def __init__(self, crawler, report_path, interval):
+        self.crawler = crawler
+        self.report_path = report_path
+        self.interval = interval
+        self.samples = []
+        self.started = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        report_path = crawler.settings.get('LOADTEST_REPORT')
+        if not report_path:
+            raise NotConfigured
+        s = cls(crawler, report_path, crawler.settings.getfloat('LOADTEST_SAMPLE_INTERVAL', 5.0))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        self.task = task.LoopingCall(self.sample)
+        self.task.start(self.interval)
+
+    def sample(self):
+        stats = self.crawler.stats
+        self.samples.append({
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'pages': stats.get_value('response_received_count', 0),
+            'items': stats.get_value('item_scraped_count', 0),
+            'rss': get_rss(),
+        })
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.sample()
+        last = self.samples[-1]
+        elapsed = last['elapsed'] or 1e-9
+        report = {
+            'spider': spider.name,
+            'reason': reason,
+            'elapsed': last['elapsed'],
+            'pages': last['pages'],
+            'items': last['items'],
+            'pages_per_sec': round(last['pages'] / elapsed, 2),
+            'items_per_sec': round(last['items'] / elapsed, 2),
+            'peak_rss': max(sample['rss'] for sample in self.samples),
+            'samples': self.samples,
+            'stats': {key: value for key, value in self.crawler.stats.get_stats().items()
+                      if isinstance(value, (int, float, str))},
+        }
+        with open(self.report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def growing(values, min_growth):
+    """True when `values` keeps growing: the second half stays above the first and grew by min_growth."""
+    if len(values) < 4:
+        return False
+    half = len(values) // 2
+    return min(values[half:]) > max(values[:half]) and values[-1] - values[0] >= min_growth
+
+
+class SoakMonitor:
+
+    def __init__(self, crawler, report_path, interval, warmup, frames, budget, min_growth, top):
+        self.crawler = crawler
+        self.report_path = report_path
+        self.interval = interval
+        self.warmup = warmup
+        self.frames = frames
+        self.budget = budget
+        self.min_growth = min_growth
+        self.top = top
+        self.samples = []
+        # tracemalloc snapshot and sample at the end of the warm-up
+        self.baseline = None
+        self.baseline_sample = None
+        self.started = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        report_path = settings.get('LOADTEST_SOAK_REPORT')
+        if not report_path:
+            raise NotConfigured
+        s = cls(crawler, report_path,
+                settings.getfloat('LOADTEST_SOAK_INTERVAL', 60.0),
+                settings.getfloat('LOADTEST_SOAK_WARMUP', 300.0),
+                settings.getint('LOADTEST_SOAK_FRAMES', 1),
+                settings.getint('LOADTEST_SOAK_BYTES_PER_ITEM', 4096),
+                settings.getint('LOADTEST_SOAK_MIN_GROWTH', 100),
+                settings.getint('LOADTEST_SOAK_TOP', 20))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.started = time.monotonic()
+        self.task = task.LoopingCall(self.sample)
+        self.task.start(self.interval, now=False)
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def sample(self):
+        stats = self.crawler.stats
+        live = {cls.__name__: len(refs) for cls, refs in live_refs.items()}
+        # requests waiting in the scheduler are not held anywhere else
+        slot = getattr(self.crawler.engine, 'slot', None)
+        queued = len(slot.scheduler) if slot is not None and hasattr(slot.scheduler, '__len__') else 0
+        if 'Request' in live:
+            live['Request (not queued)'] = live['Request'] - queued
+        sample = {
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'pages': stats.get_value('response_received_count', 0),
+            'items': stats.get_value('item_scraped_count', 0),
+            'queued': queued,
+            'rss': get_rss(),
+            'traced': tracemalloc.get_traced_memory()[0],
+            'live': live,
+        }
+        self.samples.append(sample)
+        if self.baseline is None and sample['elapsed'] >= self.warmup:
+            self.baseline = self.snapshot()
+            self.baseline_sample = sample
+
+    def growth(self):
+        # allocation sites that grew most since the end of the warm-up
+        if self.baseline is None:
+            return []
+        stats = self.snapshot().compare_to(self.baseline, 'traceback' if self.frames > 1 else 'lineno')
+        return [{
+            'location': '\n'.join(stat.traceback.format()),
+            'size_diff': stat.size_diff,
+            'count_diff': stat.count_diff,
+            'size': stat.size,
+        } for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:self.top] if stat.size_diff > 0]
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.sample()
+        last = self.samples[-1]
+        base = self.baseline_sample
+        # the samples from the end of the warm-up on
+        soaked = [sample for sample in self.samples if base is not None and sample['elapsed'] >= base['elapsed']]
+        growing_types = {}
+        for name in sorted({name for sample in soaked for name in sample['live']}):
+            counts = [sample['live'].get(name, 0) for sample in soaked]
+            if growing(counts, self.min_growth):
+                growing_types[name] = {'from': counts[0], 'to': counts[-1]}
+        items = last['items'] - base['items'] if base is not None else 0
+        report = {
+            'spider': spider.name,
+            'reason': reason,
+            'elapsed': last['elapsed'],
+            'items': last['items'],
+            'soaked_items': items,
+            'peak_rss': max(sample['rss'] for sample in self.samples),
+            'budget_bytes_per_item': self.budget,
+            'rss_bytes_per_item': None,
+            'traced_bytes_per_item': None,
+            # no items after the warm-up is a failure too, the budget was not checked
+            'passed': False,
+            'growing_types': growing_types,
+            'top_growth': self.growth(),
+            'samples': self.samples,
+        }
+        if items > 0:
+            report['rss_bytes_per_item'] = round((last['rss'] - base['rss']) / items, 1)
+            report['traced_bytes_per_item'] = round((last['traced'] - base['traced']) / items, 1)
+            report['passed'] = report['rss_bytes_per_item'] <= self.budget
+        tracemalloc.stop()
+        with open(self.report_path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,129 @@
+"""
+Threaded HTTP server that serves the synthetic retailers for end-to-end load tests.
+
+Requests are routed by their first path segment, which holds the original host name
+(e.g. http://127.0.0.1:8700/www.arket.com/ko-kr/index.html). The
+`loadtest.scrapy_hooks.SyntheticDownloadHandler` rewrites spider requests into that form,
+so the spiders run unchanged.
+
+Usage:
+    python -m loadtest.server --products 100000 --latency-ms 20 --error-rate 0.01
+    python -m loadtest.server --outage 'ctgrListAddItem' --outage-seconds 30
+
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from .sites import SITES, image
+
+
+class SyntheticRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SyntheticRetailer/1.0'
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        site = server.sites.get(host)
+
+        if server.latency:
+            time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+
+        if server.in_outage('/' + path):
+            result = 503, 'text/plain', b'Service Unavailable'
+        elif server.error_rate and random.random() < server.error_rate:
+            result = 503, 'text/plain', b'Service Unavailable'
+        else:
+            result = site.handle('/' + path, parts.query) if site is not None else None
+            if result is None:
+                # product images, on the retailer or any CDN host
+                result = image('/' + path)
+        if result is None:
+            result = 404, 'text/plain', b'Not Found'
+
+        status, content_type, body = result
+        server.count(host, status, len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyntheticServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, products=10000, latency_ms=0, jitter_ms=0, error_rate=0.0, page_size=24,
+                 padding=20000, seed=0, outage=None, outage_seconds=0):
+        super().__init__(address, SyntheticRequestHandler)
+        self.sites = {site.host: site(products, page_size=page_size, seed=seed, padding=padding) for site in SITES}
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.outage = re.compile(outage) if outage else None
+        self.outage_ends = time.monotonic() + outage_seconds if outage_seconds else None
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def in_outage(self, path):
+        # paths matching --outage fail until --outage-seconds have passed
+        if self.outage is None or not self.outage.search(path):
+            return False
+        return self.outage_ends is None or time.monotonic() < self.outage_ends
+
+    def count(self, host, status, size):
+        with self.lock:
+            stats = self.stats.setdefault(host, {'requests': 0, 'errors': 0, 'bytes': 0})
+            stats['requests'] += 1
+            stats['bytes'] += size
+            if status >= 400:
+                stats['errors'] += 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Serve synthetic retailer catalogs for load tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--products', type=int, default=10000, help='products per site')
+    parser.add_argument('--page-size', type=int, default=24, help='products per listing page')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='uniform +/- jitter on the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses answered with 503')
+    parser.add_argument('--outage', help='regular expression of the paths answered with 503')
+    parser.add_argument('--outage-seconds', type=float, default=0, help='length of the outage, 0 for the whole run')
+    parser.add_argument('--padding', type=int, default=20000, help='bytes of script padding per HTML page')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = SyntheticServer(
+        (args.host, args.port), products=args.products, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, page_size=args.page_size, padding=args.padding, seed=args.seed,
+        outage=args.outage, outage_seconds=args.outage_seconds)
+    print('Serving %d products per site on http://%s:%d/ (%s)'
+          % (args.products, args.host, args.port, ', '.join(server.sites)), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for host, stats in sorted(server.stats.items()):
+            print('%s: %d requests, %d errors, %d bytes' % (host, stats['requests'], stats['errors'], stats['bytes']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+"""
+Synthetic stand-ins for the retailers crawled by the spiders.
+
+Every site renders the same markup and JSON shapes the spiders select on, backed by a
+`Catalog` so any catalog size can be served without storing it.
+
+Classes:
+    Site: Base class with routing, padding and the shared robots.txt response.
+    TheStingSite: Header nav menus, sub-nav flyouts, product tiles (with a `position` tracking parameter)
+        and detail pages (www.thesting.com).
+    ArketSite: Category wrappers, `ctgrListAddItem` pages and `changeItemInfo` JSON (www.arket.com).
+    MarcJacobsSite: navL1/navL2 menus, spinner paging and `Product-Variation` JSON (marcjacobs.com).
+    MohagniSite: Shopify collections, pagination and product pages (mohagni.com).
+
+Product images on any host are served by `image()`, and the sites with product pages serve a
+sitemap index at /sitemap.xml listing a pages sitemap and product sitemaps of `sitemap_size` urls.
+
+"""
+
+import hashlib
+import json
+import re
+import struct
+import zlib
+from html import escape
+from urllib.parse import parse_qs
+
+from .catalog import Catalog, category_tree, slugify
+
+HTML = 'text/html; charset=utf-8'
+JSON = 'application/json; charset=utf-8'
+XML = 'application/xml; charset=utf-8'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+SITEMAP_PATTERN = re.compile(r'/sitemap_(?:pages|products_(\d+))\.xml')
+LOCALE_PATTERN = re.compile(r'/([a-z]{2}-[a-z]{2})(?=/|$)')
+IMAGE_PATTERN = re.compile(r'.+\.(jpe?g|png|webp)$', re.I)
+
+
+def image(path, size=96):
+    """
+    Returns a `size`x`size` PNG response for image paths, or None. The pixels only depend on
+    the path, so the resized variants a CDN serves through query parameters are identical.
+    """
+    if not IMAGE_PATTERN.fullmatch(path):
+        return None
+    seed = hashlib.sha1(path.encode('utf-8')).digest()
+    row = b'\x00' + (seed * (size * 3 // len(seed) + 1))[:size * 3]
+    pixels = zlib.compress(row * size)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    body = (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', pixels) + chunk(b'IEND', b''))
+    return 200, 'image/png', body
+
+
+class Site:
+    host = None
+    depth = 2
+    # locale path prefix of the default market, other prefixes are served the same catalog
+    locale = None
+    route_patterns = []
+    # product urls per sitemap file, sites with product pages serve /sitemap.xml
+    sitemap_size = 1000
+
+    def __init__(self, size, page_size=24, seed=0, padding=20000):
+        self.catalog = Catalog(category_tree(self.depth), size, page_size=page_size, seed=seed)
+        self.listing_paths = {self.listing_path(path): index for index, path in enumerate(self.catalog.listings)}
+        # Scripts and footers that real pages carry around the few nodes the spiders need
+        self.padding = '<footer class="footer"><script type="application/json" id="tracking">%s</script></footer>' % (
+            json.dumps({'t': 'x' * padding})) if padding else ''
+        self.routes = [(re.compile(pattern), getattr(self, name)) for pattern, name in self.route_patterns]
+
+    def handle(self, path, query):
+        """Returns (status, content_type, body) for `path`, or None if nothing matches."""
+        match = LOCALE_PATTERN.match(path) if self.locale else None
+        if match and match.group(1) != self.locale:
+            # every other locale serves the same catalog, with its own links
+            result = self.handle('/' + self.locale + path[match.end():], query)
+            if result is None:
+                return None
+            status, content_type, body = result
+            return status, content_type, body.replace(('/%s/' % self.locale).encode(), ('/%s/' % match.group(1)).encode())
+        if path == '/robots.txt':
+            return 200, 'text/plain', b'User-agent: *\nAllow: /\n'
+        if hasattr(self, 'product_url'):
+            if path == '/sitemap.xml':
+                return self.render_sitemap_index()
+            match = SITEMAP_PATTERN.fullmatch(path)
+            if match:
+                return self.render_sitemap(int(match.group(1) or 0))
+        query = {key: values[0] for key, values in parse_qs(query).items()}
+        if path in self.listing_paths:
+            return self.render_listing(self.listing_paths[path], query)
+        for pattern, view in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                return view(query, *match.groups())
+        return None
+
+    def render_sitemap_index(self):
+        count = -(-self.catalog.size // self.sitemap_size)
+        entries = ['/sitemap_pages.xml'] + ['/sitemap_products_%d.xml' % n for n in range(1, count + 1)]
+        return 200, XML, ('<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="%s">%s</sitemapindex>' % (
+            SITEMAP_NS, ''.join('<sitemap><loc>https://%s%s</loc></sitemap>' % (self.host, path) for path in entries))
+        ).encode('utf-8')
+
+    def render_sitemap(self, number):
+        if number == 0:
+            paths = ['/'] + list(self.listing_paths)
+        else:
+            first = (number - 1) * self.sitemap_size
+            paths = [self.product_url(pid) for pid in range(first, min(first + self.sitemap_size, self.catalog.size))]
+        if not paths:
+            return None
+        return 200, XML, ('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="%s">%s</urlset>' % (
+            SITEMAP_NS, ''.join('<url><loc>https://%s%s</loc><changefreq>daily</changefreq></url>' % (self.host, path)
+                                for path in paths))).encode('utf-8')
+
+    def listing_path(self, path):
+        raise NotImplementedError
+
+    def render_listing(self, index, query):
+        raise NotImplementedError
+
+    def product_id(self, value):
+        try:
+            pid = int(value)
+        except (TypeError, ValueError):
+            return None
+        return pid if 0 <= pid < self.catalog.size else None
+
+    def page(self, body, status=200):
+        return status, HTML, ('<!DOCTYPE html><html><head><title>%s</title></head><body>%s%s</body></html>'
+                              % (self.host, body, self.padding)).encode('utf-8')
+
+    def json(self, data):
+        return 200, JSON, json.dumps(data).encode('utf-8')
+
+
+class TheStingSite(Site):
+    host = 'www.thesting.com'
+    depth = 4
+    locale = 'nl-nl'
+    route_patterns = [
+        (r'/nl-nl', 'render_home'),
+        (r'/nl-nl/([a-z-]+)', 'render_category'),
+        (r'/nl-nl/p/[a-z-]+-(\d+)\.html', 'render_product'),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # second level nav entries are listings as well, showing their first leaf
+        for index, path in enumerate(self.catalog.listings):
+            self.listing_paths.setdefault(self.sub_path(*path[:2]), index)
+        self.tops = list(dict.fromkeys(path[0] for path in self.catalog.listings))
+        self.header = self.render_header()
+
+    def listing_path(self, path):
+        top, sub, _, leaf = path
+        return '/nl-nl/%s/%s/%s' % (slugify(top), slugify(sub), slugify(leaf))
+
+    def sub_path(self, top, sub):
+        return '/nl-nl/%s/%s' % (slugify(top), slugify(sub))
+
+    def render_header(self):
+        tops = self.tops
+        navigation = ''.join('<a href="/nl-nl/%s">%s</a>' % (slugify(top), top) for top in tops)
+        menus = []
+        for top in tops:
+            links = []
+            for sub in dict.fromkeys(path[1] for path in self.catalog.listings if path[0] == top):
+                groups = []
+                for group in dict.fromkeys(path[2] for path in self.catalog.listings if path[:2] == (top, sub)):
+                    leaves = ''.join(
+                        '<a href="%s"><span>%s</span></a>' % (self.listing_path(path), path[3])
+                        for path in self.catalog.listings if path[:3] == (top, sub, group))
+                    groups.append(
+                        '<div class="header__menu-flyout-navigation-wrapper">'
+                        '<span class="header__menu-flyout-navigation-label"> %s </span><nav>%s</nav></div>'
+                        % (group, leaves))
+                links.append('<a class="header__menu-navigation-link--is-secondary" href="%s">%s</a><div>%s</div>'
+                             % (self.sub_path(top, sub), sub, ''.join(groups)))
+            menus.append('<div class="header__menu-secondary" data-category="%s">%s</div>' % (top, ''.join(links)))
+        return '<header><div class="header__menu-navigation">%s</div>%s</header>' % (navigation, ''.join(menus))
+
+    def render_home(self, query):
+        return self.page(self.header)
+
+    def render_category(self, query, top):
+        if top not in [slugify(name) for name in self.tops]:
+            return None
+        return self.page(self.header)
+
+    def product_url(self, pid):
+        product = self.catalog.product(pid)
+        return '/nl-nl/p/%s-%d.html' % (slugify(product['title']), pid)
+
+    def render_listing(self, index, query):
+        page = int(query.get('page', 1))
+        # tile links carry their position in the listing, swatch links don't
+        tiles = ''.join(
+            '<div class="product"><a class="product-tile__link" href="%s?position=%d">%s</a>%s</div>'
+            % (self.product_url(pid), position, escape(self.catalog.product(pid)['title']), self.tile_prices(pid))
+            for position, pid in enumerate(self.catalog.listing_page(index, page), 1))
+        if page < self.catalog.page_count(index):
+            next_url = '%s?page=%d' % (self.listing_path(self.catalog.listings[index]), page + 1)
+        else:
+            next_url = '#'
+        return self.page('%s<div class="products">%s</div><a class="pagination__action--next" href="%s">Next</a>'
+                         % (self.header, tiles, next_url))
+
+    def tile_prices(self, pid):
+        product = self.catalog.product(pid)
+        prices = '<data class="product-tile__price">&euro; %.2f</data>' % product['old_price']
+        if product['new_price']:
+            prices += '<data class="product-tile__price--is-on-sale">&euro; %.2f</data>' % product['new_price']
+        return prices
+
+    def render_product(self, query, pid):
+        pid = self.product_id(pid)
+        if pid is None:
+            return None
+        product = self.catalog.product(pid)
+        prices = '<data class="product-detail-aside__price" value="%.2f">&euro; %.2f</data>' % (
+            product['old_price'], product['old_price'])
+        if product['new_price']:
+            prices += ('<data class="product-detail-aside__price--is-on-sale" value="%.2f">&euro; %.2f</data>'
+                       % (product['new_price'], product['new_price']))
+        swatches = ''.join('<a href="%s">%s</a>' % (self.product_url(sibling), self.catalog.product(sibling)['color'])
+                           for sibling in self.catalog.siblings(pid) if sibling != pid)
+        sizes = ''.join(
+            '<label class="radio"><span class="radio__size-value"> %s </span>%s</label>'
+            % (name, '' if stock else '<span class="radio__size-label">Uitverkocht</span>')
+            for name, stock in product['sizes'])
+        description = ''.join(
+            '<details class="accordion__detail"><summary class="accordion__item-summary"> %s </summary>'
+            '<div class="accordion__item-content"><p>%s</p></div></details>' % (title, text)
+            for title, text in product['description'])
+        images = ''.join(
+            '<div class="product-image-grid__item"><div class="image__holder"><picture>'
+            '<source data-srcset="https://images.thesting.com/product/%d_%d.jpg?w=1200"></picture></div></div>'
+            % (pid, n) for n in range(product['images']))
+        aside = ('<div class="c-product-detail-aside"><a class="product-detail-aside__brand" href="#">%s</a>'
+                 '<h1 class="product-detail-aside__title">%s</h1>%s'
+                 '<span class="product-detail-aside__current-color">%s</span>'
+                 '<div class="c-color-swatches">%s</div><div class="sizes">%s</div>'
+                 '<div class="c-accordion">%s</div></div>'
+                 % (escape(product['brand']), escape(product['title']), prices, product['color'], swatches, sizes,
+                    description))
+        return self.page('%s<div class="product-image-grid">%s</div>%s' % (self.header, images, aside))
+
+
+class ArketSite(Site):
+    host = 'www.arket.com'
+    depth = 3
+    locale = 'ko-kr'
+    route_patterns = [
+        (r'/ko-kr/index\.html', 'render_home'),
+        (r'/ko-kr/dpa/ctgrListAddItem\.html', 'render_add_items'),
+        (r'/ko-kr/product/[a-z-]+\.(\d+)\.html', 'render_product'),
+        (r'/ko-kr/pda/changeItemInfo\.html', 'render_item_info'),
+    ]
+
+    def listing_path(self, path):
+        return '/ko-kr/%s.html' % '/'.join(slugify(name) for name in path)
+
+    def render_home(self, query):
+        wrappers = []
+        for top in dict.fromkeys(path[0] for path in self.catalog.listings):
+            subs = list(dict.fromkeys(path[1] for path in self.catalog.listings if path[0] == top))
+            first_leaf = {sub: next(path for path in self.catalog.listings if path[:2] == (top, sub)) for sub in subs}
+            curated = ''.join('<a class="department-link" href="%s">%s</a>' % (self.listing_path(first_leaf[sub]), sub)
+                              for sub in subs)
+            folders = ''.join(
+                '<div class="folder-category"><h3 class="a-heading-3"><a href="#"> %s </a></h3><ul>%s</ul></div>'
+                % (sub, ''.join('<li class="subcategory" href="%s"><a href="%s"> %s </a></li>'
+                                % (self.listing_path(path), self.listing_path(path), path[2])
+                                for path in self.catalog.listings if path[:2] == (top, sub)))
+                for sub in subs)
+            wrappers.append('<div class="category-wrapper" data-title="%s"><div class="curated-categories">%s</div>'
+                            '<div class="main-categories">%s</div></div>' % (top, curated, folders))
+        return self.page(''.join(wrappers))
+
+    def code(self, pid):
+        return 'A%010d' % pid
+
+    def tiles(self, index, page):
+        return ''.join(
+            '<div class="o-product"><a href="/ko-kr/product/%s.%d.html">%s</a></div>'
+            % (slugify(self.catalog.product(pid)['title']), pid, escape(self.catalog.product(pid)['title']))
+            for pid in self.catalog.listing_page(index, page))
+
+    def render_listing(self, index, query):
+        total = self.catalog.listing_total(index)
+        size = self.catalog.page_size
+        inputs = ('<input type="hidden" name="viewCnt" value="%d"><input type="hidden" name="totalCnt" value="%d">'
+                  '<input type="hidden" name="pageSize" value="%d"><input type="hidden" name="sect_id" value="%d">'
+                  % (size if total else 0, total, size, index))
+        return self.page('<div class="product-list">%s</div>%s' % (self.tiles(index, 1), inputs))
+
+    def render_add_items(self, query):
+        index = int(query.get('sect_id', -1))
+        if not 0 <= index < len(self.catalog.listings):
+            return None
+        return 200, HTML, self.tiles(index, int(query.get('pageNum', 1))).encode('utf-8')
+
+    def render_product(self, query, pid):
+        pid = self.product_id(pid)
+        if pid is None:
+            return None
+        swatches = ''.join('<div class="js-swatch"><a class="colorLink" data-slitm-cd="%s">%s</a></div>'
+                           % (self.code(sibling), self.catalog.product(sibling)['color'])
+                           for sibling in self.catalog.siblings(pid))
+        return self.page('<form><input type="hidden" name="sectId" value="%d"></form>'
+                         '<div class="color-swatch-container">%s</div>' % (self.catalog.listing_of(pid), swatches))
+
+    def render_item_info(self, query):
+        code = query.get('slitmCd', '')
+        if not re.fullmatch(r'A\d{10}', code):
+            return None
+        pid = self.product_id(code[1:])
+        if pid is None:
+            return None
+        product = self.catalog.product(pid)
+        return self.json({
+            'imgList': [{'imflNm': '%s%02d.jpg' % (code, n)} for n in range(product['images'])],
+            'itemPtc': {
+                'sellPrc': int((product['new_price'] or product['old_price']) * 1000),
+                'csmPrc': int(product['old_price'] * 1000),
+                'itstInfoList': [{'itstTitl': title, 'itstCntn': text} for title, text in product['description']],
+                'engItemNm': product['title'],
+                'clrEngNm': product['color'],
+            },
+            'sizeAndStockBySlitmCdList': [{
+                'articleCd': code,
+                'sizeAndStockVOList': [{'u2aNm': name, 'stockCount': stock} for name, stock in product['sizes']],
+            }],
+        })
+
+
+class MarcJacobsSite(Site):
+    host = 'marcjacobs.com'
+    depth = 3
+    route_patterns = [
+        (r'/', 'render_home'),
+        (r'/products/[a-z-]+/(\d+)\.html', 'render_product'),
+        (r'/on/demandware\.store/Sites-mjsfra-Site/en_GB/Product-Variation', 'render_variation'),
+    ]
+
+    def listing_path(self, path):
+        return '/%s/' % '/'.join(slugify(name) for name in path)
+
+    def render_home(self, query):
+        items = []
+        for top in dict.fromkeys(path[0] for path in self.catalog.listings):
+            links = ''.join('<li><a href="%s">%s</a></li>' % (self.listing_path(path), path[2])
+                            for path in self.catalog.listings if path[0] == top)
+            items.append('<li class="navL1"><a href="/%s/">%s</a><div class="navL2"><ul>%s</ul></div></li>'
+                         % (slugify(top), top, links))
+        return self.page('<div class="nav-modal"><ul class="nav-modal__sub-list">%s</ul></div>' % ''.join(items))
+
+    def product_url(self, pid):
+        return '/products/%s/%d.html' % (slugify(self.catalog.product(pid)['title']), pid)
+
+    def render_listing(self, index, query):
+        size = self.catalog.page_size
+        page = int(query.get('start', 0)) // size + 1
+        cards = ''.join(
+            '<li class="product-grid__list-element"><a class="lockup-card" href="%s">%s</a></li>'
+            % (self.product_url(pid), escape(self.catalog.product(pid)['title']))
+            for pid in self.catalog.listing_page(index, page))
+        spinner = ''
+        if page < self.catalog.page_count(index):
+            spinner = '<div class="spinner" data-url="%s?start=%d&amp;sz=%d"></div>' % (
+                self.listing_path(self.catalog.listings[index]), page * size, size)
+        return self.page('<ul class="product-grid">%s</ul>%s' % (cards, spinner))
+
+    def variation_url(self, pid):
+        return ('https://marcjacobs.com/on/demandware.store/Sites-mjsfra-Site/en_GB/Product-Variation?pid=%d'
+                '&amp;dwvar_%d_color=%s' % (pid, pid, slugify(self.catalog.product(pid)['color'])))
+
+    def render_product(self, query, pid):
+        pid = self.product_id(pid)
+        if pid is None:
+            return None
+        inputs = ''.join('<input type="radio" class="colorDrawer__item-radio" data-label="%s" data-url="%s">'
+                         % (self.catalog.product(sibling)['color'], self.variation_url(sibling))
+                         for sibling in self.catalog.siblings(pid))
+        return self.page('<div class="swiper-wrapper">%s</div>' % inputs)
+
+    def render_variation(self, query):
+        pid = self.product_id(query.get('pid'))
+        if pid is None:
+            return None
+        product = self.catalog.product(pid)
+        sales = product['new_price'] or product['old_price']
+        return self.json({
+            'action': 'Product-Variation',
+            'product': {
+                'id': str(product['base']),
+                'brand': 'Marc Jacobs',
+                'productName': product['title'],
+                'longDescription': ' '.join(text for _, text in product['description']),
+                'images': {'large': [{'url': '/dw/image/v2/product/%d_%d.jpg?sw=1200' % (pid, n)}
+                                     for n in range(product['images'])]},
+                'price': {
+                    'sales': {'formatted': '£%.2f' % sales},
+                    'list': {'formatted': '£%.2f' % product['old_price']} if product['new_price'] else None,
+                },
+                'variationAttributes': [
+                    {'attributeId': 'color', 'values': [{'displayValue': product['color'], 'selectable': True}]},
+                    {'attributeId': 'size', 'values': [{'displayValue': name, 'selectable': bool(stock)}
+                                                       for name, stock in product['sizes']]},
+                ],
+            },
+        })
+
+
+class MohagniSite(Site):
+    host = 'mohagni.com'
+    depth = 3
+    route_patterns = [
+        (r'/', 'render_home'),
+        (r'/products/[a-z]+-(\d+)', 'render_product'),
+    ]
+    prefixes = ['lw', 'ds', 'pt', 'kt']
+
+    def listing_path(self, path):
+        return '/collections/%s' % '-'.join(slugify(name) for name in path)
+
+    def render_home(self, query):
+        paths = [self.listing_path(path) for path in self.catalog.listings]
+        half = len(paths) // 2
+        swiper = ''.join('<a href="%s">Shop</a>' % path for path in paths[:half])
+        columns = ''.join('<li><a href="%s">Shop</a></li>' % path for path in paths[half:])
+        return self.page('<div class="swiper">%s</div><ul class="multicolumn-list">%s</ul>' % (swiper, columns))
+
+    def product_url(self, pid):
+        return '/products/%s-%d' % (self.prefixes[pid % len(self.prefixes)], pid)
+
+    def render_listing(self, index, query):
+        page = int(query.get('page', 1))
+        path = self.listing_path(self.catalog.listings[index])
+        pages = ''.join('<li><a href="%s?page=%d">%d</a></li>' % (path, number, number)
+                        for number in range(2, self.catalog.page_count(index) + 1))
+        grid = ''.join('<li class="grid__item"><a class="full-unstyled-link" href="%s">%s</a></li>'
+                       % (self.product_url(pid), escape(self.catalog.product(pid)['title']))
+                       for pid in self.catalog.listing_page(index, page))
+        return self.page('<h2 class="collection-hero__title">\n<span class="visually-hidden">Collection: </span>%s</h2>'
+                         '<ul class="grid">%s</ul><ul class="pagination__list">%s</ul>'
+                         % (escape(' '.join(self.catalog.listings[index])), grid, pages))
+
+    def render_product(self, query, pid):
+        pid = self.product_id(pid)
+        if pid is None:
+            return None
+        product = self.catalog.product(pid)
+        price = int(product['old_price'] * 100) * 10
+        sale = int(product['new_price'] * 100) * 10 if product['new_price'] else None
+        variants = [
+            {'title': 'Stitched / %s' % name, 'price': sale or price, 'compare_at_price': price if sale else None,
+             'available': bool(stock)} for name, stock in product['sizes']]
+        unstitched = {'id': pid, 'price': sale or price, 'compare_at_price': price if sale else None,
+                      'available': bool(product['sizes'][0][1])}
+        kind = pid % 3
+        form = ''
+        if kind == 0:
+            form = '<fieldset class="product-form__input"><legend class="form__label">Style</legend></fieldset>'
+            variants.append(dict(unstitched, title='Unstitched'))
+        elif kind == 1:
+            form = '<fieldset class="product-form__input"><legend class="form__label">Size</legend></fieldset>'
+        if form:
+            form += '<variant-radios class="no-js-hidden"><script type="application/json">%s</script></variant-radios>' % (
+                json.dumps(variants))
+        analytics = ('<script type="text/javascript">window.ShopifyAnalytics.meta = {product: %s, collectionId: %d};'
+                     '</script>' % (json.dumps(unstitched), self.catalog.listing_of(pid)))
+        ld_json = ('<script type="application/ld+json">{"@type": "Organization", "name": "Mohagni"}</script>'
+                   '<script type="application/ld+json">\n{"@type": "Product", "name": "%s",\n"gtin14": %d,\n'
+                   '"description": "%s"}\n</script>'
+                   % (product['title'], 10000000000000 + pid, ' '.join(text for _, text in product['description'])))
+        images = ''.join(
+            '<li class="product__media-item"><div class="product__media">'
+            '<img src="//mohagni.com/cdn/shop/products/%d_%d.jpg?v=1690000000&amp;width=%d"></div></li>'
+            % (pid, n, width) for n in range(product['images']) for width in (1500, 3000))
+        return self.page('%s<div class="product__title"><h1>%s</h1></div><ul class="product__media-list">%s</ul>%s%s'
+                         % (analytics, escape(product['title']), images, form, ld_json))
+
+
+SITES = [TheStingSite, ArketSite, MarcJacobsSite, MohagniSite]
@@ -0,0 +1,121 @@
+"""
+Long-run memory soak test.
+
+Starts the synthetic retailer server with a catalog large enough to keep the spiders busy and runs
+each spider against it for --duration seconds (CLOSESPIDER_TIMEOUT) in its own `scrapy crawl`
+process, with the project's pipelines. The SoakMonitor extension samples RSS, tracemalloc and the
+trackref live object counts (requests, responses, items, selectors, spiders) every --interval
+seconds. After the --warmup seconds, when the queues, caches and connection pools have filled up,
+it snapshots the traced allocations; at the end it reports:
+
+    growing types    trackref classes whose live count kept growing after the warm-up (the
+                     count is above its first-half maximum all through the second half); the
+                     requests waiting in the scheduler are also counted apart ("Request (not
+                     queued)") so that a growing queue is not taken for leaked requests
+    top growth       the allocation sites that grew most since the warm-up snapshot, with
+                     --frames frames of traceback each
+    bytes per item   the RSS (and traced) growth since the warm-up divided by the items
+                     scraped since, checked against --budget
+
+A spider fails when its RSS growth per item is over the budget or when it scraped nothing after the
+warm-up; the command then exits with status 1. The full report of every spider is written to
+<out>/<spider>/soak.json, next to its crawl log.
+
+Usage:
+    python -m loadtest.soak --duration 3600 --budget 4096
+    python -m loadtest.soak --spiders mohangi --duration 600 --warmup 60 --interval 10 --frames 8
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+
+from .harness import (SPIDER_PROJECTS, crawl_env, parse_spiders, scrapy_command, server_settings, spider_workdir,
+                      start_server, stop_server)
+from .server import build_parser as build_server_parser
+
+
+def soak_command(spider, args, report_path):
+    settings = server_settings(args)
+    settings.update({
+        'EXTENSIONS': json.dumps({'loadtest.scrapy_hooks.SoakMonitor': 0}),
+        'LOADTEST_SOAK_REPORT': report_path,
+        'LOADTEST_SOAK_INTERVAL': args.interval,
+        'LOADTEST_SOAK_WARMUP': args.warmup,
+        'LOADTEST_SOAK_FRAMES': args.frames,
+        'LOADTEST_SOAK_BYTES_PER_ITEM': args.budget,
+        'LOADTEST_SOAK_MIN_GROWTH': args.min_growth,
+        'CLOSESPIDER_TIMEOUT': args.duration,
+    })
+    return scrapy_command(spider, settings)
+
+
+def soak_spider(spider, args):
+    workdir, report_path = spider_workdir(spider, args.out, 'soak.json')
+    subprocess.run(soak_command(spider, args, report_path), cwd=workdir, env=crawl_env(spider), check=True)
+
+    with open(report_path) as f:
+        return json.load(f)
+
+
+def format_bytes(value):
+    return '-' if value is None else '%.0f' % value
+
+
+def print_summary(reports):
+    print('%-18s %8s %9s %10s %12s %14s %16s %6s' % ('spider', 'items', 'seconds', 'soaked', 'peak RSS MB',
+                                                      'RSS B/item', 'traced B/item', 'result'))
+    for report in reports:
+        print('%-18s %8d %9.1f %10d %12.1f %14s %16s %6s' % (
+            report['spider'], report['items'], report['elapsed'], report['soaked_items'],
+            report['peak_rss'] / 2 ** 20, format_bytes(report['rss_bytes_per_item']),
+            format_bytes(report['traced_bytes_per_item']), 'ok' if report['passed'] else 'FAIL'))
+    for report in reports:
+        for name, counts in report['growing_types'].items():
+            print('%s: %s live objects grew from %d to %d' % (report['spider'], name, counts['from'], counts['to']))
+        for stat in report['top_growth'][:3]:
+            print('%s: %+.1f KiB (%+d blocks) at %s' % (report['spider'], stat['size_diff'] / 1024,
+                                                         stat['count_diff'], stat['location'].strip()))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Soak the spiders against the synthetic server and check for leaks.',
+                                     parents=[build_server_parser()], conflict_handler='resolve')
+    parser.set_defaults(products=1000000)
+    parser.add_argument('--spiders', default=','.join(SPIDER_PROJECTS), help='comma separated spider names')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=int, default=3600, help='seconds each spider runs')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between samples')
+    parser.add_argument('--warmup', type=float, default=300.0, help='seconds before the baseline snapshot')
+    parser.add_argument('--frames', type=int, default=1, help='traceback frames kept by tracemalloc')
+    parser.add_argument('--budget', type=int, default=4096, help='RSS growth allowed per item, in bytes')
+    parser.add_argument('--min-growth', type=int, default=100,
+                        help='live objects a type must gain after the warm-up to be reported as growing')
+    parser.add_argument('--out', default='soak_results', help='directory for logs and reports')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spiders = parse_spiders(args.spiders)
+
+    server = start_server(args)
+    reports = []
+    try:
+        for spider in spiders:
+            reports.append(soak_spider(spider, args))
+    finally:
+        stop_server(server)
+
+    print_summary(reports)
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump([{key: value for key, value in report.items() if key != 'samples'} for report in reports], f,
+                  indent=2)
+    if not all(report['passed'] for report in reports):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
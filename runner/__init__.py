@@ -0,0 +1,3 @@
+"""
+Runs the spiders of both scrapy projects together in one process.
+"""
@@ -0,0 +1,222 @@
+"""
+Single process runner for all spiders.
+
+Runs thesting, arket_spider, marcjacobs_spider and mohangi (or a subset) in one
+CrawlerProcess, so interpreter startup, settings loading and reactor setup are
+paid once. Every spider keeps the settings of its own project, with:
+
+- a per-spider concurrency cap (CONCURRENT_REQUESTS of that crawler),
+- a global cap on downloads in flight across all spiders (GlobalConcurrencyDownloader),
+- item pipelines created once per project and class and shared by the spiders of the project
+  (SharedItemPipelineManager), writing to <project>/Products.db, or to <db-dir>/<project>/Products.db
+  with --db-dir,
+- one combined stats report at the end, also written to --stats-file.
+
+Usage:
+    python -m runner.crawl
+    python -m runner.crawl --spiders thesting,mohangi --concurrency 32 --spider-concurrency thesting=8
+    python -m runner.crawl -s LOG_LEVEL=INFO --db-dir out
+
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from scrapy.core.downloader import Downloader
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines import ItemPipelineManager
+from scrapy.pipelines.media import MediaPipeline
+from scrapy.settings import Settings
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.defer import deferred_f_from_coro_f
+from scrapy.utils.misc import create_instance, load_object
+from twisted.internet.defer import DeferredSemaphore
+
+from crawlkit.launcher import merge_stats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# spider name -> scrapy project directory, the package has the same name
+SPIDER_PROJECTS = {
+    'thesting': 'the_sting',
+    'arket_spider': 'the_sting',
+    'marcjacobs_spider': 'the_sting',
+    'mohangi': 'clothing_spider',
+}
+
+
+class GlobalConcurrencyDownloader(Downloader):
+    # Caps the downloads in flight over all crawlers of the process to
+    # GLOBAL_CONCURRENT_REQUESTS. The token is taken around the download
+    # handler call, after DOWNLOAD_DELAY and the per-slot limits, so requests
+    # waiting in a delayed slot do not hold back the other spiders.
+
+    semaphore = None
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        limit = crawler.settings.getint('GLOBAL_CONCURRENT_REQUESTS')
+        if not limit:
+            return
+        cls = type(self)
+        if cls.semaphore is None or cls.semaphore.limit != limit:
+            cls.semaphore = DeferredSemaphore(limit)
+        download_request = self.handlers.download_request
+
+        def limited_download_request(request, spider):
+            return self.semaphore.run(download_request, request, spider)
+
+        self.handlers.download_request = limited_download_request
+
+
+class SharedItemPipelineManager(ItemPipelineManager):
+    # Creates every item pipeline class once per project, the spiders of the
+    # project get the same instance (and so the same database connection).
+    # Shared instances are built from the project settings, without a crawler
+    # (a pipeline with a connect_signals(crawler) method is connected to every
+    # crawler using it), and are reference counted: open_spider runs for the
+    # first spider, close_spider when the last one closes.
+    #
+    # Media pipelines keep the state of their spider and download through its
+    # engine, they are created for every crawler.
+
+    # (project, class path) -> pipeline, None when not configured
+    instances = {}
+    # shared pipeline -> number of its spiders that are open
+    users = {}
+
+    @classmethod
+    def from_settings(cls, settings, crawler=None):
+        pipelines = []
+        for clspath in cls._get_mwlist_from_settings(settings):
+            pipecls = load_object(clspath)
+            if issubclass(pipecls, MediaPipeline):
+                try:
+                    pipelines.append(create_instance(pipecls, settings, crawler))
+                except NotConfigured:
+                    pass
+                continue
+            key = (settings['BOT_NAME'], clspath)
+            if key not in cls.instances:
+                try:
+                    cls.instances[key] = create_instance(pipecls, settings, None)
+                    cls.users[cls.instances[key]] = 0
+                except NotConfigured:
+                    cls.instances[key] = None
+            pipeline = cls.instances[key]
+            if pipeline is None:
+                continue
+            if crawler is not None and hasattr(pipeline, 'connect_signals'):
+                pipeline.connect_signals(crawler)
+            pipelines.append(pipeline)
+        return cls(*pipelines)
+
+    def _add_middleware(self, pipe):
+        if pipe not in self.users:
+            return super()._add_middleware(pipe)
+        self.methods['open_spider'].append(lambda spider: self.open_shared(pipe, spider))
+        self.methods['close_spider'].appendleft(lambda spider: self.close_shared(pipe, spider))
+        if hasattr(pipe, 'process_item'):
+            self.methods['process_item'].append(deferred_f_from_coro_f(pipe.process_item))
+
+    def open_shared(self, pipe, spider):
+        self.users[pipe] += 1
+        if self.users[pipe] == 1 and hasattr(pipe, 'open_spider'):
+            return pipe.open_spider(spider)
+
+    def close_shared(self, pipe, spider):
+        self.users[pipe] -= 1
+        if self.users[pipe] == 0 and hasattr(pipe, 'close_spider'):
+            return pipe.close_spider(spider)
+
+
+def project_settings(project, args):
+    settings = Settings()
+    settings.setmodule('%s.settings' % project, priority='project')
+    db_dir = os.path.join(args.db_dir, project) if args.db_dir else os.path.join(ROOT, project)
+    settings['PRODUCTS_DB'] = os.path.join(db_dir, 'Products.db')
+    settings['ITEM_PROCESSOR'] = 'runner.crawl.SharedItemPipelineManager'
+    settings['GLOBAL_CONCURRENT_REQUESTS'] = args.concurrency
+    settings['DOWNLOADER'] = 'runner.crawl.GlobalConcurrencyDownloader'
+    for name, value in args.set:
+        settings.set(name, value, priority='cmdline')
+    return settings
+
+
+def combined_report(crawlers):
+    per_spider = {}
+    for crawler in crawlers:
+        per_spider[crawler.spidercls.name] = {key: value if isinstance(value, (int, float, str)) else str(value)
+                                             for key, value in crawler.stats.get_stats().items()}
+    return {'total': merge_stats(per_spider.values()), 'spiders': per_spider}
+
+
+def pair(value):
+    name, sep, setting = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE, got %r" % value)
+    return name, setting
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several spiders in one process")
+    parser.add_argument('--spiders', default=','.join(SPIDER_PROJECTS))
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="downloads in flight over all spiders, 0 for no global cap")
+    parser.add_argument('--spider-concurrency', type=pair, action='append', default=[], metavar='SPIDER=N',
+                        help="requests in flight for one spider (CONCURRENT_REQUESTS of its crawler)")
+    parser.add_argument('--db-dir', help="directory with a <project>/Products.db per project, the project "
+                                         "directories by default")
+    parser.add_argument('--stats-file', default='combined_stats.json')
+    parser.add_argument('-s', dest='set', type=pair, action='append', default=[], metavar='NAME=VALUE',
+                        help="setting applied to every spider")
+    args = parser.parse_args()
+
+    spiders = [name.strip() for name in args.spiders.split(',') if name.strip()]
+    unknown = [name for name in spiders if name not in SPIDER_PROJECTS]
+    if unknown:
+        parser.error("unknown spiders: %s" % ', '.join(unknown))
+    if args.db_dir:
+        for name in spiders:
+            os.makedirs(os.path.join(args.db_dir, SPIDER_PROJECTS[name]), exist_ok=True)
+
+    for project in set(SPIDER_PROJECTS.values()):
+        path = os.path.join(ROOT, project)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    spider_concurrency = {name: int(value) for name, value in args.spider_concurrency}
+    crawlers = []
+    for name in spiders:
+        settings = project_settings(SPIDER_PROJECTS[name], args)
+        if name in spider_concurrency:
+            settings.set('CONCURRENT_REQUESTS', spider_concurrency[name], priority='cmdline')
+        spidercls = SpiderLoader.from_settings(settings).load(name)
+        # the first crawler installs TWISTED_REACTOR, the others check they agree with it
+        crawlers.append(Crawler(spidercls, settings, init_reactor=True))
+
+    # logging and reactor come from the first spider's project
+    process = CrawlerProcess(crawlers[0].settings)
+    for crawler in crawlers:
+        process.crawl(crawler)
+    process.start()
+
+    report = combined_report(crawlers)
+    with open(args.stats_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, stats in report['spiders'].items():
+        print("%s: %d items, %d responses, %s" % (
+            name, stats.get('item_scraped_count', 0), stats.get('response_received_count', 0),
+            stats.get('finish_reason')))
+    total = report['total']
+    print("total: %d items, %d responses in %.1fs" % (
+        total.get('item_scraped_count', 0), total.get('response_received_count', 0),
+        total.get('elapsed_time_seconds', 0)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the crawlkit package and the project packages, as `scrapy crawl` finds them
+# from the project directories
+for path in (ROOT, os.path.join(ROOT, 'the_sting'), os.path.join(ROOT, 'clothing_spider')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
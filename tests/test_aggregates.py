@@ -0,0 +1,146 @@
+import random
+import sqlite3
+
+import pytest
+from scrapy import Spider
+
+from clothing_spider.pipelines import SqlitePipeline
+from crawlkit.aggregates import Aggregates
+
+
+def product(n, price, original=None, stock=True, category='Women'):
+    return {
+        'url': 'https://mohagni.com/p/%d' % n,
+        'currency': 'PKR',
+        'country_code': 'PK',
+        'title': 'Product %d' % n,
+        'category_names': category,
+        'size_infos': [{'size_name': 'M', 'size_current_price_text': price,
+                        'size_original_price_text': original or price, 'stock': stock}],
+    }
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    pipeline = SqlitePipeline(str(tmp_path / 'Products.db'), batch_size=3)
+    yield pipeline
+    pipeline.con.close()
+
+
+def summary(pipeline, dimension, value):
+    return pipeline.con.execute(
+        "SELECT products, avg_price, min_price, max_price, discount_share, in_stock_ratio FROM ProductSummary "
+        "WHERE dimension = ? AND value = ?", (dimension, value)).fetchone()
+
+
+def test_insert_and_update(pipeline):
+    spider = Spider('mohangi')
+    pipeline.process_item(product(1, 1000), spider)
+    pipeline.process_item(product(2, 3000, original=4000, stock=False), spider)
+    pipeline.commit(spider)
+    assert summary(pipeline, 'category', 'Women') == (2, 2000.0, 1000.0, 3000.0, 0.5, 0.5)
+    # the cheapest product changes price
+    pipeline.process_item(product(1, 5000), spider)
+    pipeline.commit(spider)
+    assert summary(pipeline, 'category', 'Women') == (2, 4000.0, 3000.0, 5000.0, 0.5, 0.5)
+    assert pipeline.aggregates.check() == []
+
+
+def test_partial_items_merge(pipeline):
+    spider = Spider('mohangi')
+    pipeline.process_item(product(1, 1000), spider)
+    # sitemap category item, it only carries the url and the category
+    pipeline.process_item({'url': 'https://mohagni.com/p/1', 'category_names': 'Sale'}, spider)
+    pipeline.commit(spider)
+    assert pipeline.con.execute("SELECT COUNT(*), category_names, title FROM Products").fetchone() == (
+        1, 'Sale', 'Product 1')
+    assert summary(pipeline, 'category', 'Women') is None
+    assert summary(pipeline, 'category', 'Sale')[0] == 1
+    assert pipeline.aggregates.check() == []
+
+
+def test_random_updates_match(pipeline):
+    spider = Spider('mohangi')
+    rng = random.Random(1)
+    for _ in range(500):
+        pipeline.process_item(product(rng.randrange(50), rng.randrange(1, 20) * 500,
+                                      original=rng.choice([None, 10000]), stock=rng.random() < 0.7,
+                                      category=rng.choice(['Women', 'Men', 'Sale'])), spider)
+    pipeline.commit(spider)
+    assert pipeline.aggregates.check() == []
+
+
+def test_batches(pipeline):
+    spider = Spider('mohangi')
+    for n in range(2):
+        pipeline.process_item(product(n, 1000), spider)
+    other = sqlite3.connect(pipeline.con.execute("PRAGMA database_list").fetchone()[2])
+    # nothing is written before the batch is full
+    assert other.execute("SELECT COUNT(*) FROM Products").fetchone()[0] == 0
+    pipeline.process_item(product(2, 1000), spider)
+    assert other.execute("SELECT COUNT(*) FROM Products").fetchone()[0] == 3
+    other.close()
+
+
+def test_unbindable_value_loses_its_row_only(pipeline):
+    spider = Spider('mohangi')
+    pipeline.process_item(product(1, 1000), spider)
+    pipeline.process_item(dict(product(2, 1000), title={'en': 'Product 2'}), spider)
+    pipeline.process_item(product(3, 1000), spider)
+    assert [row[0] for row in pipeline.con.execute("SELECT url FROM Products ORDER BY url")] == [
+        'https://mohagni.com/p/1', 'https://mohagni.com/p/3']
+    assert pipeline.aggregates.check() == []
+
+
+def test_failed_batch_is_kept(pipeline, monkeypatch):
+    spider = Spider('mohangi')
+    store = pipeline.store
+    calls = []
+
+    def failing_store(values, columns):
+        calls.append(values['url'])
+        if len(calls) == 2:
+            raise sqlite3.OperationalError('disk I/O error')
+        store(values, columns)
+
+    monkeypatch.setattr(pipeline, 'store', failing_store)
+    pipeline.process_item(product(1, 1000), spider)
+    pipeline.process_item(product(2, 1000), spider)
+    with pytest.raises(sqlite3.OperationalError):
+        pipeline.process_item(product(3, 1000), spider)
+    # the row written before the error is rolled back with its aggregates
+    assert not pipeline.con.in_transaction
+    assert pipeline.con.execute("SELECT COUNT(*) FROM Products").fetchone()[0] == 0
+    assert pipeline.con.execute("SELECT COUNT(*) FROM ProductAggregates").fetchone()[0] == 0
+    assert len(pipeline.pending) == 3
+    pipeline.commit(spider)
+    assert pipeline.con.execute("SELECT COUNT(*) FROM Products").fetchone()[0] == 3
+    assert pipeline.aggregates.check() == []
+
+
+def test_check_finds_differences(pipeline):
+    spider = Spider('mohangi')
+    pipeline.process_item(product(1, 1000), spider)
+    pipeline.commit(spider)
+    pipeline.con.execute("UPDATE ProductAggregates SET products = 5 WHERE dimension = 'country'")
+    pipeline.con.execute("DELETE FROM ProductAggregatePrices WHERE dimension = 'category'")
+    differences = pipeline.aggregates.check()
+    assert ('country', 'PK', 'PKR') in [key for key, stored, computed in differences]
+    assert (('category', 'Women', 'PKR'), 'price counts', None) in differences
+    assert pipeline.aggregates.rebuild() == 2
+    assert pipeline.aggregates.check() == []
+
+
+def test_built_for_existing_rows(tmp_path):
+    path = str(tmp_path / 'Products.db')
+    spider = Spider('mohangi')
+    pipeline = SqlitePipeline(path, aggregates=False)
+    pipeline.process_item(product(1, 1000), spider)
+    pipeline.close_spider(spider)
+
+    con = sqlite3.connect(path)
+    aggregates = Aggregates(con, SqlitePipeline.product_measures)
+    assert aggregates.check() == []
+    assert con.execute("SELECT products, min_price FROM ProductAggregates WHERE dimension = 'country'").fetchone() == (
+        1, 100000)
+    con.close()
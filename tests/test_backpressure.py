@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.utils.test import get_crawler
+
+from crawlkit.backpressure import BackpressureScheduler, SpillFile
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+    detail_callbacks = ('parse_product',)
+
+    def parse_listing(self, response):
+        pass
+
+    def parse_product(self, response):
+        pass
+
+
+def make_scheduler(tmp_path, **settings):
+    crawler = get_crawler(ShopSpider, dict({
+        'SCHEDULER_DETAIL_THRESHOLD': 2,
+        'SCHEDULER_DISCOVERY_IN_FLIGHT': 1,
+        'SCHEDULER_SPILL_DIR': str(tmp_path),
+        'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7',
+    }, **settings))
+    spider = ShopSpider.from_crawler(crawler)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(active={'a download'}))
+    scheduler = BackpressureScheduler.from_crawler(crawler)
+    scheduler.open(spider)
+    return scheduler
+
+
+def listing(spider, n):
+    return Request('https://shop.example/c/%d' % n, spider.parse_listing)
+
+
+def product(spider, n, **kwargs):
+    return Request('https://shop.example/p/%d' % n, spider.parse_product, **kwargs)
+
+
+def drain(scheduler):
+    requests = []
+    while True:
+        request = scheduler.next_request()
+        if request is None:
+            return requests
+        requests.append(request)
+
+
+def test_details_before_discovery(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    spider = scheduler.spider
+    for n in range(2):
+        scheduler.enqueue_request(listing(spider, n))
+    for n in range(4):
+        scheduler.enqueue_request(product(spider, n))
+    requests = drain(scheduler)
+    served = [request.url.rpartition('.example')[2] for request in requests]
+    # a listing once fewer than 2 details are pending, then only one in flight
+    assert served == ['/p/3', '/p/2', '/p/1', '/c/1', '/p/0']
+    assert scheduler.stats.get_value('backpressure/held') == 4
+    assert len(scheduler) == 1
+    # the next listing once the first one left the downloader
+    scheduler.request_left_downloader(requests[3], spider)
+    assert scheduler.next_request().url == 'https://shop.example/c/0'
+    assert not scheduler.has_pending_requests()
+
+
+def test_discovery_served_when_nothing_is_downloading(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    spider = scheduler.spider
+    scheduler.enqueue_request(listing(spider, 0))
+    scheduler.enqueue_request(listing(spider, 1))
+    in_flight = scheduler.next_request()
+    assert scheduler.next_request() is None
+    scheduler.crawler.engine.downloader.active = set()
+    assert scheduler.next_request().url == 'https://shop.example/c/0'
+    assert in_flight.url == 'https://shop.example/c/1'
+
+
+def test_requests_over_the_cap_are_spilled(tmp_path):
+    scheduler = make_scheduler(tmp_path, SCHEDULER_MEMORY_CAP=2)
+    spider = scheduler.spider
+    for n in range(5):
+        scheduler.enqueue_request(product(spider, n, priority=n % 2, meta={'country': 'nl'}))
+    detail = scheduler.classes['detail']
+    assert detail.size == 2 and detail.spill.size == 3 and len(scheduler) == 5
+    assert scheduler.stats.get_value('backpressure/spilled') == 3
+    assert scheduler.stats.get_value('backpressure/max_pending/detail') == 5
+    served = drain(scheduler)
+    assert sorted(request.url for request in served) == ['https://shop.example/p/%d' % n for n in range(5)]
+    assert all(request.callback == spider.parse_product and request.meta['country'] == 'nl' for request in served)
+    assert detail.spill.size == 0
+    scheduler.close('finished')
+
+
+def test_duplicates_are_filtered(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    spider = scheduler.spider
+    assert scheduler.enqueue_request(product(spider, 1))
+    assert not scheduler.enqueue_request(product(spider, 1))
+    assert scheduler.enqueue_request(product(spider, 1, dont_filter=True))
+    assert len(scheduler) == 2
+
+
+def test_spill_file_is_a_fifo(tmp_path):
+    spill = SpillFile(str(tmp_path))
+    for n in range(3):
+        spill.push('line %d' % n)
+    assert spill.pop(2) == ['line 0\n', 'line 1\n']
+    spill.push('line 3')
+    assert spill.pop(5) == ['line 2\n', 'line 3\n']
+    assert spill.size == 0 and spill.read_pos == 0
+    spill.close()
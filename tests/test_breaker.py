@@ -0,0 +1,161 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TimeoutError
+
+from crawlkit.breaker import CircuitBreakerMiddleware, CircuitOpen
+
+
+class BreakerSpider(Spider):
+    name = 'breaker'
+    circuit_breaker_routes = [('variations', r'/Product-Variation$')]
+
+
+class Engine:
+    # records the requests the middleware schedules again
+
+    def __init__(self):
+        self.requests = []
+
+    def crawl(self, request):
+        self.requests.append(request)
+
+
+@pytest.fixture
+def breaker():
+    crawler = get_crawler(BreakerSpider, {
+        'CIRCUIT_BREAKER_ENABLED': True,
+        'CIRCUIT_BREAKER_WINDOW': 4,
+        'CIRCUIT_BREAKER_MIN_REQUESTS': 4,
+        'CIRCUIT_BREAKER_ERROR_RATE': 0.5,
+        'CIRCUIT_BREAKER_COOLDOWN': 60,
+        'CIRCUIT_BREAKER_MAX_PROBES': 2,
+    })
+    crawler.engine = Engine()
+    spider = BreakerSpider.from_crawler(crawler)
+    mw = CircuitBreakerMiddleware.from_crawler(crawler)
+    mw.spider_opened(spider)
+    yield mw, spider
+    mw.spider_closed(spider)
+
+
+def variation(n=0):
+    return Request('https://shop.example/Product-Variation?pid=%d' % n)
+
+
+def download(mw, spider, request, status=200):
+    assert mw.process_request(request, spider) is None
+    return mw.process_response(request, Response(request.url, status=status, request=request), spider)
+
+
+def open_circuit(mw, spider):
+    for n, status in enumerate([200, 503, 200, 503]):
+        download(mw, spider, variation(n), status)
+
+
+def stat(mw, key):
+    return mw.stats.get_value('circuit_breaker/%s' % key)
+
+
+def test_routes(breaker):
+    mw, spider = breaker
+    assert mw.route(variation()) == 'shop.example/variations'
+    assert mw.route(Request('https://shop.example/p/1')) == 'shop.example/*'
+
+
+def test_opens_at_error_rate(breaker):
+    mw, spider = breaker
+    for n, status in enumerate([200, 503, 200]):
+        download(mw, spider, variation(n), status)
+    assert stat(mw, 'opened') is None
+    download(mw, spider, variation(3), 503)
+    assert stat(mw, 'opened') == 1
+    with pytest.raises(IgnoreRequest):
+        mw.process_request(variation(4), spider)
+    assert stat(mw, 'deferred') == 1
+    # other routes are not affected
+    assert mw.process_request(Request('https://shop.example/p/1'), spider) is None
+
+
+def test_download_errors_count_as_failures(breaker):
+    mw, spider = breaker
+    for n in range(4):
+        request = variation(n)
+        mw.process_request(request, spider)
+        mw.process_exception(request, TimeoutError(), spider)
+    assert stat(mw, 'opened') == 1
+
+
+def test_not_enough_requests(breaker):
+    mw, spider = breaker
+    for n in range(3):
+        download(mw, spider, variation(n), 503)
+    assert stat(mw, 'opened') is None
+
+
+def errback(failure):
+    pass
+
+
+def test_deferred_requests_do_not_fail(breaker):
+    mw, spider = breaker
+    open_circuit(mw, spider)
+    request = variation(10).replace(errback=errback)
+    with pytest.raises(IgnoreRequest) as raised:
+        mw.process_request(request, spider)
+    assert not isinstance(raised.value, CircuitOpen)
+    # the request dropped now never reaches its errback, the one kept aside does
+    assert request.errback is None
+    assert mw.circuits['shop.example/variations'].deferred[0].errback is errback
+
+
+def test_probe_closes_and_resumes(breaker):
+    mw, spider = breaker
+    open_circuit(mw, spider)
+    deferred = [variation(n) for n in range(10, 13)]
+    for request in deferred:
+        with pytest.raises(IgnoreRequest):
+            mw.process_request(request, spider)
+    mw.cooldown = 0
+    probe = variation(20)
+    download(mw, spider, probe)
+    assert stat(mw, 'probes') == 1
+    assert stat(mw, 'closed') == 1
+    assert [request.url for request in mw.crawler.engine.requests] == [request.url for request in deferred]
+    assert all(request.dont_filter for request in mw.crawler.engine.requests)
+    assert mw.process_request(variation(30), spider) is None
+
+
+def test_failed_probes_drop_deferred(breaker):
+    mw, spider = breaker
+    open_circuit(mw, spider)
+    with pytest.raises(IgnoreRequest):
+        mw.process_request(variation(10).replace(errback=errback), spider)
+    mw.cooldown = 0
+    download(mw, spider, variation(20), 503)
+    circuit = mw.circuits['shop.example/variations']
+    assert circuit.opened_at is not None
+    assert circuit.failed_probes == 1
+    assert len(circuit.deferred) == 1
+    download(mw, spider, variation(21), 503)
+    assert circuit.failed_probes == 2
+    assert not circuit.deferred
+    # scheduled again to fail through their errback
+    [dropped] = mw.crawler.engine.requests
+    assert dropped.errback is errback
+    with pytest.raises(CircuitOpen):
+        mw.process_request(dropped, spider)
+    assert stat(mw, 'skipped') == 1
+    assert stat(mw, 'shop.example/variations/skipped') == 1
+
+
+def test_fail_mode_skips(breaker):
+    mw, spider = breaker
+    mw.defer = False
+    open_circuit(mw, spider)
+    with pytest.raises(CircuitOpen):
+        mw.process_request(variation(10), spider)
+    assert stat(mw, 'skipped') == 1
+    assert stat(mw, 'deferred') is None
@@ -0,0 +1,84 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.utils.test import get_crawler
+
+from crawlkit.canonical import (DEFAULT_URL_RULES, CanonicalUrlMiddleware, canonicalize, drop_default_params,
+                                drop_params, keep_params, normalize_path, sort_params)
+
+
+def test_no_rules():
+    url = 'https://Example.com//a/?utm_source=x'
+    assert canonicalize(url, []) == url
+    assert canonicalize(url, None) == url
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://example.com/p?utm_source=mail&utm_medium=x&id=1', 'https://example.com/p?id=1'),
+    ('https://example.com/p?gclid=abc&fbclid=def', 'https://example.com/p'),
+    ('https://EXAMPLE.com//a/./b/../c/#reviews', 'https://example.com/a/c/'),
+    ('https://example.com/a//b', 'https://example.com/a/b'),
+    ('https://example.com/', 'https://example.com/'),
+])
+def test_default_rules(url, expected):
+    assert canonicalize(url, DEFAULT_URL_RULES) == expected
+
+
+def test_drop_params_patterns():
+    assert canonicalize('https://x.com/?a=1&pos=2&position=3', [drop_params('pos*')]) == 'https://x.com/?a=1'
+
+
+def test_drop_params_keeps_encoding():
+    url = 'https://x.com/search?q=red%20dress&utm_source=x'
+    assert canonicalize(url, [drop_params('utm_*')]) == 'https://x.com/search?q=red%20dress'
+
+
+def test_keep_params():
+    url = 'https://x.com/img/a.jpg?width=300&v=2'
+    assert canonicalize(url, [keep_params('v')]) == 'https://x.com/img/a.jpg?v=2'
+    assert canonicalize(url, [keep_params()]) == 'https://x.com/img/a.jpg'
+
+
+def test_drop_default_params():
+    rules = [drop_default_params(page='1')]
+    assert canonicalize('https://x.com/c?page=1&sort=new', rules) == 'https://x.com/c?sort=new'
+    assert canonicalize('https://x.com/c?page=2&sort=new', rules) == 'https://x.com/c?page=2&sort=new'
+
+
+def test_sort_params_keeps_repeated_order():
+    assert canonicalize('https://x.com/?c=1&b=2&a=3&b=1', [sort_params()]) == 'https://x.com/?a=3&b=2&b=1&c=1'
+
+
+def test_rules_limited_to_path():
+    rules = [drop_params('width', path=r'^/img/')]
+    assert canonicalize('https://x.com/img/a.jpg?width=300', rules) == 'https://x.com/img/a.jpg'
+    assert canonicalize('https://x.com/p/a?width=300', rules) == 'https://x.com/p/a?width=300'
+
+
+def test_rules_applied_in_order():
+    rules = [drop_params('utm_*'), drop_default_params(page='1'), sort_params(), normalize_path()]
+    url = 'https://WWW.Shop.com//a/./b/../c/?utm_source=x&page=1&b=2&a=1#frag'
+    assert canonicalize(url, rules) == 'https://www.shop.com/a/c/?a=1&b=2'
+
+
+def canonical_requests(settings, urls):
+    crawler = get_crawler(Spider, dict(settings, REQUEST_FINGERPRINTER_IMPLEMENTATION='2.7'))
+    mw = CanonicalUrlMiddleware.from_crawler(crawler)
+    spider = Spider('shop')
+    requests = [mw.process_request(Request(url), spider) for url in urls]
+    return [request.url for request in requests], crawler.stats
+
+
+URLS = ['https://shop.example/c/1?utm_source=x', 'https://shop.example/c/1', 'https://shop.example/c/2']
+
+
+def test_middleware_rewrites_requests():
+    urls, stats = canonical_requests({}, URLS)
+    assert urls == ['https://shop.example/c/1', 'https://shop.example/c/1', 'https://shop.example/c/2']
+    assert stats.get_value('canonical/requests_rewritten') == 1
+    assert stats.get_value('canonical/requests_avoided') is None
+
+
+def test_middleware_counts_avoided_requests_in_debug():
+    urls, stats = canonical_requests({'CANONICAL_URLS_DEBUG': True}, URLS)
+    assert stats.get_value('canonical/requests_rewritten') == 1
+    assert stats.get_value('canonical/requests_avoided') == 1
@@ -0,0 +1,58 @@
+from scrapy import Request, Spider
+
+from crawlkit.checkpoint import decode_request, encode_request
+
+
+class CheckpointSpider(Spider):
+    name = 'checkpoint'
+
+    def parse_product(self, response):
+        pass
+
+    def product_failed(self, failure):
+        pass
+
+
+def roundtrip(request, spider):
+    return decode_request(encode_request(request, spider), spider)
+
+
+def test_roundtrip_keeps_the_request():
+    spider = CheckpointSpider()
+    request = Request('https://example.com/p/1?color=red', callback=spider.parse_product,
+                      errback=spider.product_failed, priority=5, dont_filter=True,
+                      meta={'country': 'nl', 'categories': ['Women', 'Dresses'], 'depth': 2})
+    decoded = roundtrip(request, spider)
+    assert decoded.url == request.url
+    assert decoded.callback == spider.parse_product
+    assert decoded.errback == spider.product_failed
+    assert decoded.priority == 5
+    assert decoded.dont_filter
+    assert decoded.meta == {'country': 'nl', 'categories': ['Women', 'Dresses'], 'depth': 2}
+
+
+def test_roundtrip_defaults():
+    spider = CheckpointSpider()
+    decoded = roundtrip(Request('https://example.com/'), spider)
+    assert decoded.callback is None
+    assert decoded.errback is None
+    assert decoded.method == 'GET'
+    assert decoded.priority == 0
+    assert not decoded.dont_filter
+
+
+def test_roundtrip_post_body():
+    spider = CheckpointSpider()
+    body = 'q=caf\xe9&page=2'.encode('latin-1')
+    decoded = roundtrip(Request('https://example.com/search', method='POST', body=body), spider)
+    assert decoded.method == 'POST'
+    assert decoded.body == body
+
+
+def test_runtime_private_and_unencodable_meta_dropped():
+    spider = CheckpointSpider()
+    request = Request('https://example.com/', meta={
+        'download_latency': 0.3, 'download_timeout': 180, '_private': 1,
+        'response': object(), 'page': 3,
+    })
+    assert roundtrip(request, spider).meta == {'page': 3}
@@ -0,0 +1,55 @@
+import pytest
+
+from crawlkit import codec
+
+
+@pytest.fixture(params=codec.BACKENDS)
+def backend(request):
+    previous = codec.backend
+    codec.set_backend(request.param)
+    yield request.param
+    codec.set_backend(previous)
+
+
+def test_loads_key_nested_value(backend):
+    assert codec.loads_key('{"a": {"b": [1, 2]}, "c": 3}', 'a') == {'b': [1, 2]}
+
+
+def test_loads_key_bytes():
+    assert codec.loads_key('{"title": "café"}'.encode('utf-8'), 'title') == 'café'
+
+
+def test_loads_key_ignores_the_rest_of_the_document():
+    assert codec.loads_key('{"total": 42, "items": [{"broken', 'total') == 42
+
+
+def test_loads_key_first_occurrence():
+    assert codec.loads_key('{"id": 1, "children": [{"id": 2}]}', 'id') == 1
+
+
+def test_loads_key_escaped_key_and_value():
+    assert codec.loads_key('{"a.b": "x\\"y"}', 'a.b') == 'x"y'
+    # the dot is not a wildcard
+    assert codec.loads_key('{"aXb": 1}', 'a.b') is None
+
+
+def test_loads_key_missing():
+    assert codec.loads_key('{"a": 1}', 'b') is None
+    assert codec.loads_key('{"a": 1}', 'b', default=[]) == []
+
+
+def test_roundtrip(backend):
+    obj = {'title': 'café', 'prices': [19.99, 25], 'stock': True, 'brand': None}
+    assert codec.loads(codec.dumps(obj)) == obj
+    assert codec.loads(codec.dumps(obj).encode('utf-8')) == obj
+
+
+def test_fallback_to_json(backend):
+    # orjson rejects integers over 64 bits and non-string keys
+    assert codec.loads('{"n": 18446744073709551616}') == {'n': 2 ** 64}
+    assert codec.loads(codec.dumps({1: 'a'})) == {'1': 'a'}
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        codec.set_backend('simplejson')
@@ -0,0 +1,78 @@
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from loadtest.sites import TheStingSite
+from the_sting.spiders.arket_spider import ArketSpiderSpider
+from the_sting.spiders.thesting import ThestingSpider
+
+HOME = 'https://www.thesting.com'
+
+
+class TwoCountriesSpider(ThestingSpider):
+    countries_info = [
+        ('nl', 'EUR', 'nl', HOME + '/nl-nl'),
+        ('be', 'EUR', 'nl', HOME + '/be-nl'),
+    ]
+
+
+def make_spider(**kwargs):
+    crawler = get_crawler(TwoCountriesSpider, {'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7'})
+    return TwoCountriesSpider.from_crawler(crawler, **kwargs)
+
+
+def fetch(site, request):
+    path = request.url[len(HOME):]
+    status, headers, body = site.handle(path, '')
+    return HtmlResponse(request.url, status=status, body=body, request=request)
+
+
+def test_one_start_request_per_country():
+    requests = list(make_spider().start_requests())
+    assert [request.url for request in requests] == [HOME + '/nl-nl', HOME + '/be-nl']
+    assert [request.meta['download_slot'] for request in requests] == ['www.thesting.com/nl', 'www.thesting.com/be']
+    assert [request.meta['country'] for request in requests] == ['nl', 'be']
+
+
+def test_countries_argument_selects_a_subset():
+    requests = list(make_spider(countries='be, de').start_requests())
+    assert [request.meta['country'] for request in requests] == ['be']
+
+
+def test_countries_with_the_same_nav_share_its_discovery():
+    spider = make_spider()
+    site = TheStingSite(100, padding=0)
+    nl, be = spider.start_requests()
+
+    sub_navs = list(spider.parse_homepage(fetch(site, nl)))
+    assert sub_navs and all(request.meta['country'] == 'nl' for request in sub_navs)
+    # be joins the nav tree of nl before its sub-nav pages are parsed
+    assert list(spider.parse_homepage(fetch(site, be))) == []
+    assert spider.crawler.stats.get_value('thesting/nav_tree_shared_countries') == 1
+
+    listings = list(spider.parse_sub_nav(fetch(site, sub_navs[0])))
+    for_nl = [request for request in listings if request.meta['country'] == 'nl']
+    for_be = [request for request in listings if request.meta['country'] == 'be']
+    assert len(for_nl) == len(for_be) > 0
+    for nl_listing, be_listing in zip(for_nl, for_be):
+        assert be_listing.url == nl_listing.url.replace('/nl-nl/', '/be-nl/')
+        assert be_listing.meta['categories'] == nl_listing.meta['categories']
+        assert be_listing.meta['download_slot'] == 'www.thesting.com/be'
+        assert fetch(site, be_listing).status == 200
+
+
+def test_countries_joining_late_get_the_listings_found_so_far():
+    spider = make_spider()
+    site = TheStingSite(100, padding=0)
+    nl, be = spider.start_requests()
+    sub_navs = list(spider.parse_homepage(fetch(site, nl)))
+    found = list(spider.parse_sub_nav(fetch(site, sub_navs[0])))
+    shared = list(spider.parse_homepage(fetch(site, be)))
+    assert [request.url for request in shared] == [request.url.replace('/nl-nl/', '/be-nl/') for request in found]
+
+
+def test_locale_url():
+    spider = ArketSpiderSpider()
+    request = Request('https://www.arket.com/ko-kr/women.html', meta={'country': 'kr'})
+    response = HtmlResponse(request.url, body=b'', request=request)
+    assert spider.locale_url(response, 'pda/changeItemInfo.html') == 'https://www.arket.com/ko-kr/pda/changeItemInfo.html'
@@ -0,0 +1,85 @@
+import hashlib
+
+import pytest
+from scrapy import Request
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from crawlkit.dupefilters import BloomDupeFilter, CompactDupeFilter, FingerprintTable, ScalableBloomFilter
+
+
+def fingerprint(n):
+    return hashlib.sha1(b'%d' % n).digest()
+
+
+def test_table_add_and_contains():
+    table = FingerprintTable(capacity=16)
+    assert table.add(fingerprint(1))
+    assert not table.add(fingerprint(1))
+    assert fingerprint(1) in table
+    assert fingerprint(2) not in table
+    assert len(table) == 1
+
+
+def test_table_hex_fingerprints():
+    table = FingerprintTable()
+    table.add(fingerprint(1).hex())
+    assert fingerprint(1) in table
+
+
+def test_table_grows():
+    table = FingerprintTable(capacity=8)
+    slots = table.slots
+    table.update(fingerprint(n) for n in range(1000))
+    assert table.slots > slots
+    assert len(table) == 1000
+    assert all(fingerprint(n) in table for n in range(1000))
+    assert not any(fingerprint(n) in table for n in range(1000, 2000))
+
+
+def test_table_zero_key():
+    # the all zero key marks empty slots and must still be stored
+    table = FingerprintTable(width=4)
+    assert table.add(bytes(20))
+    assert bytes(20) in table
+    assert not table.add(bytes(20))
+
+
+def test_table_spill_dir(tmp_path):
+    table = FingerprintTable(capacity=8, spill_dir=str(tmp_path))
+    table.update(fingerprint(n) for n in range(100))
+    assert all(fingerprint(n) in table for n in range(100))
+    table.close()
+
+
+def test_bloom_no_false_negatives():
+    bloom = ScalableBloomFilter(error_rate=1e-6, capacity=100)
+    added = sum(bloom.add(fingerprint(n)) for n in range(2000))
+    # the filter grew past its first capacity
+    assert len(bloom.filters) > 1
+    assert len(bloom) == added == 2000
+    assert all(fingerprint(n) in bloom for n in range(2000))
+    assert not bloom.add(fingerprint(0))
+
+
+@pytest.mark.parametrize('error_rate', [0.01, 0.001])
+def test_bloom_false_positive_rate(error_rate):
+    bloom = ScalableBloomFilter(error_rate=error_rate, capacity=500)
+    bloom.update(fingerprint(n) for n in range(10000))
+    probes = 50000
+    false_positives = sum(fingerprint(n) in bloom for n in range(10000, 10000 + probes))
+    # the fingerprints are fixed, the margin only covers the sample size
+    assert false_positives / probes <= 1.2 * error_rate
+
+
+@pytest.mark.parametrize('cls', [CompactDupeFilter, BloomDupeFilter])
+def test_dupefilter_jobdir(cls, tmp_path):
+    fingerprinter = get_crawler(settings_dict={'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7'}).request_fingerprinter
+    dupefilter = cls(str(tmp_path), fingerprinter=fingerprinter, fingerprints=cls.make_fingerprints(Settings()))
+    assert not dupefilter.request_seen(Request('https://example.com/a'))
+    assert dupefilter.request_seen(Request('https://example.com/a'))
+    dupefilter.close('finished')
+    resumed = cls(str(tmp_path), fingerprinter=fingerprinter, fingerprints=cls.make_fingerprints(Settings()))
+    assert resumed.request_seen(Request('https://example.com/a'))
+    assert not resumed.request_seen(Request('https://example.com/b'))
+    resumed.close('finished')
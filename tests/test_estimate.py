@@ -0,0 +1,165 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+
+from crawlkit.estimate import CatalogEstimateMixin
+
+LISTING = 'https://shop.example/c'
+
+
+class EstimateSpider(CatalogEstimateMixin, Spider):
+    name = 'estimate'
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.setup_catalog_estimate(crawler)
+        return spider
+
+    def estimate_tiles(self, response):
+        return response.text.split()
+
+    def estimate_page_url(self, next_url, page, page_size):
+        return '%s?page=%d' % (LISTING, page)
+
+
+class Site:
+    # a listing of `products` products, `page_size` per page; pages out of
+    # range are served empty, as page 1 ('first') or as a 404
+
+    def __init__(self, products, page_size=10, out_of_range='empty'):
+        self.products = products
+        self.page_size = page_size
+        self.out_of_range = out_of_range
+
+    def tiles(self, page):
+        first = (page - 1) * self.page_size
+        return ['p%d' % n for n in range(first, min(first + self.page_size, self.products))]
+
+    def respond(self, request):
+        page = int(request.url.rpartition('=')[2]) if '?page=' in request.url else 1
+        tiles = self.tiles(page)
+        status = 200
+        if not tiles and page > 1:
+            if self.out_of_range == 'first':
+                tiles = self.tiles(1)
+            elif self.out_of_range == 404:
+                status = 404
+        return TextResponse(request.url, status=status, body=' '.join(tiles).encode(), encoding='utf-8',
+                            request=request)
+
+
+def make_spider(max_probes=16, sample=1.0):
+    crawler = get_crawler(EstimateSpider, {
+        'CATALOG_ESTIMATE': True,
+        'CATALOG_ESTIMATE_MAX_PROBES': max_probes,
+        'CATALOG_ESTIMATE_SAMPLE': sample,
+    })
+    return EstimateSpider.from_crawler(crawler)
+
+
+def crawl(site, requests):
+    requests = list(requests)
+    while requests:
+        request = requests.pop()
+        requests.extend(request.callback(site.respond(request)) or ())
+
+
+def probe_catalog(spider, site):
+    first = site.respond(Request(LISTING))
+    next_url = LISTING + '?page=2' if site.products > site.page_size else None
+    crawl(site, spider.estimate_by_probing(first, 'nl', ['Women'], next_url))
+    return spider.catalog_estimate.categories[LISTING]
+
+
+@pytest.mark.parametrize('out_of_range', ['empty', 'first', 404])
+@pytest.mark.parametrize('products', [1, 7, 10, 11, 20, 95, 100, 1234])
+def test_probing_finds_the_exact_count(products, out_of_range):
+    spider = make_spider()
+    category = probe_catalog(spider, Site(products, out_of_range=out_of_range))
+    assert category.exact
+    assert category.low == category.high == products
+    assert category.probes <= 16
+
+
+@pytest.mark.parametrize('products', [35, 95, 1234, 5000])
+def test_probing_bounds(products):
+    spider = make_spider(max_probes=3)
+    category = probe_catalog(spider, Site(products))
+    assert category.probes <= 3
+    assert category.low <= products
+    assert category.high is None or products <= category.high
+    estimate = category.estimate()
+    assert category.low <= estimate
+    assert category.high is None or estimate <= category.high
+
+
+def test_probe_errback_keeps_the_bounds():
+    spider = make_spider()
+    site = Site(95)
+    probe, = spider.estimate_by_probing(site.respond(Request(LISTING)), 'nl', ['Women'], LISTING + '?page=2')
+    failure = Failure(TimeoutError())
+    failure.request = probe
+    probe.errback(failure)
+    category = spider.catalog_estimate.categories[LISTING]
+    assert (category.low, category.high) == (10, None)
+    assert spider.crawler.stats.get_value('estimate/probe_errors') == 1
+
+
+def test_total_is_exact():
+    spider = make_spider()
+    spider.estimate_from_total(Site(95).respond(Request(LISTING)), 'nl', ['Women'], 95, 10)
+    category = spider.catalog_estimate.categories[LISTING]
+    assert category.exact
+    assert (category.low, category.pages) == (95, 10)
+
+
+@pytest.mark.parametrize('out_of_range', ['empty', 404])
+def test_pages_sampled(out_of_range):
+    spider = make_spider(sample=1.0)
+    site = Site(95, out_of_range=out_of_range)
+    crawl(site, spider.estimate_from_pages(site.respond(Request(LISTING)), 'nl', ['Women'], 10,
+                                           LISTING + '?page=10'))
+    category = spider.catalog_estimate.categories[LISTING]
+    assert category.exact
+    assert category.low == 95
+
+
+def test_pages_last_page_gone():
+    spider = make_spider(sample=1.0)
+    # the listing shows 10 pages, but the last one answers 404
+    site = Site(90, out_of_range=404)
+    crawl(site, spider.estimate_from_pages(site.respond(Request(LISTING)), 'nl', ['Women'], 10,
+                                           LISTING + '?page=10'))
+    category = spider.catalog_estimate.categories[LISTING]
+    assert not category.exact
+    assert (category.low, category.high) == (91, 100)
+
+
+def test_pages_unsampled_bounds():
+    spider = make_spider(sample=0.0)
+    site = Site(95)
+    assert not list(spider.estimate_from_pages(site.respond(Request(LISTING)), 'nl', ['Women'], 10,
+                                               LISTING + '?page=10'))
+    category = spider.catalog_estimate.categories[LISTING]
+    assert (category.low, category.high) == (91, 100)
+    assert category.estimate() == 95.5
+    assert category.estimate(last_page_fill=3) == 93
+
+
+def test_listing_reached_twice_counts_once():
+    spider = make_spider()
+    site = Site(95)
+    assert len(list(spider.estimate_by_probing(site.respond(Request(LISTING)), 'nl', ['Women'],
+                                               LISTING + '?page=2'))) == 1
+    # the same listing under another nav path
+    assert not list(spider.estimate_by_probing(site.respond(Request(LISTING)), 'nl', ['Sale'], LISTING + '?page=2'))
+    spider.estimate_from_total(site.respond(Request(LISTING)), 'nl', ['Sale'], 95, 10)
+    stats = spider.crawler.stats
+    assert stats.get_value('estimate/categories') == 1
+    assert stats.get_value('estimate/probes') == 1
+    assert stats.get_value('estimate/exact') is None
+    assert spider.catalog_estimate.categories[LISTING].categories == ['Women']
@@ -0,0 +1,110 @@
+import itertools
+
+import pytest
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from clothing_spider.spiders.mohangi_spider import MohangiSpider
+from crawlkit import codec, extractcache
+from crawlkit.extractcache import ExtractionCache, code_version
+from loadtest.sites import TheStingSite
+from the_sting.spiders.thesting import ThestingSpider
+
+META = {'country': 'nl', 'language': 'nl', 'currency': 'EUR', 'categories': ['Dames', 'Jeans']}
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # one tick per call, so the least recently used entry is never ambiguous
+    ticks = itertools.count()
+    monkeypatch.setattr(extractcache.time, 'time', lambda: next(ticks))
+
+
+def product_page(pid, meta=META, site=TheStingSite(20, padding=0)):
+    url = 'https://www.thesting.com' + site.product_url(pid)
+    status, headers, body = site.handle(site.product_url(pid), '')
+    return HtmlResponse(url, body=body, request=Request(url, meta=dict(meta)))
+
+
+def make_spider(tmp_path):
+    crawler = get_crawler(ThestingSpider, {'EXTRACTION_CACHE_ENABLED': True, 'EXTRACTION_CACHE_DIR': str(tmp_path)})
+    return ThestingSpider.from_crawler(crawler)
+
+
+def as_dicts(items):
+    return [ItemAdapter(item).asdict() for item in items]
+
+
+def test_items_come_from_the_cache(tmp_path, monkeypatch):
+    first = make_spider(tmp_path)
+    items = as_dicts(first.parse_detail(product_page(1)))
+    first.extraction_cache.spider_closed(first, 'finished')
+    assert first.crawler.stats.get_value('extraction_cache/misses') == 1
+    assert first.crawler.stats.get_value('extraction_cache/stored') == 1
+
+    second = make_spider(tmp_path)
+
+    def extract_detail(response):
+        raise AssertionError("parsed a cached response")
+
+    monkeypatch.setattr(second, 'extract_detail', extract_detail)
+    cached = second.parse_detail(product_page(1))
+    assert as_dicts(cached) == items
+    assert isinstance(cached[0], second.product_item)
+    assert isinstance(cached[0]['size_infos'][0], second.size_item)
+    assert second.crawler.stats.get_value('extraction_cache/hits') == 1
+
+
+def test_key_covers_the_meta_and_the_body(tmp_path):
+    spider = make_spider(tmp_path)
+    cache = spider.extraction_cache
+    response = product_page(1)
+    key = cache.key('extract_detail', response, META)
+    assert cache.key('extract_detail', product_page(1), META) == key
+    assert cache.key('extract_detail', response, dict(META, categories=['Heren'])) != key
+    assert cache.key('extract_detail', response.replace(body=response.body + b' '), META) != key
+    assert cache.key('extract_color', response, META) != key
+
+
+def test_other_code_version_is_dropped(tmp_path):
+    crawler = get_crawler(ThestingSpider)
+    path = str(tmp_path / 'thesting.db')
+    cache = ExtractionCache(crawler, path, 2 ** 20, 'v1')
+    cache.set(b'key', [{'title': 'Shirt'}])
+    assert cache.get(b'key') == [{'title': 'Shirt'}]
+    cache.spider_closed(None, 'finished')
+
+    cache = ExtractionCache(crawler, path, 2 ** 20, 'v2')
+    cache.spider_opened(ThestingSpider())
+    assert crawler.stats.get_value('extraction_cache/invalidated') == 1
+    assert cache.get(b'key') is None and cache.size == 0
+
+
+def test_code_version_follows_the_project():
+    assert code_version(ThestingSpider) == code_version(ThestingSpider)
+    assert code_version(ThestingSpider) != code_version(MohangiSpider)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    crawler = get_crawler(ThestingSpider)
+    entry = [{'title': 'x' * 20}]
+    size = len(codec.dumps(entry))
+    # room for three entries, a fourth one evicts down to 90% of that
+    cache = ExtractionCache(crawler, str(tmp_path / 'thesting.db'), 3 * size, 'v1')
+    for n in range(3):
+        cache.set(b'key %d' % n, entry)
+    cache.get(b'key 0')
+    cache.set(b'key 3', entry)
+    assert crawler.stats.get_value('extraction_cache/evicted') == 2
+    assert [key for key, in cache.con.execute("SELECT key FROM entries ORDER BY key")] == [b'key 0', b'key 3']
+    assert cache.size == 2 * size
+
+
+def test_items_json_cannot_encode_are_not_cached(tmp_path):
+    crawler = get_crawler(ThestingSpider)
+    cache = ExtractionCache(crawler, str(tmp_path / 'thesting.db'), 2 ** 20, 'v1')
+    cache.set(b'key', [{'title': object()}])
+    assert cache.get(b'key') is None
+    assert not crawler.stats.get_value('extraction_cache/stored')
@@ -0,0 +1,175 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from crawlkit.frontier import CLAIMED, LEASED, PENDING, FrontierLeaseMiddleware, FrontierScheduler, prepare_frontier
+from crawlkit.launcher import merge_stats
+
+
+class FrontierSpider(Spider):
+    name = 'frontier'
+
+
+def open_worker(path, worker, **settings):
+    crawler = get_crawler(FrontierSpider, dict({
+        'SCHEDULER': 'crawlkit.frontier.FrontierScheduler',
+        'DUPEFILTER_CLASS': 'crawlkit.frontier.FrontierDupeFilter',
+        'FRONTIER_PATH': str(path),
+        'FRONTIER_WORKER': worker,
+        'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7',
+    }, **settings))
+    scheduler = FrontierScheduler.from_crawler(crawler)
+    crawler.engine = SimpleNamespace(slot=SimpleNamespace(scheduler=scheduler), spider_is_idle=lambda: True)
+    scheduler.open(FrontierSpider())
+    return scheduler
+
+
+@pytest.fixture
+def frontier(tmp_path):
+    scheduler = open_worker(tmp_path / 'frontier.sqlite', 'w1')
+    yield scheduler, FrontierLeaseMiddleware.from_crawler(scheduler.crawler), scheduler.spider
+    scheduler.close('finished')
+
+
+@pytest.fixture
+def workers(tmp_path):
+    w1 = open_worker(tmp_path / 'frontier.sqlite', 'w1', FRONTIER_BATCH_SIZE=2)
+    w2 = open_worker(tmp_path / 'frontier.sqlite', 'w2', FRONTIER_BATCH_SIZE=2)
+    yield w1, w2
+    w1.close('finished')
+    w2.close('finished')
+
+
+def states(scheduler):
+    return [state for state, in scheduler.con.execute("SELECT state FROM requests ORDER BY id")]
+
+
+def fetch(scheduler, url):
+    scheduler.enqueue_request(Request(url))
+    request = scheduler.next_request()
+    return request, Response(url, request=request)
+
+
+def test_lease_kept_until_the_callback_output_is_consumed(frontier):
+    scheduler, mw, spider = frontier
+    request, response = fetch(scheduler, 'https://shop.example/c/1')
+    output = mw.process_spider_output(response, iter([Request('https://shop.example/p/1')]), spider)
+    for child in output:
+        # the engine queues the request before the next one is pulled
+        scheduler.enqueue_request(child)
+        scheduler.delete_finished()
+        assert states(scheduler) == [LEASED, 0]
+    scheduler.delete_finished()
+    assert states(scheduler) == [0]
+    assert scheduler.stats.get_value('frontier/leases_released') == 1
+
+
+def test_lease_released_when_the_callback_fails(frontier):
+    scheduler, mw, spider = frontier
+    request, response = fetch(scheduler, 'https://shop.example/c/1')
+    mw.process_spider_exception(response, ValueError(), spider)
+    scheduler.delete_finished()
+    assert states(scheduler) == []
+
+
+def test_lease_released_with_the_request(frontier):
+    # requests that get no response, e.g. dropped by a downloader middleware
+    scheduler, mw, spider = frontier
+    request, response = fetch(scheduler, 'https://shop.example/c/1')
+    scheduler.delete_finished()
+    assert states(scheduler) == [LEASED]
+    del request, response
+    scheduler.delete_finished()
+    assert states(scheduler) == []
+
+
+def test_middleware_needs_the_frontier():
+    with pytest.raises(NotConfigured):
+        FrontierLeaseMiddleware.from_crawler(get_crawler(FrontierSpider))
+
+
+def test_dupefilter_counts_its_own_fingerprints(frontier):
+    scheduler, mw, spider = frontier
+    for url in ('https://shop.example/c/1', 'https://shop.example/c/2', 'https://shop.example/c/1'):
+        scheduler.enqueue_request(Request(url))
+    assert len(scheduler.df) == 2
+
+
+def test_workers_share_the_queue_and_the_fingerprints(workers):
+    w1, w2 = workers
+    for n in range(3):
+        assert w1.enqueue_request(Request('https://shop.example/c/%d' % n))
+    assert not w2.enqueue_request(Request('https://shop.example/c/1'))
+    # w1 claims a batch of two, w2 gets what is left
+    first = w1.next_request()
+    assert states(w1) == [LEASED, CLAIMED, PENDING]
+    urls = {first.url, w1.next_request().url, w2.next_request().url}
+    assert urls == {'https://shop.example/c/%d' % n for n in range(3)}
+    assert w1.next_request() is None and w2.next_request() is None
+
+
+def test_highest_priority_first(frontier):
+    scheduler, mw, spider = frontier
+    scheduler.enqueue_request(Request('https://shop.example/c/1'))
+    scheduler.enqueue_request(Request('https://shop.example/p/1', priority=10))
+    assert scheduler.next_request().url == 'https://shop.example/p/1'
+    assert scheduler.next_request().url == 'https://shop.example/c/1'
+
+
+def test_leases_of_a_stopped_worker_expire(workers):
+    w1, w2 = workers
+    w1.enqueue_request(Request('https://shop.example/c/1'))
+    request = w1.next_request()
+    assert w2.next_request() is None
+    # w1 stops renewing its lease
+    w1.con.execute("UPDATE requests SET leased_at = leased_at - 3600")
+    w2.empty_since = None
+    assert w2.next_request().url == request.url
+    assert w2.stats.get_value('frontier/leases_expired') == 1
+
+
+def test_closing_worker_hands_back_its_requests(tmp_path, workers):
+    w1, w2 = workers
+    w3 = open_worker(tmp_path / 'frontier.sqlite', 'w3')
+    w3.enqueue_request(Request('https://shop.example/c/1'))
+    w3.enqueue_request(Request('https://shop.example/c/2'))
+    request = w3.next_request()
+    assert states(w2) == [LEASED, CLAIMED]
+    # the request still in flight is not counted as crawled
+    w3.close('shutdown')
+    del request
+    assert states(w2) == [PENDING, PENDING]
+    assert w2.next_request() is not None and w2.next_request() is not None
+
+
+def test_idle_worker_waits_for_the_busy_ones(workers):
+    w1, w2 = workers
+    with pytest.raises(DontCloseSpider):
+        w1.spider_idle(w1.spider)
+    # w2 is idle too once it beats
+    w2.beat()
+    w1.spider_idle(w1.spider)
+
+
+def test_prepare_frontier_releases_the_previous_run(tmp_path, workers):
+    w1, w2 = workers
+    w1.enqueue_request(Request('https://shop.example/c/1'))
+    w1.enqueue_request(Request('https://shop.example/c/2'))
+    # leased by a worker that did not close cleanly
+    request = w1.next_request()
+    prepare_frontier(str(tmp_path / 'frontier.sqlite'), ['a', 'b'])
+    assert states(w1) == [PENDING, PENDING]
+    assert w1.con.execute("SELECT worker, busy FROM workers ORDER BY worker").fetchall() == [('a', 1), ('b', 1)]
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        {'item_scraped_count': 3, 'elapsed_time_seconds': 10.0, 'finish_reason': 'finished'},
+        {'item_scraped_count': 4, 'elapsed_time_seconds': 12.5, 'finish_reason': 'finished'},
+        {'item_scraped_count': 1, 'elapsed_time_seconds': 2.0, 'finish_reason': 'shutdown'},
+    ])
+    assert merged == {'elapsed_time_seconds': 12.5, 'finish_reason': 'finished, shutdown', 'item_scraped_count': 8}
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.web.client import URI
+
+from the_sting import http2
+
+requires_h2 = pytest.mark.skipif(http2.H2DownloadHandler is None, reason="the h2 package is not installed")
+
+
+class ArketSpider(Spider):
+    name = 'arket'
+    http2_domains = ['arket.com']
+
+
+def handler(**settings):
+    crawler = get_crawler(ArketSpider, dict({'HTTP2_ENABLED': True}, **settings))
+    return http2.DomainsDownloadHandler.from_crawler(crawler)
+
+
+@requires_h2
+def test_http2_for_the_spider_domains():
+    spider = ArketSpider()
+    h = handler(HTTP2_DOMAINS=['marcjacobs.com'])
+    assert h.use_http2(Request('https://www.arket.com/ko-kr/pda/changeItemInfo.html'), spider)
+    assert h.use_http2(Request('https://www.marcjacobs.com/on/demandware.store/Product-Variation'), spider)
+    assert not h.use_http2(Request('https://cdn.example.com/a.jpg'), spider)
+    assert not h.use_http2(Request('https://notarket.com/'), spider)
+    assert not h.use_http2(Request('http://www.arket.com/'), spider)
+    assert not h.use_http2(Request('https://www.arket.com/', meta={'proxy': 'http://proxy:3128'}), spider)
+
+
+def test_http11_when_disabled():
+    h = handler(HTTP2_ENABLED=False)
+    assert h.http2 is None
+    assert not h.use_http2(Request('https://www.arket.com/'), ArketSpider())
+
+
+def connection(load, streams=100):
+    return SimpleNamespace(load=load, allowed_max_concurrent_streams=streams)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = http2.HostConnectionPool(reactor, Settings({'HTTP2_MAX_CONNECTIONS_PER_HOST': 2}))
+    opened = []
+
+    def new_connection(key, uri, endpoint):
+        opened.append(key)
+        pool._pending_requests[key] = []
+        return Deferred()
+
+    monkeypatch.setattr(pool, '_new_connection', new_connection)
+    return pool, opened
+
+
+def get(pool):
+    pool.get_connection(('https', 'www.arket.com', 443), URI.fromBytes(b'https://www.arket.com/'), None)
+
+
+@requires_h2
+def test_connections_per_host(pool):
+    pool, opened = pool
+    host = ('https', 'www.arket.com', 443)
+    get(pool)
+    # the second request waits for the connection being made
+    get(pool)
+    assert opened == [host + (0,)]
+    del pool._pending_requests[host + (0,)]
+    pool._connections[host + (0,)] = connection(load=100)
+    # the first connection has no free stream
+    get(pool)
+    assert opened == [host + (0,), host + (1,)]
+    del pool._pending_requests[host + (1,)]
+    pool._connections[host + (1,)] = connection(load=100)
+    # both are full, no third one
+    get(pool)
+    assert len(opened) == 2
+
+
+@requires_h2
+def test_least_busy_connection_is_used(pool):
+    pool, opened = pool
+    host = ('https', 'www.arket.com', 443)
+    pool._connections[host + (0,)] = connection(load=40)
+    pool._connections[host + (1,)] = idle = connection(load=3)
+    used = []
+    pool.get_connection(host, None, None).addCallback(used.append)
+    assert used == [idle] and not opened
+
+
+@requires_h2
+def test_streams_capped_per_connection():
+    protocol = http2.CappedH2ClientProtocol(URI.fromBytes(b'https://www.arket.com/'), Settings(), Deferred())
+    allowed = protocol.allowed_max_concurrent_streams
+    protocol.max_streams = 8
+    assert protocol.allowed_max_concurrent_streams == min(8, allowed)
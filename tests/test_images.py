@@ -0,0 +1,81 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from crawlkit.pipelines import ContentImagesPipeline, make_thumbnails
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+
+
+@pytest.fixture
+def images(tmp_path):
+    crawler = get_crawler(ShopSpider)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(per_slot_settings={}))
+    spider = ShopSpider.from_crawler(crawler)
+    pipeline = ContentImagesPipeline.from_settings(Settings({
+        'IMAGES_STORE': str(tmp_path),
+        'IMAGES_CONCURRENT_REQUESTS_PER_HOST': 2,
+    }))
+    pipeline.open_spider(spider)
+    yield pipeline, pipeline.spiderinfo
+    pipeline.close_spider(spider)
+
+
+def download(pipeline, info, url, body):
+    request = Request(url)
+    return pipeline.file_downloaded(Response(url, body=body, request=request), request, info)
+
+
+def test_disabled_without_images_store():
+    with pytest.raises(NotConfigured):
+        ContentImagesPipeline.from_settings(Settings())
+
+
+def test_image_requests_use_a_slot_per_host(images):
+    pipeline, info = images
+    item = {'image_urls': ['https://cdn.shop.example/a.jpg', 'https://img.shop.example/b.jpg']}
+    requests = pipeline.get_media_requests(item, info)
+    assert [request.meta['download_slot'] for request in requests] == ['images/cdn.shop.example',
+                                                                       'images/img.shop.example']
+    assert all(request.dont_filter for request in requests)
+    per_slot_settings = info.spider.crawler.engine.downloader.per_slot_settings
+    assert per_slot_settings['images/cdn.shop.example'] == {'concurrency': 2, 'delay': 0}
+
+
+def test_images_are_stored_once_by_content(images, tmp_path):
+    pipeline, info = images
+    checksum = download(pipeline, info, 'https://cdn.shop.example/red/a.jpg', b'same image')
+    assert download(pipeline, info, 'https://cdn.shop.example/blue/a.jpg?w=800', b'same image') == checksum
+    other = download(pipeline, info, 'https://cdn.shop.example/b.jpg', b'other image')
+    stored = [name for _, _, names in os.walk(tmp_path / 'full') for name in names]
+    assert sorted(stored) == sorted(['%s.jpg' % checksum, '%s.jpg' % other])
+    assert info.spider.crawler.stats.get_value('file_status_count/duplicate') == 1
+
+
+def test_indexed_images_are_not_requested_again(images, tmp_path):
+    pipeline, info = images
+    checksum = download(pipeline, info, 'https://cdn.shop.example/a.jpg', b'image')
+    result = pipeline.media_to_download(Request('https://cdn.shop.example/a.jpg'), info)
+    assert result == {'url': 'https://cdn.shop.example/a.jpg', 'path': 'full/%s/%s.jpg' % (checksum[:2], checksum),
+                      'checksum': checksum, 'status': 'uptodate'}
+    assert pipeline.media_to_download(Request('https://cdn.shop.example/b.jpg'), info) is None
+    # a file removed from the store is downloaded again
+    os.remove(tmp_path / result['path'])
+    assert pipeline.media_to_download(Request('https://cdn.shop.example/a.jpg'), info) is None
+
+
+def test_make_thumbnails(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmp_path / 'abc.png')
+    Image.new('RGB', (400, 200)).save(path)
+    assert make_thumbnails(path, {'small': [50, 50], 'big': [200, 200]}, str(tmp_path / 'thumbs')) == 2
+    with Image.open(tmp_path / 'thumbs' / 'small' / 'abc.jpg') as thumb:
+        assert thumb.size == (50, 25)
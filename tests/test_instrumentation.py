@@ -0,0 +1,63 @@
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from crawlkit.instrumentation import SIZE_BUCKETS, Histogram
+from crawlkit.middlewares import InstrumentationMiddleware
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for value in [0.001] * 90 + [0.3] * 9 + [42.0]:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert histogram.max == 42.0
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.95) == 0.5
+    # the last observation is capped by the max, not the bucket bound
+    assert histogram.quantile(1.0) == 42.0
+    assert list(histogram.cumulative())[-1] == (float('inf'), 100)
+
+
+def test_histogram_over_the_last_bound():
+    histogram = Histogram(SIZE_BUCKETS)
+    histogram.observe(10 ** 9)
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(0.5) == 10 ** 9
+    assert Histogram().quantile(0.5) == 0
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+
+    def parse_product(self, response):
+        pass
+
+
+def test_middleware_stats():
+    crawler = get_crawler(ShopSpider)
+    spider = ShopSpider.from_crawler(crawler)
+    mw = InstrumentationMiddleware.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    for n, status in enumerate([200, 200, 404]):
+        request = Request('https://shop.example/p/%d' % n, callback=spider.parse_product)
+        mw.request_scheduled(request, spider)
+        mw.process_request(request, spider)
+        response = Response(request.url, status=status, body=b'x' * 2000, request=request)
+        mw.response_downloaded(response.replace(body=b'x' * 500), request, spider)
+        mw.process_response(request, response, spider)
+    failed = Request('https://shop.example/p/9')
+    mw.process_request(failed, spider)
+    mw.process_exception(failed, TimeoutError(), spider)
+    mw.spider_closed(spider)
+
+    stats = crawler.stats.get_stats()
+    assert stats['instrumentation/domain/shop.example/status_count/200'] == 2
+    assert stats['instrumentation/callback/parse_product/status_count/404'] == 1
+    assert stats['instrumentation/callback/parse/exception_count/TimeoutError'] == 1
+    assert stats['instrumentation/domain/shop.example/size/total'] == 6000
+    assert stats['instrumentation/domain/shop.example/wire_size/total'] == 1500
+    assert 'instrumentation/callback/parse_product/queue_wait/p95' in stats
+    assert 'instrumentation/domain/shop.example/latency/max' in stats
+    # nothing is left behind for the finished requests
+    assert not mw.timings
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+from itemadapter import ItemAdapter
+from scrapy import Spider
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from clothing_spider.pipelines import ClothingSpiderPipeline
+from crawlkit.canonical import CanonicalUrlMiddleware
+from crawlkit.items import CompactProductItem, CompactSizeItem, ProductItem, SizeItem, item_classes
+from crawlkit.pipelines import ContentImagesPipeline
+
+
+def category_item():
+    # only what the category pages of sitemap discovery know about a product
+    item = CompactProductItem()
+    item['url'] = 'https://mohagni.com/p/1'
+    item['category_names'] = 'Women'
+    return item
+
+
+def test_adapter_skips_unset_fields():
+    adapter = ItemAdapter(category_item())
+    assert 'url' in adapter
+    assert 'title' not in adapter
+    assert adapter.get('title') is None
+    assert adapter.asdict() == {'url': 'https://mohagni.com/p/1', 'category_names': 'Women'}
+    with pytest.raises(KeyError):
+        adapter['title']
+
+
+def test_partial_item_through_the_pipelines(tmp_path):
+    crawler = get_crawler(Spider)
+    spider = Spider('mohangi')
+    spider.crawler = SimpleNamespace(engine=SimpleNamespace(downloader=SimpleNamespace(per_slot_settings={})))
+    item = category_item()
+
+    item = CanonicalUrlMiddleware(crawler).process_item(item, spider)
+    assert ContentImagesPipeline(str(tmp_path), settings=Settings()).get_media_requests(
+        item, SimpleNamespace(spider=spider)) == []
+    item = ClothingSpiderPipeline().process_item(item, spider)
+    assert dict(item.items()) == {'url': 'https://mohagni.com/p/1', 'category_names': 'Women'}
+
+
+def test_images_of_a_compact_item_are_canonicalized():
+    item = CompactProductItem()
+    item['image_urls'] = ['https://cdn.mohagni.com/a.jpg?utm_source=x', 'https://cdn.mohagni.com/a.jpg']
+    CanonicalUrlMiddleware(get_crawler(Spider)).process_item(item, Spider('mohangi'))
+    assert item['image_urls'] == ['https://cdn.mohagni.com/a.jpg']
+
+
+def test_compact_item_mapping():
+    item = CompactProductItem()
+    item['title'] = 'Linen shirt'
+    item['size_infos'] = []
+    assert item['title'] == 'Linen shirt'
+    assert 'size_infos' in item and 'url' not in item
+    assert len(item) == 2
+    assert item.get('url', 'none') == 'none'
+    with pytest.raises(KeyError):
+        item['url']
+    with pytest.raises(KeyError):
+        item['colour'] = 'red'
+    del item['size_infos']
+    assert item.keys() == ['title']
+    with pytest.raises(KeyError):
+        del item['size_infos']
+
+
+def test_compact_item_copy_and_slots():
+    item = CompactProductItem()
+    item['url'] = 'https://mohagni.com/p/1'
+    copy = item.copy()
+    copy['title'] = 'Copy'
+    assert 'title' not in item
+    assert copy['url'] == item['url']
+    # no per-instance dict, that is the memory it saves
+    assert not hasattr(item, '__dict__')
+    with pytest.raises(AttributeError):
+        item.colour = 'red'
+
+
+def test_compact_items_keep_the_field_meta():
+    assert set(CompactProductItem.fields) == set(ProductItem.fields)
+    assert ItemAdapter.get_field_names_from_class(CompactSizeItem) == list(SizeItem.fields)
+
+
+def test_item_classes_setting():
+    assert item_classes(Settings()) == (ProductItem, SizeItem)
+    assert item_classes(Settings({'COMPACT_ITEMS': True})) == (CompactProductItem, CompactSizeItem)
@@ -0,0 +1,88 @@
+import re
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from loadtest.catalog import Catalog, category_tree
+from loadtest.server import SyntheticServer
+from loadtest.sites import SITES, MohagniSite, TheStingSite
+
+
+@pytest.mark.parametrize('size', [1, 50, 1001])
+def test_listings_split_the_catalog(size):
+    catalog = Catalog(category_tree(3), size, page_size=10)
+    pids = []
+    for index in range(len(catalog.listings)):
+        for page in range(1, catalog.page_count(index) + 1):
+            shown = list(catalog.listing_page(index, page))
+            assert len(shown) <= catalog.page_size
+            assert all(catalog.listing_of(pid) == index for pid in shown)
+            pids.extend(shown)
+    assert pids == list(range(size))
+
+
+def test_colour_variants_share_their_listing():
+    catalog = Catalog(category_tree(3), 1000, colors=3)
+    for pid in range(0, 1000, 37):
+        siblings = catalog.siblings(pid)
+        assert pid in siblings
+        assert {catalog.listing_of(sibling) for sibling in siblings} == {catalog.listing_of(pid)}
+        assert {catalog.product(sibling)['base'] for sibling in siblings} == {siblings[0]}
+
+
+def test_products_are_deterministic():
+    assert Catalog(category_tree(2), 100, seed=1).product(42) == Catalog(category_tree(2), 100, seed=1).product(42)
+    assert Catalog(category_tree(2), 100, seed=1).product(42) != Catalog(category_tree(2), 100, seed=2).product(42)
+
+
+@pytest.mark.parametrize('site_class', [site for site in SITES if hasattr(site, 'product_url')])
+def test_sitemaps_list_every_product(site_class):
+    site = site_class(2500, padding=0)
+    site.sitemap_size = 1000
+    status, _, index = site.handle('/sitemap.xml', '')
+    assert status == 200
+    sitemaps = re.findall(r'<loc>https://[^/]+(/[^<]+)</loc>', index.decode())
+    assert sitemaps == ['/sitemap_pages.xml'] + ['/sitemap_products_%d.xml' % n for n in (1, 2, 3)]
+    urls = []
+    for path in sitemaps[1:]:
+        urls += re.findall(r'<loc>https://[^/]+(/[^<]+)</loc>', site.handle(path, '')[2].decode())
+    assert urls == [site.product_url(pid) for pid in range(2500)]
+    assert site.handle(urls[-1].partition('?')[0], urls[-1].partition('?')[2])[0] == 200
+    assert site.handle('/sitemap_products_4.xml', '') is None
+
+
+def test_other_locales_serve_the_same_catalog():
+    site = TheStingSite(100, padding=0)
+    status, _, body = site.handle('/be-nl', '')
+    assert status == 200
+    assert b'/be-nl/' in body and b'/nl-nl/' not in body
+    assert site.handle('/nl-nl/no-such-category', '') is None
+
+
+@pytest.fixture
+def server():
+    server = SyntheticServer(('127.0.0.1', 0), products=100, padding=0, outage='/collections/', outage_seconds=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1], server
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_routes_by_host(server):
+    url, srv = server
+    with urlopen(url + '/%s/robots.txt' % MohagniSite.host) as response:
+        assert response.read() == b'User-agent: *\nAllow: /\n'
+    with urlopen(url + '/cdn.example.com/images/1.jpg') as response:
+        assert response.headers['Content-Type'] == 'image/png'
+    with pytest.raises(HTTPError) as error:
+        urlopen(url + '/%s/no-such-page' % MohagniSite.host)
+    assert error.value.code == 404
+    # --outage without --outage-seconds lasts the whole run
+    with pytest.raises(HTTPError) as error:
+        urlopen(url + '/%s/collections/women' % MohagniSite.host)
+    assert error.value.code == 503
+    assert srv.stats[MohagniSite.host]['requests'] == 3
+    assert srv.stats[MohagniSite.host]['errors'] == 2
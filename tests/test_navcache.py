@@ -0,0 +1,97 @@
+import json
+import time
+from collections import deque
+
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from crawlkit.navcache import NavCache
+from loadtest.sites import TheStingSite
+from the_sting.spiders.thesting import ThestingSpider
+
+
+def make_spider(tmp_path, **settings):
+    crawler = get_crawler(ThestingSpider, dict({'NAV_CACHE_ENABLED': True, 'NAV_CACHE_DIR': str(tmp_path)},
+                                               **settings))
+    return ThestingSpider.from_crawler(crawler)
+
+
+def walk_nav(spider, site):
+    # Runs the home page and sub-nav requests against the synthetic site,
+    # returns the other requests
+    queue = deque(spider.start_requests())
+    requests = []
+    while queue:
+        request = queue.popleft()
+        if request.callback.__name__ not in ('parse_homepage', 'parse_sub_nav'):
+            requests.append(request)
+            continue
+        path = request.url[len('https://www.thesting.com'):]
+        status, headers, body = site.handle(path, '')
+        queue.extend(request.callback(HtmlResponse(request.url, status=status, body=body, request=request)))
+    return requests
+
+
+def test_listings_are_requested_from_the_cache(tmp_path):
+    site = TheStingSite(100, padding=0)
+    first = make_spider(tmp_path)
+    walked = walk_nav(first, site)
+    first.nav_cache.spider_closed(first, 'finished')
+    assert (tmp_path / 'thesting.json').exists()
+
+    second = make_spider(tmp_path)
+    start = list(second.start_requests())
+    cached, home = start[:-1], start[-1]
+    assert home.callback == second.parse_homepage
+    assert [(request.url, request.meta['categories']) for request in cached] == \
+        [(request.url, request.meta['categories']) for request in walked]
+    assert all(request.callback == second.parse_products and request.meta['country'] == 'nl' for request in cached)
+    stats = second.crawler.stats
+    assert stats.get_value('nav_cache/hits') == 1
+    assert stats.get_value('nav_cache/listings') == len(walked)
+
+
+def test_expired_tree_is_not_used(tmp_path):
+    site = TheStingSite(100, padding=0)
+    first = make_spider(tmp_path)
+    walk_nav(first, site)
+    first.nav_cache.spider_closed(first, 'finished')
+
+    second = make_spider(tmp_path, NAV_CACHE_TTL=0)
+    assert len(list(second.start_requests())) == 1
+    assert second.crawler.stats.get_value('nav_cache/misses') == 1
+
+
+def test_interrupted_crawl_keeps_the_saved_tree(tmp_path):
+    spider = make_spider(tmp_path)
+    walk_nav(spider, TheStingSite(100, padding=0))
+    spider.nav_cache.spider_closed(spider, 'shutdown')
+    assert not (tmp_path / 'thesting.json').exists()
+
+
+def test_revalidation_replaces_the_tree(tmp_path):
+    path = tmp_path / 'thesting.json'
+    path.write_text(json.dumps({'nl': {'saved_at': time.time(), 'listings': [
+        [['Dames', 'Jeans'], 'https://www.thesting.com/nl-nl/dames/jeans'],
+        [['Dames', 'Gone'], 'https://www.thesting.com/nl-nl/dames/gone'],
+    ]}}))
+    crawler = get_crawler(ThestingSpider)
+    cache = NavCache(crawler, str(path), ttl=3600)
+    cache.record('nl', ['Dames', 'Jeans'], 'https://www.thesting.com/nl-nl/dames/jeans')
+    cache.record('nl', ['Heren', 'Jeans'], 'https://www.thesting.com/nl-nl/heren/jeans')
+    # found again under other categories, the first ones win
+    cache.record('nl', ['Sale'], 'https://www.thesting.com/nl-nl/heren/jeans')
+    cache.spider_closed(None, 'finished')
+    assert crawler.stats.get_value('nav_cache/new_listings') == 1
+    assert crawler.stats.get_value('nav_cache/removed_listings') == 1
+    assert NavCache(crawler, str(path), ttl=3600).listings('nl') == [
+        [['Dames', 'Jeans'], 'https://www.thesting.com/nl-nl/dames/jeans'],
+        [['Heren', 'Jeans'], 'https://www.thesting.com/nl-nl/heren/jeans'],
+    ]
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / 'thesting.json'
+    path.write_text('{"nl": ')
+    cache = NavCache(get_crawler(ThestingSpider), str(path), ttl=3600)
+    assert cache.listings('nl') == []
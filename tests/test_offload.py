@@ -0,0 +1,106 @@
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.python.failure import Failure
+
+from crawlkit import offload
+from crawlkit.offload import MIN_SEGMENT_SIZE, BodySegment, chain_output
+from loadtest.sites import TheStingSite
+from the_sting.spiders.thesting import ThestingSpider
+
+META = {'country': 'nl', 'language': 'nl', 'currency': 'EUR', 'categories': ['Dames', 'Jeans']}
+
+
+def product_page(pid, site=TheStingSite(20, padding=0)):
+    url = 'https://www.thesting.com' + site.product_url(pid)
+    status, headers, body = site.handle(site.product_url(pid), '')
+    return HtmlResponse(url, body=body, request=Request(url, meta=dict(META)))
+
+
+def inline_items(response):
+    return [ItemAdapter(item).asdict() for item in ThestingSpider().extract_detail(response)]
+
+
+def wait(deferreds, timeout=60):
+    # the pool hands its results to the reactor thread with callFromThread
+    results = []
+    for d in deferreds:
+        d.addBoth(results.append)
+    deadline = time.monotonic() + timeout
+    while len(results) < len(deferreds) and time.monotonic() < deadline:
+        reactor.runUntilCurrent()
+        time.sleep(0.01)
+    assert len(results) == len(deferreds)
+    return results
+
+
+def test_body_segment_is_reused():
+    segment = BodySegment()
+    name = segment.write(b'small body')
+    assert segment.write(b'another body') == name
+    # grown to the next power of two for a larger body
+    assert segment.write(b'x' * (MIN_SEGMENT_SIZE + 1)) != name
+    assert segment.shm.size == 2 * MIN_SEGMENT_SIZE
+    segment.close()
+    assert segment.shm is None
+
+
+def test_worker_extraction(monkeypatch):
+    monkeypatch.setattr(offload, 'worker_spider', ThestingSpider())
+    response = product_page(3)
+    segment = BodySegment()
+    try:
+        results = offload.extract('extract_detail', HtmlResponse, response.url, 200, response.encoding, META,
+                                  segment.write(response.body), len(response.body))
+    finally:
+        segment.close()
+    assert results == inline_items(response)
+    assert results[0]['title'] and results[0]['size_infos']
+
+
+def test_offloaded_items_match_the_inline_ones():
+    crawler = get_crawler(ThestingSpider, {
+        'PARSE_OFFLOAD_ENABLED': True,
+        'PARSE_OFFLOAD_WORKERS': 1,
+        'PARSE_OFFLOAD_MAX_IN_FLIGHT': 1,
+    })
+    spider = ThestingSpider.from_crawler(crawler)
+    responses = [product_page(pid) for pid in range(3)]
+    try:
+        results = wait([spider.parse_detail(response) for response in responses])
+    finally:
+        spider.parse_pool.close()
+    assert [[ItemAdapter(item).asdict() for item in items] for items in results] == \
+        [inline_items(response) for response in responses]
+    # the items are the spider's item classes again
+    assert all(isinstance(items[0], spider.product_item) for items in results)
+    assert crawler.stats.get_value('parse_offload/responses') == 3
+    # one response in flight at a time
+    assert crawler.stats.get_value('parse_offload/waits') == 2
+
+
+def test_parsed_inline_after_a_pool_failure():
+    crawler = get_crawler(ThestingSpider)
+    spider = ThestingSpider.from_crawler(crawler)
+    response = product_page(5)
+    items = spider.offload_failed(Failure(BrokenProcessPool()), response, 'extract_detail')
+    assert [ItemAdapter(item).asdict() for item in items] == inline_items(response)
+    assert crawler.stats.get_value('parse_offload/inline') == 1
+    with pytest.raises(ValueError):
+        spider.offload_failed(Failure(ValueError()), response, 'extract_detail')
+
+
+def test_chain_output():
+    assert list(chain_output(iter([1, 2]), iter([3]))) == [1, 2, 3]
+    results = []
+    d = chain_output(succeed([1, 2]), iter([3]))
+    assert isinstance(d, Deferred)
+    d.addCallback(results.append)
+    assert results == [[1, 2, 3]]
@@ -0,0 +1,60 @@
+import pstats
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from crawlkit.middlewares import CallbackProfilerMiddleware
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+
+    def parse_listing(self, response):
+        for n in range(3):
+            yield {'title': 'Product %d' % n, 'tags': [str(n)] * 100}
+
+
+def profiler(tmp_path, sample_rate, trace_allocations=True):
+    crawler = get_crawler(ShopSpider, {
+        'PROFILER_ENABLED': True,
+        'PROFILER_SAMPLE_RATE': sample_rate,
+        'PROFILER_DIR': str(tmp_path),
+        'PROFILER_TRACEMALLOC': trace_allocations,
+    })
+    spider = ShopSpider.from_crawler(crawler)
+    return CallbackProfilerMiddleware.from_crawler(crawler), spider
+
+
+def run(mw, spider):
+    request = Request('https://shop.example/c/1', callback=spider.parse_listing)
+    response = Response(request.url, request=request)
+    return list(mw.process_spider_output(response, spider.parse_listing(response), spider))
+
+
+def test_disabled_by_default():
+    with pytest.raises(NotConfigured):
+        CallbackProfilerMiddleware.from_crawler(get_crawler(ShopSpider))
+
+
+def test_sampled_callbacks_are_profiled(tmp_path):
+    mw, spider = profiler(tmp_path, sample_rate=1.0)
+    assert len(run(mw, spider)) == 3
+    assert len(run(mw, spider)) == 3
+    assert not mw.active
+    mw.dump(spider)
+    assert mw.samples == {'parse_listing': 2}
+    stats = pstats.Stats(str(tmp_path / 'shop.parse_listing.prof'))
+    assert any(function == 'parse_listing' for _, _, function in stats.stats)
+    with open(tmp_path / 'shop.parse_listing.alloc.txt') as f:
+        assert f.readline().startswith('# 2 sampled invocations')
+
+
+def test_unsampled_output_is_untouched(tmp_path):
+    mw, spider = profiler(tmp_path, sample_rate=0.0)
+    result = iter([{'title': 'Product'}])
+    request = Request('https://shop.example/c/1')
+    assert mw.process_spider_output(Response(request.url, request=request), result, spider) is result
+    assert not mw.samples
@@ -0,0 +1,57 @@
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+from the_sting.refresh import ProductStore, price_value
+
+
+@pytest.mark.parametrize('text, value', [
+    ('€ 1.299,95', Decimal('1299.95')),
+    ('£89.00', Decimal('89.00')),
+    ('39.99', Decimal('39.99')),
+    ('1,299.95', Decimal('1299.95')),
+    ('12,5', Decimal('12.5')),
+    ('1 299,00 kr', Decimal('1299.00')),
+    ('€ 59,-', Decimal('59')),
+    # thousands separators only
+    ('1.299', Decimal('1299')),
+    ('Rs. 4,500', Decimal('4500')),
+    (25, Decimal('25')),
+])
+def test_price_value(text, value):
+    assert price_value(text) == value
+
+
+@pytest.mark.parametrize('text', [None, '', 'Sold out'])
+def test_price_value_none(text):
+    assert price_value(text) is None
+
+
+def test_same_price_in_another_format():
+    assert price_value('€ 1.299,95') == price_value('1299.95 EUR')
+
+
+def test_product_store(tmp_path):
+    path = str(tmp_path / 'Products.db')
+    assert ProductStore(path).get('https://x.com/p/1', 'nl') is None
+
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE Products (url TEXT, country_code TEXT, old_price_text TEXT, new_price_text TEXT)")
+    con.execute("INSERT INTO Products VALUES ('https://x.com/p/1', 'nl', '€ 59,95', '€ 39,95')")
+    con.commit()
+    con.close()
+
+    store = ProductStore(path)
+    stored = store.get('https://x.com/p/1', 'nl')
+    assert stored == ('€ 59,95', '€ 39,95')
+    assert store.get('https://x.com/p/1', 'be') is None
+    assert store.same_prices(stored, '59.95', '39.95')
+    assert not store.same_prices(stored, '59.95', '29.95')
+    store.close()
+
+
+def test_product_store_without_table(tmp_path):
+    path = tmp_path / 'Products.db'
+    sqlite3.connect(str(path)).close()
+    assert ProductStore(str(path)).get('https://x.com/p/1', 'nl') is None
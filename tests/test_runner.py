@@ -0,0 +1,103 @@
+from argparse import Namespace
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.core.downloader.handlers import DownloadHandlers
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from runner.crawl import GlobalConcurrencyDownloader, SharedItemPipelineManager, combined_report, project_settings
+
+
+class RecordingPipeline:
+    # one instance per project, the calls of all its spiders
+    def __init__(self):
+        self.calls = []
+
+    def open_spider(self, spider):
+        self.calls.append(('open', spider.name))
+
+    def process_item(self, item, spider):
+        self.calls.append(('item', spider.name))
+        return item
+
+    def close_spider(self, spider):
+        self.calls.append(('close', spider.name))
+
+
+def pipeline_settings(bot_name):
+    return Settings({'BOT_NAME': bot_name, 'ITEM_PIPELINES': {RecordingPipeline: 300}})
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch):
+    monkeypatch.setattr(SharedItemPipelineManager, 'instances', {})
+    monkeypatch.setattr(SharedItemPipelineManager, 'users', {})
+    monkeypatch.setattr(GlobalConcurrencyDownloader, 'semaphore', None)
+
+
+def test_pipelines_are_shared_by_the_spiders_of_a_project():
+    thesting = SharedItemPipelineManager.from_settings(pipeline_settings('the_sting'))
+    arket = SharedItemPipelineManager.from_settings(pipeline_settings('the_sting'))
+    mohangi = SharedItemPipelineManager.from_settings(pipeline_settings('clothing_spider'))
+    pipeline = SharedItemPipelineManager.instances[('the_sting', RecordingPipeline)]
+    other = SharedItemPipelineManager.instances[('clothing_spider', RecordingPipeline)]
+    assert other is not pipeline
+
+    thesting.open_spider(Spider('thesting'))
+    arket.open_spider(Spider('arket_spider'))
+    mohangi.open_spider(Spider('mohangi'))
+    arket.process_item({}, Spider('arket_spider'))
+    thesting.close_spider(Spider('thesting'))
+    # the pipeline is opened by the first spider and closed by the last one
+    assert pipeline.calls == [('open', 'thesting'), ('item', 'arket_spider')]
+    arket.close_spider(Spider('arket_spider'))
+    assert pipeline.calls[-1] == ('close', 'arket_spider')
+    assert other.calls == [('open', 'mohangi')]
+
+
+def test_global_download_cap(monkeypatch):
+    downloads = []
+
+    def download_request(self, request, spider):
+        downloads.append(Deferred())
+        return downloads[-1]
+
+    monkeypatch.setattr(DownloadHandlers, 'download_request', download_request)
+    settings = {'GLOBAL_CONCURRENT_REQUESTS': 2}
+    thesting = GlobalConcurrencyDownloader(get_crawler(Spider, settings))
+    mohangi = GlobalConcurrencyDownloader(get_crawler(Spider, settings))
+    for downloader in (thesting, mohangi, thesting):
+        downloader.handlers.download_request(Request('https://shop.example/'), Spider('shop'))
+    # the third download waits for a token of the cap shared by both crawlers
+    assert len(downloads) == 2
+    downloads[0].callback(None)
+    assert len(downloads) == 3
+
+
+def test_no_global_download_cap():
+    downloader = GlobalConcurrencyDownloader(get_crawler(Spider, {'GLOBAL_CONCURRENT_REQUESTS': 0}))
+    assert GlobalConcurrencyDownloader.semaphore is None
+    assert downloader.handlers.download_request.__func__ is DownloadHandlers.download_request
+
+
+def test_project_settings(tmp_path):
+    args = Namespace(db_dir=str(tmp_path), concurrency=32, set=[('LOG_LEVEL', 'INFO')])
+    settings = project_settings('clothing_spider', args)
+    assert settings['BOT_NAME'] == 'clothing_spider'
+    assert settings['PRODUCTS_DB'] == str(tmp_path / 'clothing_spider' / 'Products.db')
+    assert settings.getint('GLOBAL_CONCURRENT_REQUESTS') == 32
+    assert settings['LOG_LEVEL'] == 'INFO'
+
+
+def test_combined_report():
+    crawlers = [
+        SimpleNamespace(spidercls=SimpleNamespace(name=name), stats=SimpleNamespace(get_stats=lambda count=count: {
+            'item_scraped_count': count, 'finish_reason': 'finished'}))
+        for name, count in (('thesting', 3), ('mohangi', 5))
+    ]
+    report = combined_report(crawlers)
+    assert report['total'] == {'finish_reason': 'finished', 'item_scraped_count': 8}
+    assert report['spiders']['mohangi']['item_scraped_count'] == 5
@@ -0,0 +1,86 @@
+import gzip
+from collections import deque
+
+from scrapy.http import HtmlResponse, XmlResponse
+from scrapy.utils.test import get_crawler
+
+from crawlkit.sitemaps import iter_sitemap
+from loadtest.sites import TheStingSite
+from the_sting.spiders.thesting import ThestingSpider
+
+INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc> https://shop.example/sitemap_1.xml </loc></sitemap>
+  <sitemap><loc>https://shop.example/sitemap_2.xml.gz</loc></sitemap>
+</sitemapindex>"""
+
+URLSET = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://shop.example/p/1.html</loc><changefreq>daily</changefreq></url>
+  <url><changefreq>daily</changefreq></url>
+  <url><loc>https://shop.example/c/women</loc></url>
+</urlset>"""
+
+
+def test_iter_sitemap():
+    assert list(iter_sitemap(INDEX)) == [('sitemap', 'https://shop.example/sitemap_1.xml'),
+                                         ('sitemap', 'https://shop.example/sitemap_2.xml.gz')]
+    assert list(iter_sitemap(gzip.compress(URLSET))) == [('url', 'https://shop.example/p/1.html'),
+                                                         ('url', 'https://shop.example/c/women')]
+
+
+def make_spider(**settings):
+    crawler = get_crawler(ThestingSpider, dict({'SITEMAP_DISCOVERY': True}, **settings))
+    return ThestingSpider.from_crawler(crawler)
+
+
+def crawl(spider, site, callbacks):
+    # Runs the requests of `callbacks` breadth first against the synthetic site,
+    # returns the other requests and the items
+    queue = deque(spider.start_requests())
+    requests, items = [], []
+    while queue:
+        request = queue.popleft()
+        if request.callback.__name__ not in callbacks:
+            requests.append(request)
+            continue
+        path, _, query = request.url[len('https://www.thesting.com'):].partition('?')
+        status, headers, body = site.handle(path, query)
+        response_class = XmlResponse if path.endswith('.xml') else HtmlResponse
+        response = response_class(request.url, status=status, body=body, request=request)
+        for output in request.callback(response):
+            if isinstance(output, dict) or hasattr(output, 'fields'):
+                items.append(output)
+            else:
+                queue.append(output)
+    return requests, items
+
+
+def test_products_are_requested_from_the_sitemap():
+    site = TheStingSite(30, padding=0)
+    spider = make_spider()
+    requests, items = crawl(spider, site, ('parse_sitemap', 'parse_homepage', 'parse_sub_nav', 'parse_products'))
+    product_urls = ['https://www.thesting.com' + site.product_url(pid) for pid in range(30)]
+    assert [request.url for request in requests] == product_urls
+    assert all(request.callback.__name__ == 'parse_color' for request in requests)
+    assert all(request.meta['country'] == 'nl' for request in requests)
+    # the listings only add the categories of every product
+    assert sorted(item['url'] for item in items) == sorted(product_urls)
+    assert all(item['category_names'] and item['country_code'] == 'nl' for item in items)
+    stats = spider.crawler.stats
+    assert stats.get_value('sitemap/product_urls') == 30
+    assert stats.get_value('sitemap/category_items') == 30
+
+
+def test_sitemap_only():
+    site = TheStingSite(30, padding=0)
+    spider = make_spider(SITEMAP_CATEGORIES=False)
+    requests, items = crawl(spider, site, ('parse_sitemap',))
+    assert len(requests) == 30 and not items
+    assert spider.crawler.stats.get_value('sitemap/files') == 3
+
+
+def test_products_of_other_countries_are_skipped():
+    spider = make_spider()
+    assert spider.sitemap_product_meta('https://www.thesting.com/be-nl/p/shirt-1.html') is None
+    assert spider.sitemap_product_meta('https://www.thesting.com/nl-nl/p/shirt-1.html')['country'] == 'nl'
@@ -0,0 +1,79 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from loadtest import scrapy_hooks
+from loadtest.scrapy_hooks import SoakMonitor, growing
+from loadtest.soak import build_parser, soak_command
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+
+
+def test_growing():
+    assert growing([10, 50, 120, 200, 300, 400], min_growth=100)
+    # back down in the second half, a queue that fills and drains
+    assert not growing([10, 50, 300, 20, 400, 500], min_growth=100)
+    assert not growing([10, 11, 12, 13, 14, 15], min_growth=100)
+    assert not growing([10, 500, 1000], min_growth=100)
+
+
+def test_disabled_without_a_report():
+    with pytest.raises(NotConfigured):
+        SoakMonitor.from_crawler(get_crawler(ShopSpider))
+
+
+def soak(tmp_path, monkeypatch, leak, budget):
+    rss = iter(range(100 * 2 ** 20, 200 * 2 ** 20, 2 ** 20))
+    monkeypatch.setattr(scrapy_hooks, 'get_rss', lambda: next(rss))
+    crawler = get_crawler(ShopSpider, {
+        'LOADTEST_SOAK_REPORT': str(tmp_path / 'soak.json'),
+        'LOADTEST_SOAK_WARMUP': 0,
+        'LOADTEST_SOAK_BYTES_PER_ITEM': budget,
+        'LOADTEST_SOAK_MIN_GROWTH': 100,
+    })
+    spider = ShopSpider.from_crawler(crawler)
+    queue = [Request('https://shop.example/q/%d' % n) for n in range(5)]
+    crawler.engine = SimpleNamespace(slot=SimpleNamespace(scheduler=queue))
+    monitor = SoakMonitor.from_crawler(crawler)
+    monitor.spider_opened(spider)
+    # requests kept alive by nothing but this list, like a leak
+    leaked = []
+    for n in range(8):
+        crawler.stats.inc_value('item_scraped_count', 1000)
+        if leak:
+            leaked += [Request('https://shop.example/p/%d/%d' % (n, i)) for i in range(50)]
+        monitor.sample()
+    monitor.spider_closed(spider, 'closespider_timeout')
+    with open(tmp_path / 'soak.json') as f:
+        return json.load(f)
+
+
+def test_leaked_requests_are_reported(tmp_path, monkeypatch):
+    report = soak(tmp_path, monkeypatch, leak=True, budget=1024)
+    # the baseline is the first sample, after its 1000 items
+    assert report['soaked_items'] == 7000
+    assert 'Request (not queued)' in report['growing_types']
+    assert report['samples'][0]['queued'] == 5
+    # 8 MiB of RSS growth over 7000 items
+    assert report['rss_bytes_per_item'] == round(8 * 2 ** 20 / 7000, 1)
+    assert not report['passed']
+
+
+def test_flat_memory_passes(tmp_path, monkeypatch):
+    report = soak(tmp_path, monkeypatch, leak=False, budget=2048)
+    assert report['growing_types'] == {}
+    assert report['passed']
+
+
+def test_soak_command(tmp_path):
+    args = build_parser().parse_args(['--duration', '600', '--warmup', '60', '--budget', '2048'])
+    command = soak_command('mohangi', args, str(tmp_path / 'soak.json'))
+    assert 'CLOSESPIDER_TIMEOUT=600' in command
+    assert 'LOADTEST_SOAK_BYTES_PER_ITEM=2048' in command
+    assert 'LOADTEST_SOAK_REPORT=%s' % (tmp_path / 'soak.json') in command
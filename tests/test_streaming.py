@@ -0,0 +1,104 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured, StopDownload
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from crawlkit.streaming import EarlyAbortMiddleware, ParseTimeMiddleware
+
+
+class ShopSpider(Spider):
+    name = 'shop'
+    early_abort_limits = {
+        'parse_detail': {'until': b'<footer', 'max_bytes': 1000},
+        'parse_reviews': {'max_bytes': 100},
+    }
+
+    def parse_detail(self, response):
+        yield {'title': response.css('h1::text').get(), 'footer': response.css('footer').get()}
+
+    def parse_reviews(self, response):
+        pass
+
+
+@pytest.fixture
+def early_abort():
+    crawler = get_crawler(ShopSpider, {'EARLY_ABORT_ENABLED': True})
+    spider = ShopSpider.from_crawler(crawler)
+    return EarlyAbortMiddleware.from_crawler(crawler), spider
+
+
+def receive(mw, request, spider, *chunks):
+    mw.process_request(request, spider)
+    for n, chunk in enumerate(chunks):
+        try:
+            mw.bytes_received(chunk, request, spider)
+        except StopDownload as stop:
+            assert not stop.fail
+            return n + 1
+    return None
+
+
+def test_disabled_by_default():
+    with pytest.raises(NotConfigured):
+        EarlyAbortMiddleware.from_crawler(get_crawler(ShopSpider))
+
+
+def test_only_limited_callbacks_are_streamed(early_abort):
+    mw, spider = early_abort
+    request = Request('https://shop.example/p/1', callback=spider.parse_detail)
+    mw.process_request(request, spider)
+    assert request.headers['Accept-Encoding'] == b'identity'
+    other = Request('https://shop.example/c/1')
+    mw.process_request(other, spider)
+    assert b'Accept-Encoding' not in other.headers
+    assert receive(mw, other, spider, b'x' * 10000) is None
+
+
+def test_stops_after_the_marker(early_abort):
+    mw, spider = early_abort
+    request = Request('https://shop.example/p/1', callback=spider.parse_detail)
+    # the marker straddles the second and third chunks
+    assert receive(mw, request, spider, b'<h1>Shirt</h1>', b'<div></div><foo', b'ter>', b'</html>') == 3
+
+
+def test_stops_after_the_byte_budget(early_abort):
+    mw, spider = early_abort
+    request = Request('https://shop.example/p/1/reviews', callback=spider.parse_reviews)
+    assert receive(mw, request, spider, b'x' * 60, b'x' * 60, b'x' * 60) == 2
+
+
+def test_stopped_download_stats(early_abort):
+    mw, spider = early_abort
+    request = Request('https://shop.example/p/1', callback=spider.parse_detail)
+    receive(mw, request, spider, b'<h1>Shirt</h1><footer>')
+    response = HtmlResponse(request.url, body=b'<h1>Shirt</h1><footer>', headers={'Content-Length': '5000'},
+                            flags=['download_stopped'], request=request)
+    assert mw.process_response(request, response, spider) is response
+    stats = spider.crawler.stats
+    assert stats.get_value('early_abort/parse_detail/stopped') == 1
+    assert stats.get_value('early_abort/parse_detail/bytes') == 22
+    assert stats.get_value('early_abort/parse_detail/bytes_saved') == 4978
+    assert not mw.active
+
+
+def test_truncated_page_is_parsed():
+    spider = ShopSpider()
+    request = Request('https://shop.example/p/1', callback=spider.parse_detail)
+    response = HtmlResponse(request.url, body=b'<html><body><div><h1>Shirt</h1><p>Linen', request=request)
+    assert list(spider.parse_detail(response)) == [{'title': 'Shirt', 'footer': None}]
+
+
+def test_parse_time_of_limited_callbacks():
+    crawler = get_crawler(ShopSpider)
+    spider = ShopSpider.from_crawler(crawler)
+    mw = ParseTimeMiddleware.from_crawler(crawler)
+    request = Request('https://shop.example/p/1', callback=spider.parse_detail)
+    response = HtmlResponse(request.url, body=b'<h1>Shirt</h1>', request=request)
+    assert len(list(mw.process_spider_output(response, spider.parse_detail(response), spider))) == 1
+    assert crawler.stats.get_value('early_abort/parse_detail/responses') == 1
+    assert crawler.stats.get_value('early_abort/parse_detail/parse_seconds') > 0
+    # other callbacks are not timed
+    request = Request('https://shop.example/c/1')
+    result = iter([])
+    assert mw.process_spider_output(HtmlResponse(request.url, body=b'', request=request), result, spider) is result
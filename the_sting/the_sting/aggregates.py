@@ -0,0 +1,10 @@
+# Aggregate tables of the project's Products.db, see crawlkit/aggregates.py:
+#
+#     python -m the_sting.aggregates Products.db --check
+
+from crawlkit.aggregates import main
+
+from .pipelines import SqlitePipeline
+
+if __name__ == '__main__':
+    main(SqlitePipeline.product_measures)
@@ -0,0 +1,47 @@
+"""
+Country fan-out shared by the spiders that declare a `countries_info` list.
+
+Every configured country is crawled in the same run. Requests of a country carry the
+`download_slot` meta key "<host>/<country>", so each country has its own download slot and
+concurrency budget (CONCURRENT_REQUESTS_PER_DOMAIN, or a DOWNLOAD_SLOTS entry for that key)
+and a slow market does not hold back the others.
+
+Run a subset with `scrapy crawl <spider> -a countries=nl,be`.
+
+"""
+
+from urllib.parse import urljoin, urlparse
+
+
+class CountriesMixin:
+    # ('country', 'currency', 'language', 'home_url') tuples
+    countries_info = []
+
+    # comma separated country codes given with -a countries=..., all when unset
+    countries = None
+
+    def selected_countries(self):
+        if not self.countries:
+            return list(self.countries_info)
+        selected = [code.strip() for code in self.countries.split(',')]
+        return [info for info in self.countries_info if info[0] in selected]
+
+    def country_meta(self, country_info):
+        country, currency, language, home_url = country_info
+        return {
+            'country': country,
+            'currency': currency,
+            'language': language,
+            'download_slot': '%s/%s' % (urlparse(home_url).netloc, country),
+        }
+
+    def home_url(self, country):
+        for info in self.countries_info:
+            if info[0] == country:
+                return info[3]
+        raise KeyError(country)
+
+    def locale_url(self, response, path):
+        # URL of `path` inside the locale of the country being crawled, e.g.
+        # ('kr', 'pda/changeItemInfo.html') -> https://www.arket.com/ko-kr/pda/changeItemInfo.html
+        return urljoin(self.home_url(response.meta['country']), path)
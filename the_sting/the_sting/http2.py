@@ -0,0 +1,164 @@
+# HTTP/2 downloads for chosen domains (HTTP2_ENABLED).
+#
+# The product detail endpoints of Arket (pda/changeItemInfo.html) and Marc
+# Jacobs (the variation JSON) are thousands of small requests to one host. Over
+# HTTP/1.1 each in-flight request needs its own connection and waits behind
+# the response before it on that connection. HTTP/2 multiplexes them as
+# streams over a few connections.
+#
+# DomainsDownloadHandler replaces the https handler. Requests to the domains of
+# the spider's `http2_domains` (and HTTP2_DOMAINS) go through scrapy's HTTP/2
+# client, everything else through the default HTTP/1.1 handler:
+#
+#   HTTP2_MAX_CONNECTIONS_PER_HOST  connections opened per host, a new one only
+#                                   when the others have no free stream
+#   HTTP2_MAX_CONCURRENT_STREAMS    streams per connection, also capped by the
+#                                   server's SETTINGS_MAX_CONCURRENT_STREAMS
+#
+# The downloader slots still limit the requests in flight, raise
+# CONCURRENT_REQUESTS_PER_DOMAIN to make use of the streams. HTTP/2 needs the
+# `h2` package (pip install h2) and TLS with ALPN; without it, or through a
+# proxy, requests keep using HTTP/1.1. Stats: http2/requests,
+# http2/connections.
+#
+#   python -m benchmarks.http2_downloads --requests 2000
+
+import logging
+from collections import deque
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.defer import Deferred
+
+try:
+    from scrapy.core.downloader.handlers.http2 import H2DownloadHandler
+    from scrapy.core.http2.agent import H2ConnectionPool
+    from scrapy.core.http2.protocol import H2ClientFactory, H2ClientProtocol
+except ImportError:
+    H2DownloadHandler = None
+
+logger = logging.getLogger(__name__)
+
+
+if H2DownloadHandler is not None:
+
+    class CappedH2ClientProtocol(H2ClientProtocol):
+        # streams opened at once on the connection, 0 for the server's limit
+        max_streams = 0
+
+        @property
+        def allowed_max_concurrent_streams(self):
+            allowed = super().allowed_max_concurrent_streams
+            return min(allowed, self.max_streams) if self.max_streams else allowed
+
+        @property
+        def load(self):
+            return self.metadata['active_streams'] + len(self._pending_request_stream_pool)
+
+    class CappedH2ClientFactory(H2ClientFactory):
+
+        def buildProtocol(self, addr):
+            protocol = CappedH2ClientProtocol(self.uri, self.settings, self.conn_lost_deferred)
+            protocol.max_streams = self.settings.getint('HTTP2_MAX_CONCURRENT_STREAMS')
+            return protocol
+
+    class HostConnectionPool(H2ConnectionPool):
+        # Up to HTTP2_MAX_CONNECTIONS_PER_HOST connections per host, each
+        # stored under the host key with its index appended
+
+        def __init__(self, reactor, settings, stats=None):
+            super().__init__(reactor, settings)
+            self.max_connections = max(1, settings.getint('HTTP2_MAX_CONNECTIONS_PER_HOST', 1))
+            self.stats = stats
+
+        def get_connection(self, key, uri, endpoint):
+            keys = [key + (n,) for n in range(self.max_connections)]
+            opened = [k for k in keys if k in self._connections]
+            free = [k for k in opened
+                    if self._connections[k].load < self._connections[k].allowed_max_concurrent_streams]
+            connecting = [k for k in keys if k in self._pending_requests]
+            unused = [k for k in keys if k not in self._connections and k not in self._pending_requests]
+            if free:
+                # the least busy connection with a free stream
+                key = min(free, key=lambda k: self._connections[k].load)
+            elif connecting:
+                # wait for a connection being made rather than opening another one
+                key = connecting[0]
+            elif unused:
+                key = unused[0]
+            else:
+                # every connection is full, queue on the least busy one
+                key = min(opened, key=lambda k: self._connections[k].load)
+            return super().get_connection(key, uri, endpoint)
+
+        def _new_connection(self, key, uri, endpoint):
+            # H2ConnectionPool._new_connection with the capped protocol
+            if self.stats is not None:
+                self.stats.inc_value('http2/connections')
+            self._pending_requests[key] = deque()
+
+            conn_lost_deferred = Deferred()
+            conn_lost_deferred.addCallback(self._remove_connection, key)
+
+            factory = CappedH2ClientFactory(uri, self.settings, conn_lost_deferred)
+            conn_d = endpoint.connect(factory)
+            conn_d.addCallback(self.put_connection, key)
+            conn_d.addErrback(self._connect_failed, key)
+
+            d = Deferred()
+            self._pending_requests[key].append(d)
+            return d
+
+        def _connect_failed(self, failure, key):
+            # fail the requests waiting for the connection, the next ones try again
+            pending_requests = self._pending_requests.pop(key, None)
+            while pending_requests:
+                pending_requests.popleft().errback(failure)
+
+    class CappedH2DownloadHandler(H2DownloadHandler):
+
+        def __init__(self, settings, crawler=None):
+            super().__init__(settings, crawler)
+            from twisted.internet import reactor
+
+            self._pool = HostConnectionPool(reactor, settings, crawler.stats if crawler else None)
+
+
+class DomainsDownloadHandler:
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        self.crawler = crawler
+        self.http11 = HTTP11DownloadHandler(settings, crawler)
+        self.http2 = None
+        self.domains = settings.getlist('HTTP2_DOMAINS')
+        if not settings.getbool('HTTP2_ENABLED'):
+            return
+        if H2DownloadHandler is None:
+            logger.warning("HTTP2_ENABLED is set but the h2 package is not installed, using HTTP/1.1")
+            return
+        self.http2 = CappedH2DownloadHandler(settings, crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def use_http2(self, request, spider):
+        if self.http2 is None or request.meta.get('proxy'):
+            return False
+        parts = urlparse_cached(request)
+        host = (parts.hostname or '').lower()
+        domains = self.domains + list(getattr(spider, 'http2_domains', []))
+        return parts.scheme == 'https' and any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+    def download_request(self, request, spider):
+        if self.use_http2(request, spider):
+            if self.crawler is not None:
+                self.crawler.stats.inc_value('http2/requests', spider=spider)
+            return self.http2.download_request(request, spider)
+        return self.http11.download_request(request, spider)
+
+    def close(self):
+        if self.http2 is not None:
+            self.http2.close()
+        return self.http11.close()
@@ -1,73 +1,69 @@
-import json
-import sqlite3
-import scrapy
+from crawlkit import codec, pipelines
 
-class SqlitePipeline:
-    def __init__(self):
-        # Create/Connect to database
-        self.con = sqlite3.connect('Products.db')
-        # Create cursor, used to execute commands
-        self.cur = self.con.cursor()
-        # Create Products table if it doesn't exist
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS Products (
-                url TEXT,
-                country_code TEXT,
-                language_code TEXT,
-                currency TEXT,  
-                title TEXT,
-                brand TEXT,
-                category_names TEXT,
-                description_text TEXT,
-                color_name TEXT,  
-                image_urls TEXT,
-                old_price_text TEXT,
-                new_price_text TEXT,
-                use_size_level_prices BOOL,
-                size_infos TEXT
-            )
-        """)
+from .refresh import price_value
 
-    def process_item(self, item, spider):
-        self.cur.execute("SELECT * FROM Products WHERE url = ?", (item['url'],))
-        result = self.cur.fetchone()
-        if result:
-            spider.logger.warning("Item already in database: %s" % item['url'])
-        else:
-            # Serialize size_infos
-            serialized_types = []
-            if 'size_infos' in item:
-                for size in item["size_infos"]:
-                    serialized_type = {
-                        "size_name": size.get("size_name", ""),
-                        "stock": size.get("stock", "")
-                    }
-                    serialized_types.append(serialized_type)
 
-            # Define insert statement
-            self.cur.execute("""
-                INSERT INTO Products (url, country_code, language_code, currency, title, brand, category_names,
-                                      description_text, color_name, image_urls, old_price_text, new_price_text, 
-                                      use_size_level_prices, size_infos) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                item["url"],
-                item.get('country_code', ""),
-                item.get('language_code', ""),
-                item.get('currency', ""),
-                item.get("title", ""),
-                item.get("brand", ""),
-                json.dumps(item.get("category_names", "")),
-                item.get("description_text", ""),
-                item.get("color_name", ""),
-                json.dumps(item.get("image_urls", "")),
-                item.get("old_price_text", ""),
-                item.get("new_price_text", ""),
-                item.get('use_size_level_prices', False),
-                json.dumps(serialized_types)
-            ))
+class SqlitePipeline(pipelines.SqlitePipeline):
+    # Products table of PRODUCTS_DB, see crawlkit.pipelines.SqlitePipeline
+    schema = """
+        CREATE TABLE IF NOT EXISTS Products (
+            url TEXT,
+            country_code TEXT,
+            language_code TEXT,
+            currency TEXT,  
+            title TEXT,
+            brand TEXT,
+            category_names TEXT,
+            description_text TEXT,
+            color_name TEXT,  
+            image_urls TEXT,
+            old_price_text TEXT,
+            new_price_text TEXT,
+            use_size_level_prices BOOL,
+            size_infos TEXT
+        )
+    """
+    # a product is stored once per country
+    key_columns = ('url', 'country_code')
 
-            # Execute insert of data into database
-            self.con.commit()
-        return item
+    @staticmethod
+    def product_measures(row):
+        # what a Products row adds to the aggregates (see crawlkit/aggregates.py)
+        categories = codec.loads(row['category_names']) if row['category_names'] else None
+        category = ' > '.join(categories) if isinstance(categories, list) else categories or ''
+        groups = [('brand', row['brand'] or ''), ('category', category), ('country', row['country_code'] or '')]
+        old_price, new_price = price_value(row['old_price_text']), price_value(row['new_price_text'])
+        price = new_price if new_price is not None else old_price
+        discounted = new_price is not None and old_price is not None and new_price < old_price
+        sizes = codec.loads(row['size_infos']) if row['size_infos'] else []
+        in_stock = any(size.get('stock') for size in sizes)
+        return (row['currency'] or '', groups, None if price is None else int(price * 100), int(discounted),
+                int(in_stock))
+
+    def row_values(self, item):
+        # column -> value of `item`, with the defaults of a new row
+        # Serialize size_infos
+        serialized_types = []
+        if 'size_infos' in item:
+            for size in item["size_infos"]:
+                serialized_type = {
+                    "size_name": size.get("size_name", ""),
+                    "stock": size.get("stock", "")
+                }
+                serialized_types.append(serialized_type)
+        return {
+            'url': item["url"],
+            'country_code': item.get('country_code', ""),
+            'language_code': item.get('language_code', ""),
+            'currency': item.get('currency', ""),
+            'title': item.get("title", ""),
+            'brand': item.get("brand", ""),
+            'category_names': codec.dumps(item.get("category_names", "")),
+            'description_text': item.get("description_text", ""),
+            'color_name': item.get("color_name", ""),
+            'image_urls': codec.dumps(item.get("image_urls", "")),
+            'old_price_text': item.get("old_price_text", ""),
+            'new_price_text': item.get("new_price_text", ""),
+            'use_size_level_prices': item.get('use_size_level_prices', False),
+            'size_infos': codec.dumps(serialized_types),
+        }
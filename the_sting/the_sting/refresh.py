@@ -0,0 +1,77 @@
+# Listing-only refresh of prices.
+#
+# With LISTING_REFRESH, spiders compare the price shown on each listing tile
+# with the row SqlitePipeline stored for the product (PRODUCTS_DB). When they
+# agree the spider yields a partial item from the tile (url, country, prices,
+# categories) that the pipeline merges into the row, and the product page is
+# not fetched. New products and products whose tile price changed are crawled
+# in full. A refresh then costs about one request per listing page instead of
+# one per product.
+#
+# Only prices are compared: the listing tiles carry no stock, so a product
+# whose sizes sell out or come back at an unchanged price keeps the stored
+# size_infos. Stock needs a full crawl (without LISTING_REFRESH) from time to
+# time.
+#
+# Stats: refresh/listing_items, refresh/new_products, refresh/changed_products.
+#
+#   scrapy crawl thesting -s LISTING_REFRESH=1 -s ITEM_PIPELINES='{"the_sting.pipelines.SqlitePipeline": 300}'
+
+import os
+import re
+import sqlite3
+from decimal import Decimal, InvalidOperation
+
+NUMBER_PATTERN = re.compile(r'\d[\d.,\s]*')
+
+
+def price_value(text):
+    """Returns the amount in a price text ("€ 1.299,95", "£89.00", "39.99") as a Decimal, or None."""
+    if text is None:
+        return None
+    match = NUMBER_PATTERN.search(str(text))
+    if match is None:
+        return None
+    number = re.sub(r'\s', '', match.group()).rstrip('.,')
+    # the last separator followed by 1 or 2 digits is the decimal one
+    head, sep, tail = max(number.rpartition(','), number.rpartition('.'), key=lambda parts: len(parts[0]))
+    if sep and 0 < len(tail) <= 2:
+        number = re.sub(r'[.,]', '', head) + '.' + tail
+    else:
+        number = re.sub(r'[.,]', '', number)
+    try:
+        return Decimal(number)
+    except InvalidOperation:
+        return None
+
+
+class ProductStore:
+    # Read-only view of the Products table written by SqlitePipeline
+
+    def __init__(self, path):
+        self.con = None
+        if os.path.exists(path):
+            self.con = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('PRODUCTS_DB', 'Products.db'))
+
+    def get(self, url, country_code):
+        """Returns the stored (old_price_text, new_price_text) of a product, None if it is not stored."""
+        if self.con is None:
+            return None
+        try:
+            return self.con.execute("SELECT old_price_text, new_price_text FROM Products WHERE url = ? AND country_code = ?",
+                                    (url, country_code)).fetchone()
+        except sqlite3.OperationalError:
+            # no Products table yet
+            return None
+
+    def same_prices(self, stored, old_price_text, new_price_text):
+        return (price_value(stored[0]) == price_value(old_price_text)
+                and price_value(stored[1]) == price_value(new_price_text))
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
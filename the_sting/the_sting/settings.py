@@ -44,28 +44,113 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "the_sting.middlewares.TheStingSpiderMiddleware": 543,
-#}
+# The profiler has to stay closest to the spider (after DepthMiddleware, 900),
+# the pipeline timer of the metrics closest to the engine
+SPIDER_MIDDLEWARES = {
+    "crawlkit.middlewares.PipelineTimerMiddleware": 0,
+    # only with the frontier scheduler of the launcher
+    "crawlkit.frontier.FrontierLeaseMiddleware": 1,
+    "crawlkit.canonical.CanonicalUrlMiddleware": 920,
+    "crawlkit.streaming.ParseTimeMiddleware": 940,
+    "crawlkit.middlewares.CallbackProfilerMiddleware": 950,
+}
+
+# Rewrite request and image URLs with the spider's canonicalization rules
+# before they are fingerprinted (see crawlkit/canonical.py)
+CANONICAL_URLS_ENABLED = True
+# also count the requests canonicalization turned into duplicates
+# (canonical/requests_avoided), fingerprinting every request twice
+#CANONICAL_URLS_DEBUG = False
+
+# Sampling profiler for spider callbacks, see crawlkit.middlewares.CallbackProfilerMiddleware
+PROFILER_ENABLED = False
+PROFILER_SAMPLE_RATE = 0.01
+PROFILER_DIR = "profiles"
+PROFILER_DUMP_INTERVAL = 60.0
+PROFILER_TRACEMALLOC = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "the_sting.middlewares.TheStingDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "crawlkit.middlewares.InstrumentationMiddleware": 543,
+    # between RetryMiddleware (550) and HttpCompressionMiddleware (590): it
+    # asks for an uncompressed body before HttpCompressionMiddleware sets its
+    # Accept-Encoding, and it sees every download attempt, retried ones included
+    "crawlkit.streaming.EarlyAbortMiddleware": 555,
+    "crawlkit.breaker.CircuitBreakerMiddleware": 560,
+}
+
+# Stop downloading the responses of the callbacks listed in the spider's
+# early_abort_limits once their byte budget or end marker is reached
+# (see crawlkit/streaming.py)
+EARLY_ABORT_ENABLED = False
+
+# Download handler sending the requests to the spider's http2_domains (and
+# HTTP2_DOMAINS) over HTTP/2 when HTTP2_ENABLED is set, everything else over
+# HTTP/1.1 (see http2.py, needs the h2 package)
+DOWNLOAD_HANDLERS = {
+    "https": "the_sting.http2.DomainsDownloadHandler",
+}
+HTTP2_ENABLED = False
+HTTP2_DOMAINS = []
+HTTP2_MAX_CONNECTIONS_PER_HOST = 1
+HTTP2_MAX_CONCURRENT_STREAMS = 100
+
+# Stop sending requests to a route (host and path pattern of the spider's
+# circuit_breaker_routes) while most of its downloads fail, probing it again
+# after a cool-down; 'defer' keeps its requests for when it recovers, 'fail'
+# drops them (see crawlkit/breaker.py)
+CIRCUIT_BREAKER_ENABLED = False
+CIRCUIT_BREAKER_MODE = "defer"
+CIRCUIT_BREAKER_WINDOW = 50
+CIRCUIT_BREAKER_MIN_REQUESTS = 20
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+CIRCUIT_BREAKER_COOLDOWN = 60.0
+CIRCUIT_BREAKER_MAX_PROBES = 5
+#CIRCUIT_BREAKER_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408, 429]
+
+# Requests slower than this (seconds) are logged by the instrumentation middleware
+INSTRUMENTATION_SLOW_REQUEST_THRESHOLD = 5.0
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "crawlkit.extensions.PrometheusMetrics": 500,
+}
+
+# With METRICS_ENABLED, live metrics in Prometheus text format on
+# http://METRICS_HOST:METRICS_PORT/metrics (first free port of the range),
+# refreshed every METRICS_INTERVAL seconds. Off by default, so a crawl only
+# binds a port when asked to
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = [9410, 9450]
+METRICS_INTERVAL = 5.0
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+   "crawlkit.pipelines.ContentImagesPipeline": 200,
    # "the_sting.pipelines.SqlitePipeline": 300,
 }
 
+# SqlitePipeline commits every PRODUCTS_DB_BATCH_SIZE items and keeps the
+# aggregate tables of the dashboards (products and prices per brand, category
+# and country) up to date in the same transaction (see crawlkit/aggregates.py)
+#PRODUCTS_DB = "Products.db"
+#PRODUCTS_DB_BATCH_SIZE = 100
+PRODUCTS_AGGREGATES = True
+
+# Download image_urls with ContentImagesPipeline (stays disabled while
+# IMAGES_STORE is unset), one file per distinct image content
+#IMAGES_STORE = "images"
+#IMAGES_CONCURRENT_REQUESTS_PER_HOST = 4
+#IMAGES_DOWNLOAD_DELAY = 0
+# thumbnails need Pillow, they are made in a pool of IMAGES_THUMBS_WORKERS processes
+#IMAGES_THUMBS = {"small": [100, 100]}
+#IMAGES_THUMBS_WORKERS = 2
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -87,6 +172,96 @@ ITEM_PIPELINES = {
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Build items as slotted attrs objects (items.CompactProductItem/CompactSizeItem)
+# instead of dict-backed scrapy.Items, to keep queued items small
+COMPACT_ITEMS = False
+
+# Listing-only refresh: products whose listing tile shows the price stored in
+# PRODUCTS_DB are updated from the tile, only new products and changed prices
+# are crawled in full (see refresh.py, needs SqlitePipeline). Tiles have no
+# stock, so stock changes at an unchanged price wait for the next full crawl.
+LISTING_REFRESH = False
+
+# Sitemap discovery: product pages are requested from the site's sitemap, so
+# the first items come after a few requests; with SITEMAP_CATEGORIES the nav
+# tree is still walked to fill in the categories of those products (see
+# crawlkit/sitemaps.py, SqlitePipeline merges the category items into the rows)
+SITEMAP_DISCOVERY = False
+SITEMAP_CATEGORIES = True
+
+# Parse offload: product pages are parsed in PARSE_OFFLOAD_WORKERS processes
+# (0 for one per core) instead of on the reactor thread, with at most
+# PARSE_OFFLOAD_MAX_IN_FLIGHT responses (0 for twice the workers) in the pool
+# (see crawlkit/offload.py)
+PARSE_OFFLOAD_ENABLED = False
+#PARSE_OFFLOAD_WORKERS = 0
+#PARSE_OFFLOAD_MAX_IN_FLIGHT = 0
+
+# Extraction cache: the items of the product pages are stored in
+# EXTRACTION_CACHE_DIR/<spider>.db by hash of the page and reused for the same
+# page, up to EXTRACTION_CACHE_SIZE bytes; a change to the project's code drops
+# the stored items (see crawlkit/extractcache.py)
+EXTRACTION_CACHE_ENABLED = False
+#EXTRACTION_CACHE_DIR = "extractcache"
+#EXTRACTION_CACHE_SIZE = 268435456
+
+# Navigation tree cache: the listings found through the nav are saved to
+# NAV_CACHE_DIR/<spider>.json, and the next crawls request them right away
+# while the nav is walked again to revalidate the tree, as long as it is
+# younger than NAV_CACHE_TTL seconds (see crawlkit/navcache.py)
+NAV_CACHE_ENABLED = False
+#NAV_CACHE_DIR = "navcache"
+#NAV_CACHE_TTL = 86400
+
+# Catalog size estimation: only the nav and listing pages are crawled and the
+# size of every category is estimated from the counts and paging the listings
+# show, sampling CATALOG_ESTIMATE_SAMPLE of the last pages and probing at most
+# CATALOG_ESTIMATE_MAX_PROBES pages per category where no count is shown; the
+# report goes to CATALOG_ESTIMATE_FILE (see crawlkit/estimate.py)
+CATALOG_ESTIMATE = False
+#CATALOG_ESTIMATE_FILE = "%(spider)s.estimate.json"
+#CATALOG_ESTIMATE_SAMPLE = 0.2
+#CATALOG_ESTIMATE_MAX_PROBES = 16
+
+# Shared crawl frontier used by the workers of `python -m the_sting.launcher`
+# (see crawlkit/frontier.py). The launcher sets SCHEDULER, DUPEFILTER_CLASS and
+# FRONTIER_WORKER for each worker process.
+#FRONTIER_PATH = "%(spider)s.frontier.sqlite"
+#FRONTIER_BATCH_SIZE = 16
+#FRONTIER_HEARTBEAT = 0.5
+# requests of a worker that stopped renewing its leases for this many seconds
+# are crawled by the other workers
+#FRONTIER_LEASE_TIMEOUT = 60
+
+# Resumable crawls: with SCHEDULER = "crawlkit.checkpoint.CheckpointScheduler"
+# the pending requests, seen fingerprints and item counts are saved to
+# CHECKPOINT_DIR (checkpoints/<spider> by default) every CHECKPOINT_INTERVAL
+# seconds, and a stopped crawl continues from there when started again.
+# SqlitePipeline commits its batch with every checkpoint.
+#CHECKPOINT_DIR = "checkpoints/thesting"
+#CHECKPOINT_INTERVAL = 60.0
+
+# Detail-first scheduling: with SCHEDULER = "crawlkit.backpressure.BackpressureScheduler"
+# the requests of the spider's detail_callbacks are served first and discovery
+# requests wait while SCHEDULER_DETAIL_THRESHOLD detail requests are pending;
+# beyond SCHEDULER_MEMORY_CAP requests per class the queue spills to disk
+# (see crawlkit/backpressure.py)
+#SCHEDULER_DETAIL_THRESHOLD = 32
+#SCHEDULER_DISCOVERY_IN_FLIGHT = 2
+#SCHEDULER_MEMORY_CAP = 10000
+#SCHEDULER_SPILL_DIR = "/var/tmp"
+
+# Memory-bounded duplicate filters for very large crawls (see crawlkit/dupefilters.py):
+# CompactDupeFilter keeps truncated binary fingerprints in a flat hash table
+# (11-23 bytes per request instead of ~120), BloomDupeFilter a scalable Bloom
+# filter (~6 bytes per request at 1e-6, may drop DUPEFILTER_ERROR_RATE of the
+# new requests). DUPEFILTER_SPILL_DIR keeps their buffers in mmap'd files.
+#DUPEFILTER_CLASS = "crawlkit.dupefilters.CompactDupeFilter"
+#DUPEFILTER_FINGERPRINT_BYTES = 8
+#DUPEFILTER_ERROR_RATE = 1e-6
+#DUPEFILTER_CAPACITY = 65536
+#DUPEFILTER_SPILL_DIR = "/var/tmp"
+
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
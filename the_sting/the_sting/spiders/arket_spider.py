@@ -4,8 +4,13 @@ Scrapy spider for scraping product information from the Arket website (https://w
 This spider crawls through the website to extract information about various products, including their titles,
 descriptions, prices, images, sizes, and colors.
 
+Every country of `countries_info` is crawled in the same run, each in its own download slot
+(see `CountriesMixin`). With NAV_CACHE_ENABLED the listings of the last crawl's nav tree are
+requested right away (see `NavCacheMixin`). With CATALOG_ESTIMATE only the first listing pages are
+crawled, their totalCnt gives the size of every category (see `CatalogEstimateMixin`).
+
 Methods:
-    start_requests: Method to generate initial requests to the home page of the website.
+    start_requests: Method to generate initial requests to the home page of every configured country, and to its cached listings.
     parse_homepage: Callback method to parse the home page and extract navigation links to different categories.
     make_nav_request: Helper method to create requests for navigating to category pages.
     parse_products: Callback method to parse product listing pages and extract product URLs.
@@ -22,10 +27,15 @@ from urllib.parse import urljoin
 import scrapy
 from scrapy import Request
 
-from ..items import ProductItem, SizeItem
+from crawlkit import codec
+from crawlkit.estimate import CatalogEstimateMixin
+from crawlkit.items import ProductItem, SizeItem, item_classes
+from crawlkit.navcache import NavCacheMixin
+
+from ..countries import CountriesMixin
 
 
-class ArketSpiderSpider(scrapy.Spider):
+class ArketSpiderSpider(CountriesMixin, NavCacheMixin, CatalogEstimateMixin, scrapy.Spider):
     name = "arket_spider"
     allowed_domains = ["www.arket.com"]
 
@@ -34,10 +44,38 @@ class ArketSpiderSpider(scrapy.Spider):
         ('kr', 'KRW', 'ko', 'https://www.arket.com/ko-kr/index.html')
     ]
 
+    # hosts downloaded over HTTP/2 with HTTP2_ENABLED (see http2.py): the
+    # pda/changeItemInfo.html requests of every colour
+    http2_domains = ["www.arket.com"]
+
+    # routes with their own circuit with CIRCUIT_BREAKER_ENABLED (see crawlkit/breaker.py)
+    circuit_breaker_routes = [
+        ('add_items', r'/dpa/ctgrListAddItem\.html$'),
+        ('item_info', r'/pda/changeItemInfo\.html$'),
+    ]
+
+    # callbacks of the product pages and their colour JSON, served before
+    # discovery by backpressure.BackpressureScheduler
+    detail_callbacks = ("parse_color", "parse_detail")
+
+    # item classes, switched to the slotted variants by COMPACT_ITEMS
+    product_item = ProductItem
+    size_item = SizeItem
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.product_item, spider.size_item = item_classes(crawler.settings)
+        spider.setup_nav_cache(crawler)
+        spider.setup_catalog_estimate(crawler)
+        return spider
+
     def start_requests(self):
-        country_info = self.countries_info[0]
-        country, currency, language, home_url  = country_info
-        yield scrapy.Request(home_url, self.parse_homepage, meta={'country': country, 'currency': currency, 'language': language})
+        for country_info in self.selected_countries():
+            home_url = country_info[3]
+            yield from self.cached_nav_requests(country_info[0], self.country_meta(country_info))
+            # the nav is walked in any case, it revalidates the cached tree
+            yield scrapy.Request(home_url, self.parse_homepage, meta=self.country_meta(country_info))
     
     def parse_homepage(self, response):
         for level1 in response.css("div.category-wrapper"):
@@ -57,9 +95,16 @@ class ArketSpiderSpider(scrapy.Spider):
     def make_nav_request(self, response, categories, url):
         meta = copy.deepcopy(response.meta)
         meta['categories'] = categories
+        self.record_nav(response.meta['country'], categories, response.urljoin(url))
         return response.follow(url, self.parse_products, meta=meta)
     
     def parse_products(self, response):
+        if self.catalog_estimate is not None:
+            total_cnt = response.css('input[name="totalCnt"]::attr(value)').get()
+            page_size = response.css('input[name="pageSize"]::attr(value)').get()
+            yield from self.estimate_from_total(response, response.meta['country'], response.meta['categories'],
+                                                int(total_cnt or 0), int(page_size or 0))
+            return
         product_urls = response.css('.o-product > a::attr(href)').getall()
         for url in product_urls:
             yield Request(urljoin(response.url, url), self.parse_color, meta=response.meta)
@@ -74,12 +119,12 @@ class ArketSpiderSpider(scrapy.Spider):
         sec_id = response.css('form [name="sectId"]::attr(value)').get()
         for clr in response.css("div.color-swatch-container div.js-swatch"):
             clr_id = clr.css("a.colorLink::attr(data-slitm-cd)").get()
-            clr_url = f"https://www.arket.com/ko-kr/pda/changeItemInfo.html?slitmCd={clr_id}&sectId={sec_id}&preview=false"
+            clr_url = self.locale_url(response, f"pda/changeItemInfo.html?slitmCd={clr_id}&sectId={sec_id}&preview=false")
             yield response.follow(clr_url, self.parse_detail, meta=response.meta)
 
     def parse_detail(self, response):
-        product = ProductItem()
-        product_data = response.json()
+        product = self.product_item()
+        product_data = codec.response_json(response)
         product['url'] = self.get_url(response)
         product['country_code'] = self.get_country_code(response)
         product['language_code'] = self.get_language_code(response)
@@ -124,7 +169,7 @@ class ArketSpiderSpider(scrapy.Spider):
         pagination_links = []
         for page_num in range(2, num_pages + 1):
             new_view_cnt = page_size * (page_num - 1)
-            pagination_link = f"https://www.arket.com/ko-kr/dpa/ctgrListAddItem.html?sect_id={sect_id}&pageNum={page_num}&viewCnt={new_view_cnt}&totalCnt={total_cnt}&pageSize={page_size}"
+            pagination_link = self.locale_url(response, f"dpa/ctgrListAddItem.html?sect_id={sect_id}&pageNum={page_num}&viewCnt={new_view_cnt}&totalCnt={total_cnt}&pageSize={page_size}")
             pagination_links.append(pagination_link)
         return pagination_links
     
@@ -155,7 +200,7 @@ class ArketSpiderSpider(scrapy.Spider):
     def get_sizes(self, product_data):
         sizes_info = []
         for size_value in product_data['sizeAndStockBySlitmCdList'][0]['sizeAndStockVOList']:
-                size = SizeItem()
+                size = self.size_item()
                 size['size_name'] = size_value['u2aNm']
                 size['stock'] = 1 if size_value['stockCount'] > 0 else 0
                 sizes_info.append(size)
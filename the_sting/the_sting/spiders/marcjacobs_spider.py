@@ -2,11 +2,17 @@
 This Scrapy spider crawls marcjacobs.com to extract product information including brand, title, price, colors, sizes, and images. 
 It handles proxy usage, and avoids overwhelming the website with a configurable download delay.
 
+Every country of `countries_info` is crawled in the same run, each in its own download slot
+(see `CountriesMixin`). With NAV_CACHE_ENABLED the listings of the last crawl's nav tree are
+requested right away (see `NavCacheMixin`). With CATALOG_ESTIMATE only listing pages are crawled,
+probing the spinner paging for the size of every category (see `CatalogEstimateMixin`).
+
 Methods:
-    start_requests: Generates initial requests.
+    start_requests: Generates initial requests, one per configured country, and the cached listings.
     parse_homepage: Extracts top-level and sub-level categories.
     make_nav_request: Constructs requests to navigate to sub-category pages.
     parse_products: Extracts product URLs and pagination links of a specific category.
+    estimate_tiles, estimate_page_url: Listing tiles and paging for the CATALOG_ESTIMATE mode.
     parse_color: Extracts color-specific product data.
     parse_detail: Extracts detailed product information and yield it.
 """
@@ -16,11 +22,17 @@ from urllib.parse import urljoin
 
 import scrapy
 from scrapy import Request
+from w3lib.url import add_or_replace_parameter
+
+from crawlkit import codec
+from crawlkit.estimate import CatalogEstimateMixin
+from crawlkit.items import ProductItem, SizeItem, item_classes
+from crawlkit.navcache import NavCacheMixin
 
-from ..items import ProductItem, SizeItem
+from ..countries import CountriesMixin
 
 
-class MarcjacobsSpiderSpider(scrapy.Spider):
+class MarcjacobsSpiderSpider(CountriesMixin, NavCacheMixin, CatalogEstimateMixin, scrapy.Spider):
     name = "marcjacobs_spider"
     allowed_domains = ["marcjacobs.com"]
     start_urls = ["https://marcjacobs.com/"]
@@ -33,15 +45,39 @@ class MarcjacobsSpiderSpider(scrapy.Spider):
         'ROBOTSTXT_OBEY' : False
     }
 
+    # hosts downloaded over HTTP/2 with HTTP2_ENABLED (see http2.py): the
+    # variation JSON requests of every product
+    http2_domains = ["marcjacobs.com"]
+
+    # routes with their own circuit with CIRCUIT_BREAKER_ENABLED (see crawlkit/breaker.py)
+    circuit_breaker_routes = [
+        ('variation', r'/Product-Variation$'),
+    ]
+
+    # callbacks of the product pages and their variation JSON, served before
+    # discovery by backpressure.BackpressureScheduler
+    detail_callbacks = ("parse_color", "parse_detail")
+
+    # item classes, switched to the slotted variants by COMPACT_ITEMS
+    product_item = ProductItem
+    size_item = SizeItem
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.product_item, spider.size_item = item_classes(crawler.settings)
+        spider.setup_nav_cache(crawler)
+        spider.setup_catalog_estimate(crawler)
+        return spider
+
     def start_requests(self):
-        country_info = self.countries_info[0]
-        country, currency, language, home_url = country_info
-        categories = []
-        yield Request(
-            home_url,
-            self.parse_homepage,
-            meta={'country': country, 'currency': currency, 'language': language, 'categories': categories}
-        )
+        for country_info in self.selected_countries():
+            home_url = country_info[3]
+            meta = self.country_meta(country_info)
+            meta['categories'] = []
+            yield from self.cached_nav_requests(country_info[0], meta)
+            # the nav is walked in any case, it revalidates the cached tree
+            yield Request(home_url, self.parse_homepage, meta=meta)
 
     def parse_homepage(self, response):
         for level1 in response.css('.nav-modal__sub-list li.navL1'):
@@ -55,9 +91,15 @@ class MarcjacobsSpiderSpider(scrapy.Spider):
     def make_nav_request(self, response, categories, url):
         meta = copy.deepcopy(response.meta)
         meta['categories'] = categories
+        self.record_nav(response.meta['country'], categories, response.urljoin(url))
         return response.follow(url, self.parse_products, meta=meta)
 
     def parse_products(self, response):
+        if self.catalog_estimate is not None:
+            next_page_url = response.css('.spinner::attr(data-url)').get()
+            yield from self.estimate_by_probing(response, response.meta['country'], response.meta['categories'],
+                                                response.urljoin(next_page_url) if next_page_url else None)
+            return
         product_urls = response.css('.product-grid__list-element .lockup-card::attr(href), .product-grid__list-element .plp-card::attr(href)').getall()
         for url in product_urls:
             yield Request(urljoin(response.url, url), self.parse_color, meta=response.meta)
@@ -66,6 +108,14 @@ class MarcjacobsSpiderSpider(scrapy.Spider):
         if next_page_url:
             yield response.follow(next_page_url, self.parse_products, meta=response.meta)
 
+    def estimate_tiles(self, response):
+        return response.css('.product-grid__list-element .lockup-card::attr(href), .product-grid__list-element .plp-card::attr(href)').getall()
+
+    def estimate_page_url(self, next_url, page, page_size):
+        # the spinner pages by product offset
+        url = add_or_replace_parameter(next_url, 'start', str((page - 1) * page_size))
+        return add_or_replace_parameter(url, 'sz', str(page_size))
+
     def parse_color(self, response):
         colors = response.css('div.swiper-wrapper input.colorDrawer__item-radio, li.heaven-color__item-container picture')
         if colors:
@@ -77,12 +127,13 @@ class MarcjacobsSpiderSpider(scrapy.Spider):
                     'currency': response.meta['currency'],
                     'language': response.meta['language'],
                     'categories': response.meta['categories'],
-                    'color_label': color_label
+                    'color_label': color_label,
+                    'download_slot': response.meta['download_slot']
                 })
 
     def parse_detail(self, response):
-        product = ProductItem()
-        product_data = response.json()['product']
+        product = self.product_item()
+        product_data = codec.response_json(response)['product']
         product['country_code'] = response.meta['country']
         product['language_code'] = response.meta['language']
         product['currency'] = response.meta['currency']
@@ -116,7 +167,7 @@ class MarcjacobsSpiderSpider(scrapy.Spider):
         sizes = [attr['values'] for attr in product_data['variationAttributes'] if attr["attributeId"] == "size"]
         for size_values in sizes:
             for size_value in size_values:
-                size = SizeItem()
+                size = self.size_item()
                 size['size_name'] = size_value['displayValue']
                 size['stock'] = 1 if size_value['selectable'] else 0
                 sizes_info.append(size)
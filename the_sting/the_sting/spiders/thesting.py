@@ -3,14 +3,29 @@ Spider for scraping product information from The Sting website.
 
 This spider navigates through the categories of The Sting website to extract details of various products including their title, category, URL, images, description, and pricing information.
 
+Every country of `countries_info` is crawled in the same run, each in its own download slot (see `CountriesMixin`).
+Countries whose main categories match a country already being crawled reuse its sub-navigation pages.
+With SITEMAP_DISCOVERY the product pages are requested from the sitemap instead (see `SitemapDiscoveryMixin`).
+With NAV_CACHE_ENABLED the listings of the last crawl's nav tree are requested right away (see `NavCacheMixin`).
+With CATALOG_ESTIMATE only listing pages are crawled, to estimate the size of every category (see `CatalogEstimateMixin`).
+With EXTRACTION_CACHE_ENABLED product pages parsed before get their items from the cache (see `ExtractionCacheMixin`).
+
 Methods:
-    start_requests(self): Generates initial requests to start crawling.
-    parse_homepage(self, response): Parses the homepage to extract main categories and initiate category parsing.
+    start_requests(self): Generates initial requests to start crawling, one per configured country, the cached listings (NAV_CACHE_ENABLED) and the sitemap requests (SITEMAP_DISCOVERY).
+    parse_homepage(self, response): Parses the homepage to extract main categories and initiate category parsing, or joins the nav tree of a country with the same categories.
     parse_sub_nav(self, response): Parses sub-navigation menu to extract sub-categories and initiate product parsing.
     make_nav_request(self, response, categories, url): Constructs and returns a request object with updated metadata.
-    parse_products(self, response): Parses product pages to extract product URLs and initiate product detail parsing.
+    share_nav_request(self, response, categories, url): Sends a discovered listing to the countries sharing the nav tree.
+    parse_products(self, response): Parses product pages to extract product URLs and initiate product detail parsing, or probes the number of pages (CATALOG_ESTIMATE).
+    estimate_tiles(self, response): Returns the product URLs of a listing page (CATALOG_ESTIMATE).
+    estimate_page_url(self, next_url, page, page_size): Returns the URL of a page of a listing (CATALOG_ESTIMATE).
+    refresh_tile(self, response, tile, url, meta): Builds a partial item from a listing tile when its price matches the stored product, or requests the product page (LISTING_REFRESH).
+    sitemap_tile(self, response, url): Builds the partial item with the categories of a product requested from the sitemap (SITEMAP_DISCOVERY).
+    sitemap_product_meta(self, url): Returns the meta of the country of a product url found in the sitemap.
     parse_color(self, response): Parses product color variations and initiates product detail parsing for each variant individually.
-    parse_detail(self, response): Extract product detail.
+    color_requests(self, response): Generates the requests of the other colors of a product.
+    parse_detail(self, response): Extract product detail, in the worker processes with PARSE_OFFLOAD_ENABLED (see `ParseOffloadMixin`) or from the extraction cache.
+    extract_detail(self, response): Builds the product item of a product page.
 
 """
 
@@ -19,11 +34,22 @@ from urllib.parse import urljoin
 
 import scrapy
 from scrapy import Request
+from w3lib.url import add_or_replace_parameter
+
+from crawlkit.canonical import DEFAULT_URL_RULES, canonicalize, keep_params
+from crawlkit.estimate import CatalogEstimateMixin
+from crawlkit.extractcache import ExtractionCacheMixin
+from crawlkit.items import ProductItem, SizeItem, item_classes
+from crawlkit.navcache import NavCacheMixin
+from crawlkit.offload import ParseOffloadMixin, chain_output
+from crawlkit.sitemaps import SitemapDiscoveryMixin
 
-from ..items import ProductItem, SizeItem
+from ..countries import CountriesMixin
+from ..refresh import ProductStore
 
 
-class ThestingSpider(scrapy.Spider):
+class ThestingSpider(CountriesMixin, SitemapDiscoveryMixin, ExtractionCacheMixin, ParseOffloadMixin, NavCacheMixin,
+                     CatalogEstimateMixin, scrapy.Spider):
     name = "thesting"
     allowed_domains = ["www.thesting.com"]
     start_urls = ["https://www.thesting.com/nl-nl"]
@@ -33,15 +59,97 @@ class ThestingSpider(scrapy.Spider):
         ('nl', 'EUR', 'nl', 'https://www.thesting.com/nl-nl')
     ]
 
+    # callbacks of the product pages, served before discovery by
+    # backpressure.BackpressureScheduler
+    detail_callbacks = ('parse_color', 'parse_detail')
+
+    # meta keys extract_detail reads, sent with the body to the parse workers
+    # and part of the extraction cache key
+    offload_meta = ('country', 'language', 'currency', 'categories')
+
+    # item classes, switched to the slotted variants by COMPACT_ITEMS
+    product_item = ProductItem
+    size_item = SizeItem
+
+    # stored products (refresh.ProductStore) in the LISTING_REFRESH mode
+    product_store = None
+
+    # product pages listed in the sitemap, in the SITEMAP_DISCOVERY mode
+    sitemap_urls = ['https://www.thesting.com/sitemap.xml']
+    sitemap_product_pattern = r'/p/[^/]+\.html$'
+    sitemap_callback = 'parse_color'
+
+    # URL canonicalization (see crawlkit/canonical.py): every colour has its own product
+    # page, so the query of tile and swatch links is dropped on product URLs
+    canonical_url_rules = DEFAULT_URL_RULES + [keep_params(path=r'/p/[^/]+\.html$')]
+
+    # Early-abort downloads (see crawlkit/streaming.py, EARLY_ABORT_ENABLED): everything
+    # the product page callbacks read is above the footer
+    early_abort_limits = {
+        'parse_color': {'until': b'<footer', 'max_bytes': 512 * 1024},
+        'parse_detail': {'until': b'<footer', 'max_bytes': 512 * 1024},
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # main category structure -> nav tree discovered by the first country having it
+        self.nav_trees = {}
+        # country doing the sub-nav discovery -> its nav tree
+        self.country_trees = {}
+        # (country, canonical product url) of the listing tiles seen in the LISTING_REFRESH and SITEMAP_DISCOVERY modes
+        self.listed_urls = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.product_item, spider.size_item = item_classes(crawler.settings)
+        # stored products, only read in the listing refresh mode
+        spider.product_store = ProductStore.from_settings(crawler.settings) if crawler.settings.getbool('LISTING_REFRESH') else None
+        spider.sitemap_settings(crawler.settings)
+        spider.setup_parse_pool(crawler)
+        spider.setup_extraction_cache(crawler)
+        spider.setup_nav_cache(crawler)
+        spider.setup_catalog_estimate(crawler)
+        return spider
+
+    def closed(self, reason):
+        if self.product_store is not None:
+            self.product_store.close()
+
     def start_requests(self):
-        country_info = self.countries_info[0]
-        country, currency, language, home_url  = country_info
-        yield scrapy.Request(home_url, self.parse_homepage, meta={'country': country, 'currency': currency, 'language': language})
+        # the sitemap only lists product pages, which the estimation skips
+        if self.sitemap_discovery and self.catalog_estimate is None:
+            yield from self.sitemap_requests()
+            if not self.sitemap_categories:
+                return
+        for country_info in self.selected_countries():
+            home_url = country_info[3]
+            meta = self.country_meta(country_info)
+            yield from self.cached_nav_requests(country_info[0], dict(meta, stats_product_count={}))
+            # the nav is walked in any case, it revalidates the cached tree
+            yield scrapy.Request(home_url, self.parse_homepage, meta=meta)
 
     def parse_homepage(self, response):
         main_categories = response.css('div.header__menu-secondary[data-category]::attr(data-category)').getall()
         main_categories_url = response.css("div.header__menu-navigation a::attr(href)").getall()
-        
+
+        home_url = self.home_url(response.meta['country'])
+        signature = tuple((category, self.nav_path(home_url, response.urljoin(category_url)))
+                          for category, category_url in zip(main_categories, main_categories_url))
+        tree = self.nav_trees.get(signature)
+        if tree is not None:
+            # Same categories as a country that is already discovered: reuse its
+            # sub-nav pages instead of fetching them again for this locale
+            follower = {key: response.meta[key] for key in ('country', 'currency', 'language', 'download_slot')}
+            follower['stats_product_count'] = {}
+            tree['followers'].append(follower)
+            self.crawler.stats.inc_value('thesting/nav_tree_shared_countries')
+            for categories, path in tree['listings']:
+                yield self.make_shared_nav_request(follower, categories, path)
+            return
+        tree = {'home_url': home_url, 'listings': [], 'followers': []}
+        self.nav_trees[signature] = self.country_trees[response.meta['country']] = tree
+
         for category , category_url in zip(main_categories, main_categories_url):
             categories = []
             stats_product_count = {}
@@ -52,6 +160,7 @@ class ThestingSpider(scrapy.Spider):
             meta = {'country': response.meta['country'], 
                 'currency': response.meta['currency'], 
                 'language': response.meta['language'], 
+                'download_slot': response.meta['download_slot'],
                 'categories': categories,
                 'stats_product_count': stats_product_count
                 }
@@ -63,6 +172,7 @@ class ThestingSpider(scrapy.Spider):
             url2 = level1.attrib['href']
             cat2 = level1.css('::text').get()
             yield self.make_nav_request(response, [cat1, cat2], url2)
+            yield from self.share_nav_request(response, [cat1, cat2], url2)
 
             for level2 in level1.css('a + div .header__menu-flyout-navigation-wrapper'):
                 cat3 = level2.css('.header__menu-flyout-navigation-label::text').get().strip()
@@ -71,42 +181,150 @@ class ThestingSpider(scrapy.Spider):
                     cat4 = level3.css('span::text').get()
                     url4 = level3.attrib['href']
                     yield self.make_nav_request(response, [cat1, cat2,cat3,cat4], url4)
+                    yield from self.share_nav_request(response, [cat1, cat2,cat3,cat4], url4)
                 
     def make_nav_request(self, response, categories, url):
         meta = copy.deepcopy(response.meta)
         meta['categories'] = categories
+        self.record_nav(response.meta['country'], categories, response.urljoin(url))
         return response.follow(url, self.parse_products, meta=meta)
 
+    def nav_path(self, home_url, url):
+        # locale independent part of a nav url, e.g. /dames/jeans for https://www.thesting.com/nl-nl/dames/jeans
+        return url[len(home_url):] if url.startswith(home_url) else url
+
+    def share_nav_request(self, response, categories, url):
+        # Record a listing found by the discovering country and send it to the
+        # countries sharing its nav tree
+        tree = self.country_trees.get(response.meta['country'])
+        if tree is None:
+            return
+        path = self.nav_path(tree['home_url'], response.urljoin(url))
+        tree['listings'].append((categories, path))
+        for follower in tree['followers']:
+            yield self.make_shared_nav_request(follower, categories, path)
+
+    def make_shared_nav_request(self, follower, categories, path):
+        meta = copy.deepcopy(follower)
+        meta['categories'] = categories
+        url = path if '://' in path else self.home_url(follower['country']) + path
+        self.record_nav(follower['country'], categories, url)
+        return Request(url, self.parse_products, meta=meta)
+
     def parse_products(self,response):
-        product_urls = response.css('div.product a.product-tile__link::attr(href)').getall()
+        if self.catalog_estimate is not None:
+            next_page_url = response.css("a.pagination__action--next::attr(href)").get()
+            yield from self.estimate_by_probing(
+                response, response.meta['country'], response.meta['categories'],
+                response.urljoin(next_page_url) if next_page_url and next_page_url != '#' else None)
+            return
+        tiles = [tile for tile in response.css('div.product') if tile.css('a.product-tile__link::attr(href)').get()]
         stats_product_count = response.meta.get('stats_product_count') 
         key = '/'.join(response.meta['categories'])
         stats_product_count.setdefault(key, 0)
-        stats_product_count[key] += len(product_urls)  
+        stats_product_count[key] += len(tiles)  
         meta = copy.deepcopy(response.meta)
         meta['stats_product_count'] = stats_product_count
-        for url in product_urls:
-            yield Request(urljoin(response.url, url), self.parse_color, meta=meta)
+        for tile in tiles:
+            url = urljoin(response.url, tile.css('a.product-tile__link::attr(href)').get())
+            if self.listed_in_sitemap(canonicalize(url, self.canonical_url_rules)):
+                yield from self.sitemap_tile(response, url)
+            elif self.product_store is not None:
+                yield from self.refresh_tile(response, tile, url, meta)
+            else:
+                yield Request(url, self.parse_color, meta=meta)
 
         next_page_url = response.css("a.pagination__action--next::attr(href)").get()
         if next_page_url and next_page_url != '#':
             yield response.follow(next_page_url, self.parse_products, meta=meta)
 
+    def estimate_tiles(self, response):
+        return [response.urljoin(url) for url in response.css('div.product a.product-tile__link::attr(href)').getall()]
+
+    def estimate_page_url(self, next_url, page, page_size):
+        return add_or_replace_parameter(next_url, 'page', str(page))
+
+    def refresh_tile(self, response, tile, url, meta):
+        # Partial item with the tile prices, or the product page request when
+        # the product is new or its price changed. The tile has no stock, the
+        # stored size_infos are kept (see refresh.py)
+        url = canonicalize(url, self.canonical_url_rules)
+        if (response.meta['country'], url) in self.listed_urls:
+            # listed in another category too, the first listing wins like in a full crawl
+            return
+        self.listed_urls.add((response.meta['country'], url))
+        stored = self.product_store.get(url, response.meta['country'])
+        if stored is None:
+            self.crawler.stats.inc_value('refresh/new_products')
+            yield Request(url, self.parse_color, meta=meta)
+            return
+        old_price = tile.css("data.product-tile__price::text").get()
+        new_price = tile.css("data.product-tile__price--is-on-sale::text").get() or old_price
+        if not self.product_store.same_prices(stored, old_price, new_price):
+            self.crawler.stats.inc_value('refresh/changed_products')
+            yield Request(url, self.parse_color, meta=meta)
+            return
+        self.crawler.stats.inc_value('refresh/listing_items')
+        product = self.product_item()
+        product['url'] = url
+        product['country_code'] = response.meta['country']
+        product['language_code'] = response.meta['language']
+        product['currency'] = response.meta['currency']
+        product['category_names'] = response.meta['categories']
+        product['old_price_text'] = old_price
+        product['new_price_text'] = new_price
+        yield product
+
+    def sitemap_tile(self, response, url):
+        # The product page is requested from the sitemap, the listing only
+        # adds the categories
+        url = canonicalize(url, self.canonical_url_rules)
+        if (response.meta['country'], url) in self.listed_urls:
+            return
+        self.listed_urls.add((response.meta['country'], url))
+        self.crawler.stats.inc_value('sitemap/category_items')
+        product = self.product_item()
+        product['url'] = url
+        product['country_code'] = response.meta['country']
+        product['category_names'] = response.meta['categories']
+        yield product
+
+    def sitemap_product_meta(self, url):
+        # the country whose home url the product url starts with, products of
+        # the countries that are not crawled are skipped
+        for country_info in self.selected_countries():
+            if url.startswith(country_info[3] + '/'):
+                return self.country_meta(country_info)
+        return None
+
     def parse_color(self, response):
-        yield from self.parse_detail(response)
+        return chain_output(self.parse_detail(response), self.color_requests(response))
+
+    def color_requests(self, response):
         for clr_url in response.css(".c-color-swatches a::attr(href)").getall():
+            # when refreshing, the colours that are stored come with their own listing tile
+            color_url = canonicalize(response.urljoin(clr_url), self.canonical_url_rules)
+            if self.product_store is not None and self.product_store.get(color_url, response.meta['country']):
+                continue
+            # colours in the sitemap are requested from it
+            if self.listed_in_sitemap(color_url):
+                continue
             yield response.follow(clr_url, self.parse_detail, meta=response.meta)
 
+    def parse_detail(self, response):
+        return self.offload(response, 'extract_detail')
 
-    def parse_detail(self, response):  
-        product = ProductItem()
+    def extract_detail(self, response):
+        product = self.product_item()
         product['url'] = response.url
         product['country_code'] = response.meta['country']
         product['language_code'] = response.meta['language']
         product['currency'] = response.meta['currency']
         product['title'] = self.get_title(response)
         product['brand'] = self.get_brand(response)
-        product['category_names'] = response.meta['categories']
+        # products requested from the sitemap get their categories from a listing item
+        if 'categories' in response.meta:
+            product['category_names'] = response.meta['categories']
         product['description_text'] = self.get_description(response)
         product['color_name'] = self.get_color_name(response)
         product['image_urls'] = self.get_img(response)
@@ -135,7 +353,7 @@ class ThestingSpider(scrapy.Spider):
         sizes_info = []
 
         for size_element in response.css(".c-product-detail-aside span.radio__size-value"):
-            size = SizeItem()
+            size = self.size_item()
             size['size_name'] = size_element.css("::text").get().strip()
             size['stock'] = 0 if size_element.xpath("following-sibling::span[@class='radio__size-label']") else 1
             sizes_info.append(size)